@@ -0,0 +1,289 @@
+""" Run ``git feature``, ``git bug`` and ``git finish`` end to end against a
+local fake Tracker, in a scratch repository with many branches.
+
+    $ python benchmarks/bench_commands.py [--stories 100,1000,10000,100000]
+          [--branches 1000] [--latency 20] [--repeat 3]
+
+Each command runs in a fresh interpreter, as it would from the console
+scripts, with its requests sent to the fake server rather than Tracker. For
+each backlog size the best wall time of ``--repeat`` runs is reported along
+with that run's request count, bytes sent and received, and peak RSS.
+
+The fake serves the v3 story listing (with filters, ``limit`` and
+``offset``), single story, story update and notes endpoints from an in
+memory backlog. pivotal-py must be installed.
+"""
+
+import os
+import sys
+import time
+import shlex
+import shutil
+import optparse
+import tempfile
+import threading
+import subprocess
+from urlparse import urlsplit, parse_qs
+from xml.etree import cElementTree as etree
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bushy.tests.fakeserver import FakeServer
+
+PROJECT_ID = 1
+FULL_NAME = 'Mr Bench'
+
+STORY = '''\
+<story>
+  <id type="integer">%(id)s</id>
+  <project_id type="integer">%(project_id)s</project_id>
+  <story_type>%(story_type)s</story_type>
+  <url>http://www.pivotaltracker.com/story/show/%(id)s</url>
+  <estimate type="integer">2</estimate>
+  <current_state>%(current_state)s</current_state>
+  <description>Description of story %(id)s</description>
+  <name>Story %(id)s</name>
+  <requested_by>Mr Requester</requested_by>
+  <owned_by>%(owned_by)s</owned_by>
+  <created_at type="datetime">2011/07/08 12:00:00 UTC</created_at>
+  <updated_at type="datetime">2011/07/09 13:30:00 UTC</updated_at>
+</story>'''
+
+FILTER_FIELDS = {'state': 'current_state',
+                 'type': 'story_type',
+                 'owned_by': 'owned_by',
+                 }
+
+
+class FakeTracker(object):
+    """ An in memory backlog served over HTTP. Stories are in priority
+        order by id: two in three are features, one in four is accepted and
+        the rest unstarted.
+    """
+
+    def __init__(self, count, latency=0):
+        self.stories = []
+        self.by_id = {}
+        for i in xrange(1, count + 1):
+            story = {'id': i,
+                     'project_id': PROJECT_ID,
+                     'story_type': i % 3 and 'feature' or 'bug',
+                     'current_state': i % 4 and 'unstarted' or 'accepted',
+                     'owned_by': '',
+                     }
+            self.stories.append(story)
+            self.by_id[i] = story
+        self.server = FakeServer()
+        self.server.delay = latency
+        self.server.default = self.respond
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.bytes_in = 0
+            self.bytes_out = 0
+
+    def start(self):
+        self.server.start()
+        return self
+
+    def stop(self):
+        self.server.stop()
+
+    @property
+    def netloc(self):
+        return urlsplit(self.server.url).netloc
+
+    def render(self, story):
+        values = dict(story)
+        values['owned_by'] = escape(story['owned_by'])
+        return STORY % values
+
+    def respond(self, request):
+        method, path, headers, body = request
+        status, content = self.route(method, path, body)
+        with self._lock:
+            self.requests += 1
+            # what the client sent and received, bodies only
+            self.bytes_out += len(body)
+            self.bytes_in += len(content)
+        return status, {'Content-Type': 'application/xml'}, content
+
+    def route(self, method, path, body):
+        url = urlsplit(path)
+        parts = url.path.strip('/').split('/')
+        # services/v3/projects/<id>/stories[/<id>[/notes]]
+        if parts[2:5:2] != ['projects', 'stories']:
+            return 404, '<error/>'
+        if len(parts) == 5:
+            return 200, self.listing(parse_qs(url.query))
+        story = self.by_id.get(int(parts[5]))
+        if story is None:
+            return 404, '<error/>'
+        if len(parts) == 7 and method == 'POST':
+            return 200, '<note><id>1</id><text>%s</text></note>' % escape(etree.fromstring(body).findtext('text'))
+        if method == 'PUT':
+            with self._lock:
+                for child in etree.fromstring(body):
+                    if child.tag in FILTER_FIELDS.values():
+                        story[child.tag] = child.text or ''
+        return 200, self.render(story)
+
+    def listing(self, query):
+        tests = []
+        ids = None
+        for term in shlex.split(query.get('filter', [''])[0]):
+            key, _, value = term.partition(':')
+            if key == 'id':
+                ids = set(int(v) for v in value.split(','))
+            elif key in FILTER_FIELDS:
+                tests.append((FILTER_FIELDS[key], set(value.split(','))))
+        offset = int(query.get('offset', ['0'])[0])
+        limit = int(query.get('limit', [len(self.stories)])[0])
+        matches = []
+        for story in self.stories:
+            if ids is not None and story['id'] not in ids:
+                continue
+            if [field for field, values in tests if story[field] not in values]:
+                continue
+            matches.append(story)
+            if len(matches) >= offset + limit:
+                break
+        page = matches[offset:offset + limit]
+        return '<stories type="array" count="%s">%s</stories>' % (
+            len(page), ''.join(self.render(story) for story in page))
+
+
+# run in each command's interpreter: every request goes to the fake
+# tracker, whichever host it was addressed to
+DRIVER = '''\
+import atexit, sys
+def peak_rss():
+    # VmHWM starts again from the exec, whereas ru_maxrss would include the
+    # benchmark's own memory from before it
+    try:
+        for line in open('/proc/self/status'):
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    except IOError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+# reported on exit, as the commands may leave through SystemExit
+atexit.register(lambda: sys.stderr.write('\\nrss:%%s\\n' %% peak_rss()))
+sys.argv = %(argv)r
+import bushy.transport
+client = bushy.transport.get_client()
+send = client._send
+client._send = lambda scheme, netloc, path, *args, **kw: send('http', %(netloc)r, path, *args, **kw)
+from bushy.scripts import %(command)s
+sys.exit(%(command)s())
+'''
+
+COMMANDS = [('feature', ['git-feature', '-q']),
+            ('bug', ['git-bug', '-q']),
+            ('finish', ['git-finish', '-q']),
+            ]
+
+
+def git(repo, *args):
+    subprocess.check_call(['git'] + list(args), cwd=repo,
+                          stdout=open(os.devnull, 'w'))
+
+
+def make_repository(path, branches):
+    """ A repository with one commit and ``branches`` packed branches, half
+        of them named for stories.
+    """
+    git(path, 'init', '-q')
+    config = [('bushy.platform', 'pivotal'),
+              ('bushy-pivotal.api-token', 'token'),
+              ('bushy-pivotal.project-id', str(PROJECT_ID)),
+              ('bushy-pivotal.full-name', FULL_NAME),
+              ('user.name', FULL_NAME),
+              ('user.email', 'bench@example.com'),
+              ]
+    for key, value in config:
+        git(path, 'config', key, value)
+    git(path, 'commit', '-q', '--allow-empty', '-m', 'Initial commit')
+    sha = subprocess.Popen(['git', 'rev-parse', 'HEAD'], cwd=path,
+                           stdout=subprocess.PIPE).communicate()[0].strip()
+    names = sorted('%s-old' % (i * 4) if i % 2 else 'topic-%s' % i
+                   for i in xrange(1, branches + 1))
+    f = open(os.path.join(path, '.git', 'packed-refs'), 'a')
+    try:
+        for name in names:
+            f.write('%s refs/heads/%s\n' % (sha, name))
+    finally:
+        f.close()
+
+
+def run_command(code, cwd, env):
+    """ Run ``code`` in a new interpreter, returning its exit status, wall
+        time and peak RSS in KB.
+    """
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=cwd, env=env,
+                            stdin=open(os.devnull), stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    elapsed = time.time() - start
+    rss = [int(line[4:]) for line in err.splitlines() if line.startswith('rss:')]
+    if proc.returncode:
+        sys.stderr.write(out + err)
+    return proc.returncode, elapsed, rss and rss[-1] or 0
+
+
+def bench(count, options, env):
+    best = {}
+    for i in range(options.repeat):
+        tracker = FakeTracker(count, options.latency / 1000.0).start()
+        repo = tempfile.mkdtemp()
+        try:
+            make_repository(repo, options.branches)
+            for name, argv in COMMANDS:
+                tracker.reset()
+                code = DRIVER % {'argv': argv, 'netloc': tracker.netloc, 'command': name}
+                status, elapsed, rss = run_command(code, repo, env)
+                if status:
+                    raise RuntimeError('%s failed with status %s' % (' '.join(argv), status))
+                result = (elapsed, tracker.requests, tracker.bytes_out, tracker.bytes_in, rss)
+                if name not in best or elapsed < best[name][0]:
+                    best[name] = result
+        finally:
+            tracker.stop()
+            shutil.rmtree(repo)
+    return best
+
+
+def main():
+    parser = optparse.OptionParser(description=__doc__)
+    parser.add_option('--stories', default='100,1000,10000,100000', help='Comma separated backlog sizes [%default]')
+    parser.add_option('--branches', type='int', default=1000, help='Branches in the scratch repository [%default]')
+    parser.add_option('--latency', type='float', default=20, help='Milliseconds the fake tracker waits before each response [%default]')
+    parser.add_option('--repeat', type='int', default=3, help='The number of timed runs (the best is reported)')
+    options, args = parser.parse_args()
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT, env.get('PYTHONPATH')]))
+    # keep the user's global settings and any running daemon out of it
+    env['HOME'] = env['XDG_RUNTIME_DIR'] = home = tempfile.mkdtemp()
+    env.pop('GIT_DIR', None)
+    try:
+        for count in [int(size) for size in options.stories.split(',')]:
+            print '%s stories, %s branches, %g ms latency (best of %s)' % (
+                count, options.branches, options.latency, options.repeat)
+            print '  %-8s %9s %9s %10s %10s %9s' % ('command', 'wall ms', 'requests', 'bytes out', 'bytes in', 'RSS KB')
+            best = bench(count, options, env)
+            for name, argv in COMMANDS:
+                elapsed, requests, bytes_out, bytes_in, rss = best[name]
+                print '  %-8s %9.1f %9d %10d %10d %9d' % (name, elapsed * 1000, requests, bytes_out, bytes_in, rss)
+    finally:
+        shutil.rmtree(home)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+""" Compare the single pass story parser against the original per-field
+``etree_*`` lookups on a large story listing, and the size and parse time of
+the same listing from the v3 XML and v5 JSON APIs.
+
+    $ python benchmarks/bench_parse.py [--stories 10000] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+import optparse
+from datetime import datetime
+from cStringIO import StringIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pivotal import anyetree
+from bushy._pivotal import parse_story, iterparse_stories, json_story, json_loads, DATETIME_FORMAT
+
+STORY = '''\
+<story>
+  <id type="integer">%(id)s</id>
+  <project_id type="integer">1</project_id>
+  <story_type>feature</story_type>
+  <url>http://www.pivotaltracker.com/story/show/%(id)s</url>
+  <estimate type="integer">2</estimate>
+  <current_state>unstarted</current_state>
+  <description>Description of story %(id)s</description>
+  <name>Story %(id)s</name>
+  <requested_by>Mr Requester</requested_by>
+  <owned_by>Mr Owner</owned_by>
+  <created_at type="datetime">2011/07/08 12:00:00 UTC</created_at>
+  <updated_at type="datetime">2011/07/09 13:30:00 UTC</updated_at>
+  <labels>one,two</labels>
+  <notes type="array">
+    <note>
+      <id type="integer">%(id)s</id>
+      <text>Note on story %(id)s</text>
+      <author>Mr Owner</author>
+      <noted_at type="datetime">2011/07/09 13:30:00 UTC</noted_at>
+    </note>
+  </notes>
+</story>'''
+
+
+# as returned for ``fields=`` V5_FIELDS with ``date_format=millis``
+JSON_STORY = ('{"kind":"story","id":%(id)s,"project_id":1,"story_type":"feature",'
+              '"url":"https://www.pivotaltracker.com/story/show/%(id)s","estimate":2,'
+              '"current_state":"unstarted","name":"Story %(id)s",'
+              '"description":"Description of story %(id)s",'
+              '"owners":[{"kind":"person","name":"Mr Owner"}],'
+              '"labels":[{"kind":"label","name":"one"},{"kind":"label","name":"two"}],'
+              '"comments":[{"kind":"comment","text":"Note on story %(id)s"}],'
+              '"created_at":1310126400000,"updated_at":1310218200000}')
+
+
+def make_listing(count):
+    stories = [STORY % {'id': i} for i in xrange(1, count + 1)]
+    return '<stories type="array" count="%s">%s</stories>' % (count, ''.join(stories))
+
+def make_json_listing(count):
+    return '[%s]' % ','.join([JSON_STORY % {'id': i} for i in xrange(1, count + 1)])
+
+
+# the helpers as they were before the single pass parser
+
+def legacy_text(etree, element):
+    if etree.find(element) is not None:
+        return etree.find(element).text
+    return ''
+
+def legacy_int(etree, element):
+    if etree.find(element) is not None:
+        return int(etree.find(element).text)
+    return 0
+
+def legacy_datetime(etree, element):
+    if etree.find(element) is not None:
+        return datetime.strptime(etree.find(element).text, DATETIME_FORMAT)
+    return None
+
+def legacy_notes(etree, element):
+    if etree.find(element) is not None:
+        return '\n'.join(note.find('text').text for note in etree.find(element))
+    return ''
+
+def legacy_parse_story(etree):
+    return {'id': legacy_int(etree, 'id'),
+            'project_id': legacy_int(etree, 'project_id'),
+            'story_type': legacy_text(etree, 'story_type'),
+            'url': legacy_text(etree, 'url'),
+            'estimate': legacy_int(etree, 'estimate'),
+            'current_state': legacy_text(etree, 'current_state'),
+            'description': legacy_text(etree, 'description'),
+            'name': legacy_text(etree, 'name'),
+            'requested_by': legacy_text(etree, 'requested_by'),
+            'owned_by': legacy_text(etree, 'owned_by'),
+            'labels': legacy_text(etree, 'labels'),
+            'notes': legacy_notes(etree, 'notes'),
+            'created_at': legacy_datetime(etree, 'created_at'),
+            'updated_at': legacy_datetime(etree, 'updated_at'),
+            }
+
+
+def best_of(repeat, func, *args):
+    timings = []
+    for i in range(repeat):
+        start = time.time()
+        func(*args)
+        timings.append(time.time() - start)
+    return min(timings)
+
+
+def main():
+    parser = optparse.OptionParser(description=__doc__)
+    parser.add_option('--stories', type='int', default=10000, help='The number of stories in the listing')
+    parser.add_option('--repeat', type='int', default=5, help='The number of timed runs (the best is reported)')
+    options, args = parser.parse_args()
+
+    listing = anyetree.etree.fromstring(make_listing(options.stories))
+    stories = listing.findall('story')
+
+    legacy = best_of(options.repeat, lambda: [legacy_parse_story(s) for s in stories])
+    current = best_of(options.repeat, lambda: [parse_story(s) for s in stories])
+
+    # both parsers must agree before their timings mean anything
+    for story in stories[:10]:
+        expected = legacy_parse_story(story)
+        record = parse_story(story)
+        assert dict(zip(record._fields, record)) == expected, story
+
+    print 'Parsed %s stories (best of %s)' % (options.stories, options.repeat)
+    print '  etree_* helpers: %8.1f ms' % (legacy * 1000)
+    print '  parse_story:     %8.1f ms' % (current * 1000)
+    print '  speedup:         %8.1fx' % (legacy / current)
+
+    xml = make_listing(options.stories)
+    json = make_json_listing(options.stories)
+    from_xml = best_of(options.repeat, lambda: list(iterparse_stories(StringIO(xml))))
+    from_json = best_of(options.repeat, lambda: [json_story(s) for s in json_loads(json)])
+
+    print
+    print 'Listing of %s stories (best of %s)' % (options.stories, options.repeat)
+    print '  v3 XML:  %8.1f KB %8.1f ms' % (len(xml) / 1024.0, from_xml * 1000)
+    print '  v5 JSON: %8.1f KB %8.1f ms' % (len(json) / 1024.0, from_json * 1000)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+""" Time how long the console scripts take to start for commands that never
+reach the tracker: ``--help`` and a missing ``bushy.platform`` setting.
+
+    $ python benchmarks/bench_startup.py [--repeat 10]
+
+Each run is a fresh interpreter in a scratch repository, compared against
+an interpreter which does nothing.
+"""
+
+import os
+import sys
+import time
+import shutil
+import optparse
+import tempfile
+import subprocess
+
+SCRIPT = '''\
+import atexit, sys
+# reported on exit, as --help and errors leave through SystemExit
+atexit.register(lambda: sys.stderr.write('\\nmodules:%%s pivotal:%%s\\n' %% (
+    len(sys.modules), 'pivotal' in sys.modules)))
+sys.argv = %(argv)r
+from bushy.scripts import %(command)s
+%(command)s()
+'''
+
+CASES = [('python (baseline)', 'pass', None),
+         ('git feature --help', SCRIPT % {'argv': ['git-feature', '--help'], 'command': 'feature'}, 'pivotal'),
+         ('git finish --help', SCRIPT % {'argv': ['git-finish', '--help'], 'command': 'finish'}, 'pivotal'),
+         ('no bushy.platform', SCRIPT % {'argv': ['git-feature'], 'command': 'feature'}, ''),
+         ]
+
+
+def run(code, cwd, env):
+    start = time.time()
+    proc = subprocess.Popen([sys.executable, '-c', code], cwd=cwd, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    elapsed = time.time() - start
+    stats = [line for line in err.splitlines() if line.startswith('modules:')]
+    return elapsed, stats and stats[-1] or ''
+
+
+def main():
+    parser = optparse.OptionParser(description=__doc__)
+    parser.add_option('--repeat', type='int', default=10, help='The number of timed runs (the best is reported)')
+    options, args = parser.parse_args()
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [root, env.get('PYTHONPATH')]))
+    # keep the user's global settings out of the measurements
+    env['HOME'] = tempdir = tempfile.mkdtemp()
+    env.pop('GIT_DIR', None)
+    try:
+        subprocess.check_call(['git', 'init', '-q', tempdir])
+        print 'Start up time (best of %s)' % options.repeat
+        for name, code, platform in CASES:
+            if platform is not None:
+                subprocess.check_call(['git', 'config', '-f', os.path.join(tempdir, '.git', 'config'),
+                                       'bushy.platform', platform])
+            timings = []
+            for i in range(options.repeat):
+                elapsed, stats = run(code, tempdir, env)
+                timings.append(elapsed)
+            print '  %-20s %8.1f ms  %s' % (name, min(timings) * 1000, stats)
+    finally:
+        shutil.rmtree(tempdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,41 @@
 """ Utilities for interfacing with a Pivotal Tracker project
 """
 
+import os
 import sys
 import optparse
-import httplib2
+import threading
+import subprocess
 from datetime import datetime
-from commands import getoutput
-from pivotal import Pivotal, anyetree
+from itertools import islice
+from collections import namedtuple
 from bushy.base import Base
+from bushy.cache import StoryCache, DEFAULT_TTL, DEFAULT_SIZE
+from bushy.outbox import Outbox
+from bushy.mirror import Mirror, Change
+from bushy.threads import Pool, background, DEFAULT_SIZE as DEFAULT_CONCURRENCY
+from bushy.trace import span
+from bushy.backlog import Backlog
+from bushy.index import SearchIndex
+
+# stories requested at a time when reading a whole listing
+DEFAULT_PAGE_SIZE = 100
+
+# activities requested when bringing the mirror up to date; more than this
+# since the last command and the mirror is rebuilt instead
+ACTIVITY_LIMIT = 100
+
+try:
+    # simplejson's C decoder is faster still where it is installed
+    from simplejson import loads as json_loads, dumps as json_dumps
+except ImportError:
+    from json import loads as json_loads, dumps as json_dumps
 
 __all__ = ['Bug',
            'Feature',
            'Finish',
+           'Search',
+           'Sync',
            ]
 
 class PivotalBase(Base):
@@ -24,123 +48,1041 @@ class PivotalBase(Base):
         parser.add_option('-b', '--integration-branch', dest='integration_branch', default='master', help='The branch to merge finished stories back down onto')
         parser.add_option('-m', '--only-mine', dest='only_mine', help='Only select Pivotal Tracker stories assigned to you')
         parser.add_option('-s', '--story', dest='target_story', help='Specify a story to work on (if applicable)')
+        parser.add_option('-i', '--interactive', action="store_true", dest='interactive', help='Search the backlog and choose a story (if applicable)')
         parser.add_option('-q', '--quiet', action="store_true", dest='quiet', help='Quiet, no-interaction mode')
         parser.add_option('-v', '--verbose', action="store_true", dest='verbose', help='Run verbosely')
+        parser.add_option('--no-cache', action="store_true", dest='no_cache', help='Ignore the local story cache')
+        parser.add_option('--profile', action="store_true", dest='profile', help='Print where the time went once the command has run')
         return parser
 
     def parse_gitconfig(self):
+        gitconfig = self.config
         config = {}
         keys = [
             'api-token',
             'project-id',
             'full-name',
             'integration-branch',
-            'only-mine'
+            'api-version',
             ]
         for key in keys:
-            val = getoutput('git config --get bushy-pivotal.%s' % key)
+            val = gitconfig.get('bushy-pivotal.%s' % key)
             if val:
                 config[key.replace('-', '_')] = val.strip()
-        if 'only_mine' in config:
-            config['only_mine'] = bool(config['only_mine'])
+        if 'bushy-pivotal.only-mine' in gitconfig:
+            config['only_mine'] = gitconfig.get_bool('bushy-pivotal.only-mine')
         return config
         
     _api = None
     @property
     def api(self):
         if self._api is None:
+            # imported on first use so ``--help`` and configuration errors
+            # don't wait on pivotal-py and its etree implementation
+            from pivotal import Pivotal
             api = Pivotal(self.options['api_token'])
             self._api = api
         return self._api
             
+    @property
+    def project_ids(self):
+        """ The projects to take stories from, in priority order. ``-p``
+            and ``bushy-pivotal.project-id`` accept a comma separated list.
+        """
+        return (self.options.get('project_id') or '').replace(',', ' ').split()
+
+    @property
+    def default_project_id(self):
+        """ The first (or only) project.
+        """
+        project_ids = self.project_ids
+        return project_ids and project_ids[0] or self.options.get('project_id')
+
     _project = None
     @property
     def project(self):
         if self._project is None:
-            project = self.api.projects(self.options['project_id'])
+            project = self.api.projects(self.default_project_id)
             self._project = project
         return self._project
 
+    _backend = None
+    @property
+    def backend(self):
+        """ The Tracker API in use, chosen by ``bushy-pivotal.api-version``.
+        """
+        if self._backend is None:
+            if self.options.get('api_version', '3') == '5':
+                self._backend = JsonBackend(self)
+            else:
+                self._backend = XmlBackend(self)
+        return self._backend
+
+    _http = None
+    @property
+    def http(self):
+        if self._http is None:
+            # httplib is left unimported until a request is made
+            from bushy.transport import get_client
+            self._http = get_client()
+        return self._http
+
+    _pool = None
+    @property
+    def pool(self):
+        """ Runs tracker requests concurrently, at most
+            ``bushy.concurrency`` (and at least one) at once.
+        """
+        if self._pool is None:
+            # no slots at all would leave the first request waiting forever
+            size = max(self.config.get_int('bushy.concurrency', DEFAULT_CONCURRENCY), 1)
+            self._pool = Pool(size)
+        return self._pool
+
+    _cache = None
+    @property
+    def cache(self):
+        if self._cache is None and not self.options.get('no_cache'):
+            self._cache = StoryCache.for_repository(
+                self.git.common_dir,
+                ttl=self.config.get_int('bushy.cache-ttl', DEFAULT_TTL),
+                size=self.config.get_int('bushy.cache-size', DEFAULT_SIZE))
+        return self._cache
+
+    _outbox = None
+    @property
+    def outbox(self):
+        """ Where changes to stories are queued when ``bushy.outbox`` is set,
+            otherwise ``None`` and changes are sent straight away.
+        """
+        if self._outbox is None and self.config.get_bool('bushy.outbox'):
+            self._outbox = Outbox.for_repository(self.git.common_dir)
+        return self._outbox
+
+    _search_index = None
+    @property
+    def search_index(self):
+        """ The full-text index of stories once ``git bushy search`` has
+            built it, otherwise ``None``. Stories read or changed by any
+            command are added to it.
+        """
+        if self._search_index is None and not self.options.get('no_cache'):
+            index = SearchIndex.for_repository(self.git.common_dir)
+            self._search_index = index is not None and index.exists() and index
+        return self._search_index or None
+
+    _indexed = None
+    _index_lock = threading.Lock()
+    def index_stories(self, changes):
+        """ Queue the changed fields of stories (or ``None`` for a deleted
+            one), keyed by id, for the search index. They are written once
+            the command has run.
+        """
+        if self.search_index is None:
+            return
+        with self._index_lock:
+            if self._indexed is None:
+                self._indexed = {}
+            for story_id, fields in changes.items():
+                story_id = str(story_id)
+                queued = self._indexed.get(story_id)
+                if fields is None or queued is None:
+                    self._indexed[story_id] = fields and dict(fields)
+                else:
+                    queued.update(fields)
+
+    _mirror = None
+    @property
+    def mirror(self):
+        """ The project's stories as of the latest activity when
+            ``bushy.mirror`` is set, otherwise (or when it can't be built)
+            ``None`` and stories are requested from Tracker.
+        """
+        # only a single project is mirrored
+        if self._mirror is None and self.config.get_bool('bushy.mirror') and \
+                not self.options.get('no_cache') and len(self.project_ids) == 1:
+            mirror = Mirror.for_repository(self.git.common_dir)
+            self._mirror = False
+            if mirror is not None:
+                with span('mirror', 'sync'):
+                    if self.sync_mirror(mirror.load()):
+                        self._mirror = mirror
+        return self._mirror or None
+
+    def sync_mirror(self, mirror):
+        """ Apply the activity since ``mirror`` was last brought up to
+            date, rebuilding it if the feed has a gap. Returns whether the
+            mirror can be used; a stale mirror is used when Tracker can't be
+            reached.
+        """
+        backend = self.backend
+        if mirror.version is not None:
+            url = backend.activity_url(mirror.version, ACTIVITY_LIMIT)
+            resp, content = self.http.request(url, 'GET', headers={'X-TrackerToken': self.api.token})
+            if transient(resp):
+                return True
+            if resp.status == 200:
+                with span('parse', 'activity'):
+                    activities = backend.parse_activity(content)
+                changes = [change for version, changes in activities for change in changes]
+                # a full page may not reach back to the mirror's version
+                if len(activities) < ACTIVITY_LIMIT and \
+                        not [change for change in changes if change.action == 'resync']:
+                    for change in changes:
+                        mirror.apply(change)
+                        if change.action == 'update':
+                            self.index_stories({change.story_id: change.fields})
+                        elif change.action == 'delete':
+                            self.index_stories({change.story_id: None})
+                    if activities:
+                        mirror.version = activities[-1][0]
+                        mirror.save()
+                    return True
+        return self.resync_mirror(mirror)
+
+    def resync_mirror(self, mirror, page_size=DEFAULT_PAGE_SIZE):
+        """ Rebuild ``mirror`` from a full listing of the project.
+        """
+        backend = self.backend
+        # the version is read first so changes made during the listing are
+        # applied (again) next time
+        resp, content = self.http.request(backend.version_url(), 'GET',
+                                          headers={'X-TrackerToken': self.api.token})
+        if resp.status != 200:
+            return mirror.version is not None
+        version = backend.parse_version(content)
+        records = []
+        offset = 0
+        previous = None
+        while True:
+            url = backend.stories_url({'includedone': 'true'}, limit=page_size, offset=offset)
+            status, stories = self._fetch(url, cached=False)
+            if status != 200:
+                return mirror.version is not None
+            page = [dump_fields(story) for story in stories]
+            if page and page[0]['id'] == previous:
+                break # the offset was ignored
+            records.extend(page)
+            # the last page, or the limit was ignored
+            if len(page) != page_size:
+                break
+            previous = page[0]['id']
+            offset += len(page)
+        deleted = set(mirror.order) - set(record['id'] for record in records)
+        mirror.reset(version, records)
+        mirror.save()
+        self.index_stories(dict((story_id, None) for story_id in deleted))
+        return True
+
+    def close(self):
+        if self._indexed:
+            self.search_index.update(self._indexed)
+            self._indexed = None
+        outbox = self._outbox
+        if outbox is not None and outbox.written:
+            self.sync_in_background()
+
+    def sync_in_background(self):
+        """ Send the queued changes from a separate process, which carries on
+            after this command has returned.
+        """
+        devnull = open(os.devnull, 'r+')
+        try:
+            subprocess.Popen([sys.executable, '-m', 'bushy.scripts', 'sync', '--quiet'],
+                             stdin=devnull, stdout=devnull, stderr=devnull,
+                             close_fds=True, preexec_fn=os.setsid)
+        finally:
+            devnull.close()
+
+    def _fetch(self, url, cached=True):
+        """ GET ``url``, returning the response status and an iterator of
+            the stories in the response, parsed as they are read. A cached
+            copy is revalidated with a conditional request rather than
+            downloaded and parsed again, unless ``cached`` is false.
+        """
+        headers = {'X-TrackerToken': self.api.token}
+        cache = cached and self.cache or None
+
+        entry = None
+        if cache is not None:
+            entry = cache.get(url)
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        resp, body = self.http.stream(url, 'GET', headers=headers)
+
+        if resp.status == 304 and entry is not None:
+            body.close()
+            cache.touch(url)
+            return 200, (load_fields(record) for record in entry['records'])
+        if resp.status != 200:
+            body.close()
+            return resp.status, (story for story in ())
+        return resp.status, self._read(url, resp, body, cache)
+
+    def _read(self, url, resp, body, cache):
+        records = []
+        count = 0
+        indexed = self.search_index is not None
+        # includes reading the body, which is parsed as it arrives, but not
+        # the caller's work on each story
+        with span('parse', 'stories') as parsing:
+            try:
+                for story in self.backend.parse_stories(body):
+                    if cache is not None or indexed:
+                        records.append(dump_fields(story))
+                    count += 1
+                    parsing.suspend()
+                    try:
+                        yield story
+                    finally:
+                        parsing.resume()
+            finally:
+                body.close()
+                parsing.set(stories=count)
+                if indexed:
+                    self.index_stories(dict((record['id'], record) for record in records))
+        # only a listing which was read to the end is worth caching
+        if cache is not None and (resp.get('etag') or resp.get('last-modified')):
+            cache.put(url, records,
+                      etag=resp.get('etag'),
+                      last_modified=resp.get('last-modified'))
+
+    def iter_stories(self, qs, limit=None, offset=None, project_id=None):
+        """ Iterate over the stories matching the filter ``qs`` as they are
+            received, in Tracker's priority order. ``limit`` and ``offset``
+            select a page of them. Close the iterator to stop reading early.
+            Stories are read from the first project unless ``project_id`` is
+            given.
+        """
+        mirror = self.mirror
+        if mirror is not None:
+            records = mirror.query(qs)
+            if records is not None:
+                offset = offset or 0
+                stop = limit is not None and offset + limit or None
+                return (load_fields(record) for record in islice(records, offset, stop))
+        url = self.backend.stories_url(qs, limit=limit, offset=offset, project_id=project_id)
+        _, stories = self._fetch(url)
+        return stories
+
+    def page_stories(self, qs, page_size=DEFAULT_PAGE_SIZE, project_id=None):
+        """ Iterate over every story matching the filter ``qs``, requesting
+            them a page at a time as the iteration reaches each page.
+        """
+        offset = 0
+        previous = None
+        while True:
+            count = 0
+            first = None
+            stories = self.iter_stories(qs, limit=page_size, offset=offset, project_id=project_id)
+            try:
+                for story in stories:
+                    if count == 0:
+                        first = story.id
+                        if first == previous:
+                            # the server ignored the offset and sent the
+                            # same page again
+                            return
+                    count += 1
+                    yield story
+            finally:
+                stories.close()
+            # a page larger than asked for means the limit was ignored and
+            # the whole listing has been sent
+            if count < page_size or count > page_size:
+                break
+            previous = first
+            offset += count
+
+    def fetch_stories(self, qs):
+        """ The ``StoryRecord`` of each story matching the filter ``qs`` in
+            any of the projects, which are asked concurrently.
+        """
+        project_ids = self.project_ids
+        if len(project_ids) < 2:
+            return list(self.page_stories(qs))
+        return merge_by_priority(self.pool.map(
+            lambda project_id: list(self.page_stories(qs, project_id=project_id)), project_ids))
+
+    def _first(self, qs, limit, project_id=None):
+        stories = self.iter_stories(qs, limit=limit, project_id=project_id)
+        try:
+            return list(islice(stories, limit))
+        finally:
+            stories.close()
+
+    def fetch_candidates(self, qs, limit):
+        """ The first ``limit`` stories matching the filter ``qs``. With
+            several projects, each is asked concurrently and the stories
+            chosen from their merged listings.
+        """
+        project_ids = self.project_ids
+        if len(project_ids) < 2:
+            return self._first(qs, limit)
+        listings = self.pool.map(lambda project_id: self._first(qs, limit, project_id), project_ids)
+        return merge_by_priority(listings)[:limit]
+
+    def fetch_stories_by_id(self, story_ids):
+        """ A ``StoryRecord`` for each of ``story_ids`` that exists, keyed by
+            id, retrieved with a single request.
+        """
+        story_ids = sorted(set(int(story_id) for story_id in story_ids))
+        if not story_ids:
+            return {}
+        stories = self.fetch_stories({'id': ','.join(map(str, story_ids)),
+                                      'includedone': 'true',
+                                      })
+        return dict((story.id, story) for story in stories)
+
+    def fetch_story(self, story_id, project_id=None):
+        """ The ``StoryRecord`` of a single story, or ``None`` if it doesn't
+            exist. Without a ``project_id`` every project is asked, as the
+            story may be in any of them.
+        """
+        story_id = str(story_id)
+        mirror = self.mirror
+        if mirror is not None:
+            record = mirror.get(story_id)
+            return record is not None and load_fields(record) or None
+        if project_id is not None or len(self.project_ids) < 2:
+            results = [self._fetch_story(story_id, project_id)]
+        else:
+            results = self.pool.map(lambda project_id: self._fetch_story(story_id, project_id),
+                                    self.project_ids)
+        for status, story in results:
+            if story is not None:
+                return story
+        unreachable = [status for status, story in results if status != 404]
+        if unreachable and self.cache is not None:
+            # Tracker couldn't be reached, fall back to any cached listing
+            # which included the story
+            record = self.cache.lookup(story_id)
+            if record is not None:
+                return load_fields(record)
+        return None
+
+    def _fetch_story(self, story_id, project_id=None):
+        url = self.backend.story_url(story_id, project_id)
+        status, stories = self._fetch(url)
+        stories = list(stories)
+        return status, stories and stories[0] or None
+
+def quote_filter(value):
+    """ A filter value as Tracker's search syntax expects it, quoted if it
+        has spaces (e.g. a person's name) and with quotes escaped.
+    """
+    value = '%s' % (value,)
+    if value and not [c for c in ' \t":\\' if c in value]:
+        return value
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
 def format_filter(qs):
-    filters = ['%s:%s' % (k,v) for k,v in qs.items()]
+    filters = ['%s:%s' % (k, quote_filter(v)) for k,v in qs.items()]
     return ' '.join(filters)
 
 def etree_text(etree, element):
-    if etree.find(element) is not None:
-        return etree.find(element).text
+    node = etree.find(element)
+    if node is not None:
+        return node.text
     return ''
 
 def etree_int(etree, element):
-    if etree.find(element) is not None:
-        return int(etree.find(element).text)
+    node = etree.find(element)
+    if node is not None:
+        return int(node.text)
     return 0
 
+DATETIME_FORMAT = '%Y/%m/%d %H:%M:%S UTC'
+
+def parse_datetime(text):
+    """ Decode Tracker's fixed ``YYYY/MM/DD HH:MM:SS UTC`` timestamps by
+        slicing, only falling back to ``strptime`` (and its error) for
+        anything else.
+    """
+    if (len(text) == 23 and text[19:] == ' UTC' and
+        text[4] == text[7] == '/' and text[13] == text[16] == ':'):
+        try:
+            return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                            int(text[11:13]), int(text[14:16]), int(text[17:19]))
+        except ValueError:
+            pass
+    return datetime.strptime(text, DATETIME_FORMAT)
+
 def etree_datetime(etree, element):
-    if etree.find(element) is not None:
-        return datetime.strptime(etree.find(element).text, '%Y/%m/%d %H:%M:%S UTC')
+    node = etree.find(element)
+    if node is not None:
+        return parse_datetime(node.text)
     return None
 
-class Story(PivotalBase):
-    def __init__(self, etree, input=sys.stdin, output=sys.stdout, args=sys.argv):
-        super(Story, self).__init__(input, output, args)
-        self._update(etree)
-        self.h = httplib2.Http()
-        self.h.force_exception_to_status_code = True
+STORY_FIELDS = ('id',
+                'project_id',
+                'story_type',
+                'url',
+                'estimate',
+                'current_state',
+                'description',
+                'name',
+                'requested_by',
+                'owned_by',
+                'labels',
+                'notes',
+                'created_at',
+                'updated_at',
+                )
+
+StoryRecord = namedtuple('StoryRecord', STORY_FIELDS)
+
+EMPTY_STORY = StoryRecord(id=0,
+                          project_id=0,
+                          story_type='',
+                          url='',
+                          estimate=0,
+                          current_state='',
+                          description='',
+                          name='',
+                          requested_by='',
+                          owned_by='',
+                          labels='',
+                          notes='',
+                          created_at=None,
+                          updated_at=None,
+                          )
+
+DATETIME_FIELDS = ('created_at', 'updated_at')
+
+def notes_text(etree):
+    """ The text of each note in a ``<notes>`` element, one per line.
+    """
+    return '\n'.join(note.findtext('text') or '' for note in etree)
+
+_POSITIONS = dict((name, position) for position, name in enumerate(STORY_FIELDS))
+_DECODERS = {'id': int,
+             'project_id': int,
+             'estimate': int,
+             'notes': notes_text,
+             'created_at': parse_datetime,
+             'updated_at': parse_datetime,
+             }
+
+def parse_story(etree):
+    """ A ``StoryRecord`` from a ``<story>`` element, visiting each child
+        once. Missing fields keep the ``EMPTY_STORY`` defaults.
+    """
+    values = list(EMPTY_STORY)
+    positions = _POSITIONS
+    decoders = _DECODERS
+    for child in etree:
+        tag = child.tag
+        position = positions.get(tag)
+        if position is None:
+            continue
+        decode = decoders.get(tag)
+        if decode is None:
+            values[position] = child.text
+        elif decode is notes_text:
+            values[position] = decode(child)
+        else:
+            values[position] = decode(child.text)
+    return StoryRecord._make(values)
+
+def iterparse_stories(source):
+    """ Yield a ``StoryRecord`` for each story in an XML listing (or for
+        the single story in a ``<story>`` document) as it is read from the
+        file-like ``source``. Elements are discarded once parsed so memory
+        use doesn't grow with the size of the listing.
+    """
+    from pivotal import anyetree
+    root = None
+    depth = 0
+    for event, elem in anyetree.etree.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if root is None:
+                root = elem
+            depth += 1
+            continue
+        depth -= 1
+        if elem.tag == 'story' and depth <= 1:
+            yield parse_story(elem)
+            if elem is not root:
+                root.clear()
+
+def xml_text(value):
+    """ ``value`` as escaped unicode for use in a request body.
+    """
+    if isinstance(value, str):
+        value = value.decode('utf-8', 'replace')
+    elif not isinstance(value, unicode):
+        value = unicode(value)
+    from xml.sax.saxutils import escape
+    return escape(value)
+
+def dump_fields(story):
+    """ A JSON serialisable copy of a ``StoryRecord``.
+    """
+    record = dict(zip(STORY_FIELDS, story))
+    for key in DATETIME_FIELDS:
+        if record[key] is not None:
+            record[key] = record[key].strftime(DATETIME_FORMAT)
+    return record
+
+def load_fields(record):
+    values = list(EMPTY_STORY)
+    for key, value in record.items():
+        if key in _POSITIONS:
+            values[_POSITIONS[key]] = value
+    story = StoryRecord._make(values)
+    for key in DATETIME_FIELDS:
+        value = getattr(story, key)
+        if value is not None:
+            story = story._replace(**{key: parse_datetime(value)})
+    return story
+
+def json_labels(labels):
+    """ v5 labels as the comma separated names v3 gives, or ``None`` if
+        only their ids are known.
+    """
+    names = [label.get('name', '') for label in labels if isinstance(label, dict)]
+    if labels and not names:
+        return None
+    return ','.join(names)
+
+def json_story(obj):
+    """ A ``StoryRecord`` from a story decoded from the v5 JSON API, with
+        timestamps given in milliseconds.
+    """
+    values = list(EMPTY_STORY)
+    positions = _POSITIONS
+    for key, value in obj.iteritems():
+        position = positions.get(key)
+        if position is not None and value is not None:
+            values[position] = value
+    owners = obj.get('owners')
+    if owners:
+        values[positions['owned_by']] = owners[0].get('name', '')
+    values[positions['labels']] = json_labels(obj.get('labels') or []) or ''
+    comments = obj.get('comments')
+    if comments:
+        values[positions['notes']] = '\n'.join(comment.get('text') or '' for comment in comments)
+    for key in DATETIME_FIELDS:
+        value = values[positions[key]]
+        if value is not None:
+            values[positions[key]] = datetime.utcfromtimestamp(value // 1000)
+    return StoryRecord._make(values)
+
+
+V3_URL = 'http://www.pivotaltracker.com/services/v3'
+V5_URL = 'https://www.pivotaltracker.com/services/v5'
+
+# the story fields bushy uses, so v5 responses leave out everything else
+V5_FIELDS = ('id',
+             'project_id',
+             'story_type',
+             'url',
+             'estimate',
+             'current_state',
+             'name',
+             'description',
+             'labels(name)',
+             'comments(text)',
+             'owners(name)',
+             'created_at',
+             'updated_at',
+             )
+
+# v3 filter names which differ in v5
+V5_FILTERS = {'owned_by': 'owner',
+              }
+
+
+def merge_by_priority(listings):
+    """ Merge the listings of several projects, each in its own priority
+        order. Tracker has no priority across projects, so stories are
+        ranked by their position in their own project's listing, and then
+        by the order the projects were given in.
+    """
+    ranked = []
+    for index, listing in enumerate(listings):
+        for position, story in enumerate(listing):
+            ranked.append((position, index, story))
+    ranked.sort(key=lambda item: item[:2])
+    return [story for position, index, story in ranked]
+
+def transient(resp):
+    """ Whether a failed request might succeed if it is tried later.
+    """
+    return resp.error is not None or resp.status in (408, 429) or resp.status >= 500
+
+def changed_fields(etree):
+    """ The story fields present in a ``<story>`` element of an activity,
+        as stored by ``dump_fields``.
+    """
+    fields = {}
+    for child in etree:
+        # an activity only has the notes it added
+        if child.tag in _POSITIONS and child.tag != 'notes':
+            value = child.text or ''
+            if child.tag in ('id', 'project_id', 'estimate'):
+                value = value and int(value) or 0
+            fields[child.tag] = value
+    return fields
+
+def page_params(limit=None, offset=None):
+    """ The query string parameters selecting a page of a listing, which
+        both APIs share.
+    """
+    params = {}
+    if limit is not None:
+        params['limit'] = limit
+    if offset:
+        params['offset'] = offset
+    return params
+
+
+class NotMemberError(ValueError):
+    """ A story can't be given to someone who isn't a member of its
+        project.
+    """
+
+
+class XmlBackend(object):
+    """ Tracker's v3 XML API.
+    """
+
+    content_type = 'application/xml'
+    # owners are given by name
+    owners_by_id = False
+
+    def __init__(self, context):
+        self.context = context
+
+    def _project(self, project_id=None):
+        if project_id is None:
+            return self.context.project
+        return self.context.api.projects(project_id)
+
+    def stories_url(self, qs, limit=None, offset=None, project_id=None):
+        params = page_params(limit, offset)
+        return self._project(project_id).stories(filter=format_filter(qs), **params).url
+
+    def story_url(self, story_id, project_id=None):
+        return self._project(project_id).stories(story_id).url
+
+    def parse_stories(self, source):
+        return iterparse_stories(source)
+
+    def parse_story(self, content):
+        from pivotal import anyetree
+        return parse_story(anyetree.etree.fromstring(content))
+
+    def update_request(self, story, fields):
+        url = '%s/projects/%s/stories/%s' % (V3_URL, story.project_id, story.id)
+        body = '<story>%s</story>' % ''.join(['<%s>%s</%s>' % (k, xml_text(v), k)
+                                              for k, v in sorted(fields.items())])
+        return 'PUT', url, body
+
+    def comment_request(self, story, text):
+        url = '%s/projects/%s/stories/%s/notes' % (V3_URL, story.project_id, story.id)
+        body = '<note><text>%s</text></note>' % xml_text(text)
+        return 'POST', url, body
+
+    def version_url(self):
+        return self.context.project.activities(limit=1).url
+
+    def parse_version(self, content):
+        from pivotal import anyetree
+        version = anyetree.etree.fromstring(content).findtext('activity/version')
+        return version and int(version) or 0
+
+    def activity_url(self, since_version, limit):
+        return self.context.project.activities(newer_than_version=since_version, limit=limit).url
+
+    def parse_activity(self, content):
+        """ ``(version, changes)`` for each activity, oldest first. v3
+            doesn't report where a moved story went, so any event other than
+            a story being created, updated or deleted, or a note, asks for a
+            resync.
+        """
+        from pivotal import anyetree
+        activities = []
+        for activity in anyetree.etree.fromstring(content).findall('activity'):
+            event = activity.findtext('event_type')
+            changes = []
+            for story in activity.findall('stories/story'):
+                story_id = int(story.findtext('id'))
+                if event in ('story_create', 'story_update'):
+                    changes.append(Change('update', story_id, changed_fields(story)))
+                elif event == 'story_delete':
+                    changes.append(Change('delete', story_id, None))
+                elif event != 'note_create':
+                    changes.append(Change('resync', story_id, None))
+            activities.append((int(activity.findtext('version')), changes))
+        activities.sort(key=lambda activity: activity[0])
+        return activities
+
+
+class JsonBackend(object):
+    """ Tracker's v5 JSON API. Only the fields bushy uses are requested
+        (``V5_FIELDS``), with timestamps as numbers so they decode without
+        parsing.
+    """
+
+    content_type = 'application/json'
+    owners_by_id = True
+
+    def __init__(self, context):
+        self.context = context
+        self._people = {}
+
+    def _url(self, path, **params):
+        from urllib import urlencode
+        params.setdefault('fields', ','.join(V5_FIELDS))
+        params['date_format'] = 'millis'
+        return '%s/%s?%s' % (V5_URL, path, urlencode(sorted(params.items())))
+
+    def _project_path(self, project_id=None):
+        return 'projects/%s' % (project_id or self.context.default_project_id)
+
+    def _story_path(self, story_id, project_id=None):
+        return '%s/stories/%s' % (self._project_path(project_id), story_id)
+
+    def stories_url(self, qs, limit=None, offset=None, project_id=None):
+        qs = dict((V5_FILTERS.get(k, k), v) for k, v in qs.items())
+        params = page_params(limit, offset)
+        return self._url(self._project_path(project_id) + '/stories',
+                         filter=format_filter(qs), **params)
+
+    def story_url(self, story_id, project_id=None):
+        return self._url(self._story_path(story_id, project_id))
+
+    def parse_stories(self, source):
+        data = json_loads(source.read())
+        if isinstance(data, dict):
+            if data.get('kind') == 'error':
+                return
+            data = [data]
+        for obj in data:
+            yield json_story(obj)
+
+    def parse_story(self, content):
+        return json_story(json_loads(content))
+
+    def members(self, project_id=None):
+        """ The project's members' ids keyed by name, looked up once per
+            command, or ``None`` if they couldn't be read.
+        """
+        path = self._project_path(project_id)
+        if path not in self._people:
+            url = self._url(path + '/memberships', fields='person(id,name)')
+            headers = {'X-TrackerToken': self.context.api.token}
+            resp, content = self.context.http.request(url, 'GET', headers=headers)
+            if resp.status != 200:
+                # asked for again next time rather than taken as no members
+                return None
+            people = {}
+            for membership in json_loads(content):
+                person = membership.get('person') or {}
+                people[person.get('name')] = person.get('id')
+            self._people[path] = people
+        return self._people[path]
+
+    def person_id(self, name, project_id=None):
+        """ The id of the member called ``name``, or ``None`` if the members
+            couldn't be read.
+        """
+        people = self.members(project_id)
+        if people is None:
+            return None
+        if name not in people:
+            raise NotMemberError('%s is not a member of %s' % (name, self._project_path(project_id)))
+        return people[name]
+
+    def person_name(self, person_id):
+        for name, other in (self.members() or {}).items():
+            if other == person_id:
+                return name
+        return ''
+
+    def update_request(self, story, fields):
+        """ ``None`` if the owner's id can't be looked up.
+        """
+        body = {}
+        for key, value in fields.items():
+            if key == 'owned_by':
+                person_id = self.person_id(value, story.project_id or None)
+                if person_id is None:
+                    return None
+                body['owner_ids'] = [person_id]
+            else:
+                body[key] = value
+        url = self._url(self._story_path(story.id, story.project_id))
+        return 'PUT', url, json_dumps(body, sort_keys=True)
+
+    def comment_request(self, story, text):
+        url = self._url(self._story_path(story.id, story.project_id) + '/comments', fields='id')
+        return 'POST', url, json_dumps({'text': text})
+
+    def version_url(self):
+        return self._url(self._project_path(), fields='version')
+
+    def parse_version(self, content):
+        return json_loads(content).get('version') or 0
+
+    def activity_url(self, since_version, limit):
+        return self._url(self._project_path() + '/activity',
+                         since_version=since_version, limit=limit,
+                         fields='project_version,changes')
+
+    def changed_fields(self, values):
+        fields = {}
+        for key, value in values.iteritems():
+            if key in _POSITIONS:
+                fields[key] = value
+        if 'labels' in fields:
+            labels = json_labels(fields.pop('labels') or [])
+            if labels is not None:
+                fields['labels'] = labels
+        for key in DATETIME_FIELDS:
+            if fields.get(key) is not None:
+                fields[key] = datetime.utcfromtimestamp(fields[key] // 1000).strftime(DATETIME_FORMAT)
+        if 'owner_ids' in values:
+            owner_ids = values['owner_ids']
+            fields['owned_by'] = owner_ids and self.person_name(owner_ids[0]) or ''
+        return fields
+
+    def parse_activity(self, content):
+        """ ``(version, changes)`` for each activity, oldest first.
+        """
+        activities = []
+        for activity in json_loads(content):
+            changes = []
+            for change in activity.get('changes') or ():
+                if change.get('kind') != 'story':
+                    continue
+                story_id = change['id']
+                if change.get('change_type') == 'delete':
+                    changes.append(Change('delete', story_id, None))
+                    continue
+                values = change.get('new_values') or {}
+                fields = self.changed_fields(values)
+                if fields or change.get('change_type') == 'create':
+                    changes.append(Change('update', story_id, fields))
+                position = dict((key, values[key]) for key in ('before_id', 'after_id') if values.get(key))
+                if position:
+                    changes.append(Change('move', story_id, position))
+            activities.append((activity['project_version'], changes))
+        activities.sort(key=lambda activity: activity[0])
+        return activities
+
+
+class Story(object):
+    """ A story bound to the API client and options of the command
+        (``context``) which retrieved it. ``story`` is either a
+        ``StoryRecord`` or a ``<story>`` element.
+    """
+
+    def __init__(self, story, context):
+        if not isinstance(story, StoryRecord):
+            story = parse_story(story)
+        self._update_fields(story)
+        self.api = context.api
+        self.options = context.options
+        self.h = context.http
+        self.pool = context.pool
+        self.outbox = context.outbox
+        self.backend = context.backend
+        self.index_stories = context.index_stories
 
     def _update(self, etree):
-        self.id = etree_int(etree, 'id')
-        self.project_id = etree_int(etree, 'project_id')
-        self.story_type = etree_text(etree, 'story_type')
-        self.url = etree_text(etree, 'url')
-        self.estimate = etree_int(etree, 'estimate')
-        self.current_state = etree_text(etree, 'current_state')
-        self.description = etree_text(etree, 'description')
-        self.name = etree_text(etree, 'name')
-        self.requested_by = etree_text(etree, 'requested_by')
-        self.owned_by = etree_text(etree, 'owned_by')
-        self.created_at = etree_datetime(etree, 'created_at')
-        self.updated_at = etree_datetime(etree, 'updated_at')
+        story = parse_story(etree)
+        self._update_fields(story)
+        self.index_stories({self.id: dump_fields(story)})
 
-    def update_status(self, status):
+    def _update_fields(self, story):
+        for name, value in zip(STORY_FIELDS, story):
+            setattr(self, name, value)
+
+    def update(self, **fields):
+        """ Change any number of fields on the story with a single request.
+        """
         h = self.h
-        
-        url = 'http://www.pivotaltracker.com/services/v3/projects/%s/stories/%s' % (self.project_id, self.id)
-        headers = {'X-TrackerToken': self.api.token, 'Content-type': 'application/xml'}
-        body = '<story><current_state>%s</current_state></story>' % status
-        
-        resp, content = h.request(url, 'PUT', headers=headers, body=body)
-        
-        etree = anyetree.etree.fromstring(content)
-        self._update(etree)
+        backend = self.backend
+
+        if self.outbox is not None:
+            queued, extra = fields, {}
+            if 'owned_by' in fields and backend.owners_by_id:
+                # the owner's id is looked up when the change is sent, so
+                # queueing it makes no request
+                queued = dict(fields)
+                extra = {'owner': queued.pop('owned_by'), 'project_id': self.project_id or None}
+            method, url, body = backend.update_request(self, queued)
+            self.outbox.append(self.id, method, url, body, backend.content_type, **extra)
+            # assume the change will be made once it is sent
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.index_stories({self.id: fields})
+            return
+
+        request = backend.update_request(self, fields)
+        if request is None:
+            # the members couldn't be read, so the story is left as it was
+            return
+        method, url, body = request
+        headers = {'X-TrackerToken': self.api.token, 'Content-type': backend.content_type}
+        resp, content = h.request(url, method, headers=headers, body=body.encode('utf-8'))
+        if resp.status != 200:
+            # the body is an error rather than the story, which is left as
+            # it was
+            return
+
+        with span('parse', 'story'):
+            story = backend.parse_story(content)
+        self._update_fields(story)
+        self.index_stories({self.id: dump_fields(story)})
+
+    def update_status(self, status):
+        self.update(current_state=status)
         
     def update_owner(self, owner):
-        h = self.h
-        
-        url = 'http://www.pivotaltracker.com/services/v3/projects/%s/stories/%s' % (self.project_id, self.id)
-        headers = {'X-TrackerToken': self.api.token, 'Content-type': 'application/xml'}
-        body = '<story><owned_by>%s</owned_by></story>' % owner
-        
-        resp, content = h.request(url, 'PUT', headers=headers, body=body)
-        
-        etree = anyetree.etree.fromstring(content)
-        self._update(etree)
+        self.update(owned_by=owner)
         
     def comment(self, comment):
         h = self.h
-        
-        url = 'http://www.pivotaltracker.com/services/v3/projects/%s/stories/%s/notes' % (self.project_id, self.id)
-        headers = {'X-TrackerToken': self.api.token, 'Content-type': 'application/xml'}
-        body = '<note><text>%s</text></note>' % comment
-        
-        resp, content = h.request(url, 'POST', headers=headers, body=body)
+        backend = self.backend
+
+        method, url, body = backend.comment_request(self, comment)
+
+        if self.outbox is not None:
+            # kept so a resend can check the note wasn't added already
+            self.outbox.append(self.id, method, url, body, backend.content_type,
+                               note=comment, story_url=backend.story_url(self.id, self.project_id or None))
+            return ''
+
+        headers = {'X-TrackerToken': self.api.token, 'Content-type': backend.content_type}
+        resp, content = h.request(url, method, headers=headers, body=body.encode('utf-8'))
         return content
         
     def start(self):
-        self.update_status('started')
-        self.update_owner(self.options['full_name'])
-        self.comment('Story started by %s' % self.options['full_name'])
+        """ Start the story and take ownership of it with a single update.
+            Once that has succeeded the note is sent on the pool, and its
+            ``Future`` is returned (``None`` if the story wasn't started).
+        """
+        full_name = self.options['full_name']
+        self.update(current_state='started', owned_by=full_name)
+        # only once the story has actually been started
+        if self.current_state == 'started' and self.owned_by == full_name:
+            return self.pool.submit(self.comment, 'Story started by %s' % full_name)
+        return None
     
 
+DEFAULT_PREFETCH = 3
+
+# stories shown at a time when choosing one interactively
+CHOICES = 10
+
 class Pick(PivotalBase):
     
     @property
@@ -155,22 +1097,147 @@ class Pick(PivotalBase):
     def branch_suffix(self):
         raise NotImplementedError('Must define in subclass')
 
+    @property
+    def prefetch(self):
+        """ How many candidate stories to keep queued (``bushy.prefetch``).
+        """
+        return self.config.get_int('bushy.prefetch', DEFAULT_PREFETCH)
+
+    def queue_key(self, qs):
+        # each project (or set of projects) has its own queue
+        return 'queue:%s projects:%s' % (' '.join(sorted(format_filter({k: v}) for k, v in qs.items())),
+                                         ','.join(self.project_ids))
+
+    def next_candidate(self, qs):
+        """ The first story queued for the filter ``qs`` by an earlier command
+            which is still available, or ``None``. Each candidate is checked
+            with a single (conditional) request in case someone else has
+            started it since.
+        """
+        cache = self.cache
+        if cache is None:
+            return None
+        key = self.queue_key(qs)
+        entry = cache.get(key)
+        if not entry or not entry['records']:
+            return None
+        records = list(entry['records'])
+        story = None
+        while records:
+            candidate = load_fields(records.pop(0))
+            story = self.fetch_story(candidate.id, candidate.project_id or None)
+            if story is not None and story.current_state == qs['state'] and \
+                    qs.get('owned_by', story.owned_by) == story.owned_by:
+                break
+            story = None
+        cache.put(key, records)
+        return story
+
+    def refill_queue(self, qs, exclude=()):
+        """ Queue the next candidates for the filter ``qs`` for the following
+            command, leaving out the stories in ``exclude``.
+        """
+        # enough for the queue even if every excluded story comes first
+        stories = self.fetch_candidates(qs, self.prefetch + len(exclude))
+        records = [dump_fields(story) for story in stories if story.id not in exclude]
+        self.cache.put(self.queue_key(qs), records[:self.prefetch])
+
+    def story_filter(self, story_id=None):
+        """ The filter for stories which can be picked.
+        """
+        qs = {'state': 'unstarted',
+              'type': self.type,
+              }
+        if story_id is not None:
+            qs['id'] = story_id
+        elif self.options.get('only_mine'):
+            qs['owned_by'] = self.options['full_name']
+        return qs
+
     _story = None
+    _refill = None
     
     def get_story(self, story_id=None):
         if not self._story:
-            qs = {'state': 'unstarted',
-                  'type': self.type,
-                  }
-            if story_id is not None:
-                qs['id'] = story_id
-            elif self.options.get('only_mine'):
-                qs['owned_by'] = self.options['full_name']
-            stories = self.project.stories(filter=format_filter(qs)).get_etree()
-            story = stories.find('story')
-            if story: # pragma: no cover
-                self._story = Story(story)
+            qs = self.story_filter(story_id)
+            # the mirror already answers without a request
+            queued = story_id is None and self.prefetch > 0 and self.cache is not None and \
+                self.mirror is None
+            story = None
+            if queued:
+                story = self.next_candidate(qs)
+            if story is None:
+                # only the first story is needed
+                stories = self.fetch_candidates(qs, 1)
+                story = stories and stories[0] or None
+            if queued:
+                # ready for the next command, while this one carries on. The
+                # refill has its own thread rather than a worker, as it lists
+                # the projects on the pool itself and would wait forever on
+                # the slot it held
+                exclude = story is not None and (story.id,) or ()
+                self._refill = background(self.refill_queue, qs, exclude)
+            if story is not None: # pragma: no cover
+                self._story = Story(story, self)
         return self._story
+
+    def format_choice(self, number, story):
+        details = ['%s pts' % story.estimate]
+        if story.owned_by:
+            details.append(story.owned_by)
+        if story.labels:
+            details.append(story.labels)
+        return '%3d. %s %s (%s)' % (number, story.id, story.name, ', '.join(details))
+
+    def choose_story(self, raw_input=raw_input):
+        """ Search the backlog and choose a story from the matches. The
+            backlog is listed once into a ``Backlog`` index, which answers
+            every search; only the chosen story is requested again, to
+            check it is still available.
+        """
+        qs = self.story_filter()
+        stories = self.fetch_stories(qs)
+        with span('index', 'backlog'):
+            backlog = Backlog(stories)
+        query = ''
+        while self._story is None:
+            hits = backlog.search(query, limit=CHOICES)
+            if not hits:
+                self.put('No %s match "%s"' % (self.plural_type, query))
+            else:
+                self.put('%s of %s %s:' % (len(hits), len(backlog), self.plural_type))
+            for number, story in enumerate(hits):
+                self.put(self.format_choice(number + 1, story))
+            answer = raw_input('Search, or enter the number of a story [1]: ').strip()
+            if answer == '' and not hits:
+                return None
+            if answer == '' or answer.isdigit() and 0 < int(answer) <= len(hits):
+                choice = hits[answer and int(answer) - 1 or 0]
+                project_id = len(self.project_ids) > 1 and choice.project_id or None
+                story = self.fetch_story(choice.id, project_id)
+                if story is None or story.current_state != qs['state']:
+                    self.put('Story %s is no longer available' % choice.id)
+                    backlog.discard(choice.id)
+                    continue
+                self._story = Story(story, self)
+            else:
+                query = answer
+        return self._story
+
+    _note = None
+
+    def close(self):
+        try:
+            if self._note is not None:
+                # sent while the branch was set up
+                self._note.result()
+        finally:
+            if self._refill is not None:
+                try:
+                    self._refill.result()
+                except Exception:
+                    pass # the queue is only ever a head start
+            super(Pick, self).close()
         
     
     def __call__(self, raw_input=raw_input):
@@ -186,6 +1253,14 @@ class Pick(PivotalBase):
             if story is None:
                 self.put('Story %s is unavailable!' % target_story)
                 return
+        elif self.options.get('interactive') and not self.options['quiet']:
+            self.put('Retrieving %s from Pivotal Tracker' % self.plural_type)
+
+            story = self.choose_story(raw_input)
+
+            if story is None:
+                self.put('No %s chosen!' % self.type)
+                return
         else:
             # there was no story number provided so just pick the first one
             msg = 'Retrieving latest %s from Pivotal Tracker' % self.plural_type
@@ -205,23 +1280,30 @@ class Pick(PivotalBase):
 
         self.put('Updating %s status in Pivotal Tracker...' % self.type)
 
-        story.start()
+        try:
+            self._note = story.start()
+        except NotMemberError as e:
+            self.put(str(e))
         if story.owned_by == self.options['full_name']:
-            suffix = default = self.branch_suffix
-            if not self.options['quiet']:
-                suffix = raw_input('Enter branch name (will be prepended by %s) [%s]: ' % (story.id, default))
-                if suffix == '':
-                    suffix = default
-
-            branch = '%s-%s' % (story.id, suffix)
-            branches = self.sys('git branch')
-            if branch not in branches:
+            existing = self.git.story_branches(story.id)
+            if existing:
+                # carry on with the story's branch, whatever it was called
+                branch = existing[0]
+            else:
+                suffix = default = self.branch_suffix
+                if not self.options['quiet']:
+                    suffix = raw_input('Enter branch name (will be prepended by %s) [%s]: ' % (story.id, default))
+                    if suffix == '':
+                        suffix = default
+                branch = '%s-%s' % (story.id, suffix)
+
+            if not self.git.branch_exists(branch):
                 self.put('Creating new branch: ', False)
                 self.put(branch)
-                self.sys('git checkout -b %s' % branch)
+                self.git('checkout', '-b', branch)
             else:
                 self.put('Switching to branch %s' % branch)
-                self.sys('git checkout %s' % branch)
+                self.git('checkout', branch)
 
         else:
             self.put('Unable to update ', False)
@@ -241,17 +1323,25 @@ class Bug(Pick):
     plural_type = 'bugs'
     branch_suffix = 'bug'
 
+# states from which a story needs no update to be finished
+FINISHED_STATES = ('finished', 'delivered', 'accepted')
+
 class Finish(PivotalBase):
 
+    def init_parser(self):
+        parser = super(Finish, self).init_parser()
+        parser.add_option('-a', '--all', action="store_true", dest='finish_all', help='Finish and merge every local story branch')
+        return parser
+
+    _current_branch = None
     @property
     def current_branch(self):
-        branches = self.sys('git branch')
-        branches = branches.split('\n')
-        for b in branches:
-            if b.startswith('* '):
-                return b.strip('* ')
-        
-        return ''
+        """ The branch being finished, resolved from HEAD once per command
+            so it stays the same after the integration branch is checked out.
+        """
+        if self._current_branch is None:
+            self._current_branch = self.git.current_branch()
+        return self._current_branch
 
     @property
     def story_id(self):
@@ -266,20 +1356,33 @@ class Finish(PivotalBase):
     @property
     def story(self):
         if self._story is None:
-            qs = {}
-            qs['owned_by'] = self.options['full_name']
-            
-            stories = self.project.stories(filter=format_filter(qs)).get_etree()
-            for story in stories.getchildren():
-                if hasattr(story.find('id'), 'text') and story.find('id').text == self.story_id: # pragma: no cover
-                    self._story = Story(story)
-                    break
+            fields = self.fetch_story(self.story_id)
+            if fields is not None: # pragma: no cover
+                self._story = Story(fields, self)
             
         return self._story
     
+    def story_branches(self):
+        """ ``(story id, branch)`` for each local ``<story id>-*`` branch.
+        """
+        branches = []
+        for branch in sorted(self.git.branches):
+            story_id, sep, suffix = branch.partition('-')
+            if sep and story_id.isdigit():
+                branches.append((int(story_id), branch))
+        return branches
+
     def __call__(self):
         super(Finish, self).__call__()
+
+        if self.options.get('finish_all'):
+            return self.finish_all()
       
+        if self.git.detached:
+            self.put('HEAD is detached, please checkout the branch for the '
+                     'story then re-run this command')
+            return
+
         if self.story_id == '':
             self.put('The current branch name (%s) does not follow the '
                      'correct format, please checkout the correct '
@@ -287,27 +1390,298 @@ class Finish(PivotalBase):
             return
 
         story = self.story
+        if story is None:
+            self.put('Story %s is unavailable!' % self.story_id)
+            return
+
+        integration_branch = self.options['integration_branch']
+        current_branch = self.current_branch
+        self.put('Merging %s into %s' % (current_branch, integration_branch))
+        result = self.git('checkout', integration_branch)
+        if not result.ok:
+            self.put('There was an error checking out %s:\n%s' % (integration_branch, result.err.strip()))
+            return
+        result = self.git('merge', '--no-ff', current_branch)
+        if not result.ok:
+            self.put('There was an error merging %s:\n%s' % (current_branch, (result.out + result.err).strip()))
+            # back to the story's branch, with the story left as it was
+            self.git('merge', '--abort')
+            self.git('checkout', current_branch)
+            return
+
+        # only once its work has been merged
         self.put('Marking Story %s as finished...' % story.id)
         story.update_status('finished')
-        if story.current_state == 'finished':
-            integration_branch = self.options['integration_branch']
-            current_branch = self.current_branch
-            self.put('Merging %s into %s' % (current_branch, integration_branch))
-            out = self.sys('git checkout %s' % integration_branch)
-            if 'error: ' in out:
-                # TODO: error handling for each command (or before running commands)
-                self.put('There was an error checking out master:\n%s' % out)
-                return
-            self.sys('git merge --no-ff %s' % current_branch)
-            
-            self.put('Removing %s branch' % current_branch)
-            self.sys('git branch -d %s' % current_branch)
+        if story.current_state != 'finished':
+            # the branch is kept, so finishing it can be tried again
+            self.put('Unable to mark Story %s as finished' % story.id)
+            return
 
-            story.comment('Development work for this story has been merged into the trunk')
-            
-            self.put('Merged code into trunk. Please push upstream and notify the release manager if necessary')
+        # the note and the local clean up don't depend on each other
+        note = self.pool.submit(story.comment, 'Development work for this story has been merged into the trunk')
+        self.put('Removing %s branch' % current_branch)
+        self.git('branch', '-d', current_branch)
+        note.result()
 
-        else:
-            self.put('Unable to mark Story %s as finished' % story.id)
+        self.put('Merged code into trunk. Please push upstream and notify the release manager if necessary')
+
+    def finish_all(self):
+        """ Merge every local story branch into the integration branch and
+            finish the stories whose branches merged. The stories are
+            fetched with one request and updated concurrently once the
+            merges, which are done one at a time, are over.
+        """
+        branches = self.story_branches()
+        if not branches:
+            self.put('There are no story branches to finish')
+            return
+
+        self.put('Retrieving %s stories from Pivotal Tracker' % len(set(story_id for story_id, branch in branches)))
+        records = self.fetch_stories_by_id([story_id for story_id, branch in branches])
+        stories = dict((story_id, Story(record, self)) for story_id, record in records.items())
+
+        integration_branch = self.options['integration_branch']
+        result = self.git('checkout', integration_branch)
+        if not result.ok:
+            self.put('There was an error checking out %s:\n%s' % (integration_branch, result.err.strip()))
+            return
+
+        results = {}
+        merged = []
+        for story_id, branch in branches:
+            if story_id not in stories:
+                results[branch] = 'story not found'
+                continue
+            self.put('Merging %s into %s' % (branch, integration_branch))
+            result = self.git('merge', '--no-ff', branch)
+            if not result.ok:
+                # leave the work tree clean for the remaining merges
+                self.git('merge', '--abort')
+                results[branch] = 'merge failed'
+                continue
+            self.git('branch', '-d', branch)
+            merged.append((story_id, branch))
+
+        # only stories whose work has been merged are marked as finished
+        story_ids = sorted(set(story_id for story_id, branch in merged))
+        def finish(story):
+            # one story failing to update shouldn't stop the others
+            try:
+                if story.current_state not in FINISHED_STATES:
+                    story.update_status('finished')
+            except Exception as e:
+                return 'merged, update failed: %s' % e
+            if story.current_state not in FINISHED_STATES:
+                return 'merged, not finished (%s)' % story.current_state
+        self.put('Marking %s stories as finished...' % len(story_ids))
+        errors = dict(zip(story_ids, self.pool.map(finish, [stories[story_id] for story_id in story_ids])))
+
+        notes = []
+        for story_id, branch in merged:
+            results[branch] = errors[story_id] or 'merged'
+            if errors[story_id] is None:
+                notes.append(self.pool.submit(stories[story_id].comment, 'Development work for this story has been merged into the trunk'))
+        for note in notes:
+            note.result()
+
+        self.put_table(('Story', 'Branch', 'Result'),
+                       [(story_id, branch, results[branch]) for story_id, branch in branches])
+
+    def put_table(self, header, rows):
+        rows = [header] + [tuple(str(value) for value in row) for row in rows]
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        self.put('')
+        for row in rows:
+            self.put('  '.join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
         
 
+
+# hits shown by ``git bushy search``
+SEARCH_HITS = 10
+
+class Search(PivotalBase):
+    """ Search the stories for words in their name, description or notes
+        (``git bushy search <words>``), and start the one chosen.
+
+        The search is answered from a local index (``bushy.index``), which
+        is built from every story in the project on the first search and
+        kept up to date by each command afterwards.
+    """
+
+    def init_parser(self):
+        parser = super(Search, self).init_parser()
+        parser.add_option('--rebuild', action="store_true", dest='rebuild', help='Index every story in Pivotal Tracker again')
+        return parser
+
+    @property
+    def query(self):
+        args = list(self.args)
+        # the words follow the subcommand, however it was run
+        if 'search' in args:
+            args = args[args.index('search') + 1:]
+        return ' '.join(args)
+
+    def build_index(self, index):
+        self.put('Indexing the stories in Pivotal Tracker...')
+        stories = self.fetch_stories({'includedone': 'true'})
+        index.reset([dump_fields(story) for story in stories])
+        # already in the index
+        self._indexed = None
+        self.put('Indexed %s stories' % len(stories))
+
+    def start(self, hit, raw_input=raw_input):
+        """ Start the story of a hit with ``git feature`` or ``git bug``.
+        """
+        commands = {'feature': Feature,
+                    'bug': Bug,
+                    }
+        command_class = commands.get(hit.get('story_type'))
+        if command_class is None:
+            self.put('Only features and bugs can be started, story %s is a %s' % (hit['id'], hit.get('story_type')))
+            return
+        command = command_class(self.input, self.output, [])
+        command.options.update(self.options)
+        command.options['target_story'] = str(hit['id'])
+        # carry on with this command's connections and repository
+        command._http = self.http
+        command._git = self.git
+        try:
+            return command(raw_input)
+        finally:
+            command.close()
+
+    def __call__(self, raw_input=raw_input):
+        super(Search, self).__call__()
+
+        index = SearchIndex.for_repository(self.git.common_dir)
+        if index is None:
+            self.put('git bushy search must be run from within a repository')
+            return
+        if self.options.get('rebuild') or not index.exists():
+            self.build_index(index)
+
+        query = self.query
+        if not query:
+            self.put('usage: git bushy search <words>')
+            return
+        with span('index', 'search'):
+            hits = index.search(query, limit=SEARCH_HITS)
+        if not hits:
+            self.put('No stories match "%s"' % query)
+            return
+        for number, hit in enumerate(hits):
+            self.put('%3d. %s [%s, %s] %s' % (number + 1, hit['id'], hit.get('story_type'),
+                                              hit.get('current_state'), hit.get('name')))
+
+        if self.options['quiet']:
+            return
+        answer = raw_input('Enter the number of a story to start it, or nothing to stop: ').strip()
+        if answer.isdigit() and 0 < int(answer) <= len(hits):
+            return self.start(hits[int(answer) - 1], raw_input)
+
+
+class Sync(PivotalBase):
+    """ Send the changes queued in the outbox (``git bushy sync``).
+    """
+
+    def note_added(self, entry):
+        """ Whether the story already has the note ``entry`` adds, or
+            ``None`` if that can't be told yet.
+        """
+        resp, content = self.http.request(entry['story_url'], 'GET',
+                                          headers={'X-TrackerToken': self.api.token})
+        if transient(resp):
+            return None
+        if resp.status != 200:
+            return False
+        if entry.get('content_type') == JsonBackend.content_type:
+            backend = JsonBackend(self)
+        else:
+            backend = XmlBackend(self)
+        with span('parse', 'story'):
+            notes = backend.parse_story(content).notes or ''
+        return ('\n%s\n' % entry['note']) in ('\n%s\n' % notes)
+
+    _json_backend = None
+
+    @property
+    def json_backend(self):
+        """ Looks up the owners of queued v5 changes, once per sync.
+        """
+        if self._json_backend is None:
+            self._json_backend = JsonBackend(self)
+        return self._json_backend
+
+    def request_body(self, entry):
+        """ The body to send for ``entry``, with the id of any owner it was
+            queued with, or ``False`` if that can't be looked up yet.
+        """
+        body = entry['body']
+        if entry.get('owner') is not None:
+            person_id = self.json_backend.person_id(entry['owner'], entry.get('project_id'))
+            if person_id is None:
+                return False
+            fields = json_loads(body)
+            fields['owner_ids'] = [person_id]
+            body = json_dumps(fields, sort_keys=True)
+        return body
+
+    def send(self, entry):
+        if entry.get('attempted') and entry.get('note') is not None:
+            # the last attempt may have added the note before it failed, and
+            # a note sent again would be added twice
+            added = self.note_added(entry)
+            if added is None:
+                return False
+            if added:
+                return None
+        try:
+            body = self.request_body(entry)
+        except NotMemberError as e:
+            return str(e)
+        if body is False:
+            return False
+        # entries queued before the content type was recorded were all XML
+        content_type = entry.get('content_type') or XmlBackend.content_type
+        headers = {'X-TrackerToken': self.api.token, 'Content-type': content_type}
+        resp, content = self.http.request(entry['url'], entry['method'], headers=headers,
+                                          body=body.encode('utf-8'))
+        if transient(resp):
+            # try again later
+            return False
+        if resp.status >= 400:
+            return '%s %s' % (resp.status, resp.reason)
+        return None
+
+    def __call__(self):
+        super(Sync, self).__call__()
+
+        outbox = Outbox.for_repository(self.git.common_dir)
+        if outbox is None or not outbox.pending():
+            self.put('There are no changes to send')
+            return
+
+        sent, failed, remaining = [], [], []
+        while True:
+            lock = outbox.lock()
+            if lock is None:
+                if not sent and not failed:
+                    self.put('The changes are already being sent by another process')
+                    return
+                break
+            try:
+                self.put('Sending %s changes to Pivotal Tracker...' % len(outbox.pending()))
+                s, f, remaining = outbox.flush(self.send, self.pool)
+            finally:
+                lock.close()
+            sent.extend(s)
+            failed.extend(f)
+            # carry on with any changes queued while these were sent
+            if remaining or not outbox.pending():
+                break
+
+        self.put('Sent %s changes' % len(sent))
+        for entry in failed:
+            self.put('Gave up on %s %s (story %s): %s' % (entry['method'], entry['url'], entry['story'], entry['error']))
+        if remaining:
+            self.put('%s changes could not be sent, run git bushy sync to try again' % len(remaining))
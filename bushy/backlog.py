@@ -0,0 +1,180 @@
+""" An in memory index of a backlog, for choosing a story interactively.
+
+The stories are listed once and every search after that is answered from
+the index without asking the tracker again. Each word of a story's name,
+description, labels and owner is indexed, along with ``label:``,
+``owner:`` and ``estimate:`` terms to narrow the search by field::
+
+    >>> backlog = Backlog(stories)
+    >>> backlog.search('login label:ui estimate:2')
+
+A word matches any indexed word it starts (``log`` finds ``login``) or,
+when nothing starts with it, a word one typo away. Stories must match every
+word of the search, and are ranked by the fields the words were found in
+and then by priority.
+
+Each word's matches are remembered, so as a search is typed only its last
+word is looked up again.
+"""
+
+import re
+from bisect import bisect_left
+from bushy.util import to_text
+
+__all__ = ['Backlog',
+           'tokenize',
+           ]
+
+# how much a word found in each field counts towards a story's rank
+WEIGHTS = {'name': 4,
+           'labels': 3,
+           'owned_by': 2,
+           'description': 1,
+           }
+
+# the fields a search can be narrowed by, e.g. ``owner:smith``
+FIELDS = ('label', 'owner', 'estimate')
+
+# words shorter than this must match exactly or as a prefix
+TYPO_LENGTH = 4
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """ The lower cased words of ``text``.
+    """
+    return _WORD.findall(to_text(text).lower())
+
+def one_edit(a, b):
+    """ Whether ``b`` is ``a`` with one character inserted, removed or
+        replaced.
+    """
+    if abs(len(a) - len(b)) > 1 or a == b:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    for i in xrange(len(a)):
+        if a[i] != b[i]:
+            if len(a) == len(b):
+                return a[i + 1:] == b[i + 1:]
+            return a[i:] == b[i + 1:]
+    return True
+
+
+class Backlog(object):
+
+    def __init__(self, stories):
+        self.stories = list(stories)
+        self._postings = {}
+        self._removed = set()
+        self._memo = {}
+        for position, story in enumerate(self.stories):
+            self._add(position, story)
+        words = sorted(self._postings)
+        self._words = [word for word in words if ':' not in word]
+        self._terms = [word for word in words if ':' in word]
+
+    def __len__(self):
+        return len(self.stories) - len(self._removed)
+
+    def _post(self, token, position, weight):
+        postings = self._postings.setdefault(token, {})
+        if weight > postings.get(position, 0):
+            postings[position] = weight
+
+    def _add(self, position, story):
+        for field, weight in WEIGHTS.items():
+            for word in tokenize(getattr(story, field)):
+                self._post(word, position, weight)
+        labels = [label.strip() for label in to_text(story.labels).lower().split(',')]
+        for label in filter(None, labels):
+            self._post(u'label:' + label, position, WEIGHTS['labels'])
+            for word in tokenize(label):
+                self._post(u'label:' + word, position, WEIGHTS['labels'])
+        owner = to_text(story.owned_by).lower()
+        if owner:
+            self._post(u'owner:' + owner, position, WEIGHTS['owned_by'])
+            for word in tokenize(owner):
+                self._post(u'owner:' + word, position, WEIGHTS['owned_by'])
+        if story.estimate is not None:
+            self._post(u'estimate:%s' % story.estimate, position, 1)
+
+    def parse(self, query):
+        """ The terms of a search: lower cased words, and ``field:value``
+            for the fields in ``FIELDS``.
+        """
+        terms = []
+        for part in to_text(query).lower().split():
+            field, sep, value = part.partition(':')
+            if sep and field in FIELDS:
+                if value:
+                    terms.append(part)
+            else:
+                terms.extend(tokenize(part))
+        return terms
+
+    def _prefixed(self, words, term):
+        i = bisect_left(words, term)
+        while i < len(words) and words[i].startswith(term):
+            yield words[i]
+            i += 1
+
+    def match(self, term):
+        """ The rank of each story matching ``term``, keyed by its position
+            in the backlog.
+        """
+        hits = self._memo.get(term)
+        if hits is not None:
+            return hits
+        if ':' in term:
+            if term.startswith('estimate:'):
+                tokens = [(term, 1)]
+            else:
+                tokens = [(token, 1) for token in self._prefixed(self._terms, term)]
+        else:
+            tokens = [(token, token == term and 2 or 1) for token in self._prefixed(self._words, term)]
+            if not tokens and len(term) >= TYPO_LENGTH:
+                tokens = [(token, 0.5) for token in self._words if one_edit(term, token)]
+        hits = {}
+        postings = self._postings
+        for token, factor in tokens:
+            for position, weight in postings.get(token, {}).iteritems():
+                rank = weight * factor
+                if rank > hits.get(position, 0):
+                    hits[position] = rank
+        if len(self._memo) > 10000:
+            self._memo.clear()
+        self._memo[term] = hits
+        return hits
+
+    def search(self, query, limit=None):
+        """ The stories matching every term of ``query``, best first, or
+            every story in priority order for an empty query.
+        """
+        terms = self.parse(query)
+        if not terms:
+            positions = [p for p in xrange(len(self.stories)) if p not in self._removed]
+        else:
+            ranks = None
+            # the rarest term first, so there is least to intersect
+            for hits in sorted([self.match(term) for term in terms], key=len):
+                if ranks is None:
+                    ranks = dict(hits)
+                else:
+                    ranks = dict((p, rank + hits[p]) for p, rank in ranks.iteritems() if p in hits)
+                if not ranks:
+                    break
+            positions = [p for p in ranks if p not in self._removed]
+            positions.sort(key=lambda p: (-ranks[p], p))
+        if limit is not None:
+            positions = positions[:limit]
+        return [self.stories[p] for p in positions]
+
+    def discard(self, story_id):
+        """ Leave a story out of later searches, e.g. once it has been
+            found to be started.
+        """
+        for position, story in enumerate(self.stories):
+            if story.id == story_id:
+                self._removed.add(position)
@@ -2,7 +2,9 @@
 """
 
 import sys
-from commands import getoutput
+from bushy.config import get_config
+from bushy.git import Git, run
+from bushy.trace import span
 
         
 class Base(object):
@@ -19,12 +21,18 @@ class Base(object):
         
         options.update(gitconfig)
         self.options = options
+        # the positional arguments, e.g. the words of a search
+        self.args = args
 
     def init_parser(self): # pragma: no cover
         raise NotImplementedError('This method should be written specifically for the platform being used')
         
     def parse_gitconfig(self): # pragma: no cover
         raise NotImplementedError('This method should be written specifically for the platform being used')
+
+    @property
+    def config(self):
+        return get_config()
     
     _integration_branch = None
     @property
@@ -38,6 +46,10 @@ class Base(object):
         if None in (self.options.get('api_token'), self.options.get('project_id')):
             raise RuntimeError('Pivotal Tracker API Token and Project ID are required')
 
+    def close(self):
+        """ Called once the command has run, whether or not it succeeded.
+        """
+
     # convenience
 
     def put(self, msg, newline=True):
@@ -48,9 +60,21 @@ class Base(object):
             if newline:
                 self.output.write('\n')
 
-    def sys(self, cmd):
+    def sys(self, *argv):
+        """ Run a command (without a shell), returning a ``bushy.git.Result``.
+        """
         if self.options.get('verbose'):
             self.put('Running command: ', False)
-            self.put(cmd)
-        return getoutput(cmd)
+            self.put(' '.join(argv))
+        with span('git', ' '.join(argv[:2])) as running:
+            result = run(argv)
+            running.set(status=result.status)
+        return result
+
+    _git = None
+    @property
+    def git(self):
+        if self._git is None:
+            self._git = Git(runner=lambda argv: self.sys(*argv))
+        return self._git
         
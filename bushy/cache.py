@@ -0,0 +1,187 @@
+""" A persistent cache of story listings, kept under ``.git/bushy/``.
+
+Each entry holds the parsed records for one listing along with the ETag and
+Last-Modified validators from the response that produced them, so a later
+request can be made conditional. The modification time of an entry's file
+records when it was last validated against the server.
+
+An index of story id to entry is kept alongside, as one small file per
+story under ``ids/``, so a single story can be found without scanning every
+cached listing and caching a listing only touches the ids it holds.
+"""
+
+import os
+import time
+import json
+import errno
+from hashlib import sha1
+from bushy.util import makedirs, dump_json
+
+__all__ = ['StoryCache',
+           ]
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_SIZE = 64
+
+
+class StoryCache(object):
+
+    def __init__(self, path, ttl=DEFAULT_TTL, size=DEFAULT_SIZE):
+        self.path = path
+        self.ttl = ttl
+        self.size = size
+
+    @classmethod
+    def for_repository(cls, git_dir, ttl=DEFAULT_TTL, size=DEFAULT_SIZE):
+        """ The cache kept in ``git_dir``, or ``None`` outside a repository.
+        """
+        if not git_dir:
+            return None
+        return cls(os.path.join(git_dir, 'bushy', 'stories'), ttl, size)
+
+    def filename(self, key):
+        return os.path.join(self.path, '%s.json' % sha1(key).hexdigest())
+
+    def _expired(self, filename, now=None):
+        if now is None:
+            now = time.time()
+        return now - os.path.getmtime(filename) > self.ttl
+
+    def _load(self, filename):
+        try:
+            if self._expired(filename):
+                self._remove(filename)
+                return None
+            f = open(filename)
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError):
+            return None
+
+    def get(self, key):
+        entry = self._load(self.filename(key))
+        if entry is None or entry.get('key') != key:
+            return None
+        return entry
+
+    def lookup(self, story_id):
+        """ The cached record for ``story_id`` from whichever entry last
+            included it.
+        """
+        indexed = self._indexed(story_id)
+        if indexed is None:
+            return None
+        name, position = indexed
+        entry = self._load(os.path.join(self.path, name))
+        if entry is not None:
+            records = entry['records']
+            if position < len(records) and str(records[position].get('id')) == str(story_id):
+                return records[position]
+        # the entry has since been evicted or no longer holds the story
+        self._unindex(story_id, name)
+        return None
+
+    def _id_filename(self, story_id):
+        return os.path.join(self.path, 'ids', str(int(story_id)))
+
+    def _indexed(self, story_id):
+        """ ``(entry name, position)`` of the story in the id index.
+        """
+        try:
+            f = open(self._id_filename(story_id))
+            try:
+                name, position = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError, TypeError):
+            # not an id, not indexed, or a torn write
+            return None
+        return name, position
+
+    def _unindex(self, story_id, name):
+        # another entry may have included the story since
+        indexed = self._indexed(story_id)
+        if indexed is not None and indexed[0] == name:
+            try:
+                self._remove(self._id_filename(story_id))
+            except OSError:
+                pass
+
+    def _update_index(self, name, previous, records):
+        """ Point the ids of an entry's ``records`` at it, and drop those of
+            its ``previous`` records which it no longer holds.
+        """
+        ids = set()
+        if records:
+            makedirs(os.path.join(self.path, 'ids'))
+        for position, record in enumerate(records):
+            if record.get('id'):
+                ids.add(str(record['id']))
+                # written in place, as a torn read is only a cache miss
+                f = open(self._id_filename(record['id']), 'w')
+                try:
+                    f.write(json.dumps([name, position]))
+                finally:
+                    f.close()
+        for record in previous:
+            if record.get('id') and str(record['id']) not in ids:
+                self._unindex(record['id'], name)
+
+    def put(self, key, records, etag=None, last_modified=None):
+        entry = {'key': key,
+                 'etag': etag,
+                 'last_modified': last_modified,
+                 'records': records,
+                 }
+        filename = self.filename(key)
+        try:
+            previous = self._load(filename)
+            dump_json(filename, entry)
+            self._update_index(os.path.basename(filename), previous and previous.get('records') or [], records)
+        except (IOError, OSError):
+            # the cache is an optimisation, never a reason to fail a command
+            return None
+        self.evict()
+        return entry
+
+    def touch(self, key):
+        """ Mark an entry as freshly validated (e.g. after a 304 response).
+        """
+        try:
+            os.utime(self.filename(key), None)
+        except OSError:
+            pass
+
+    def evict(self):
+        """ Drop expired entries, then the least recently validated ones
+            until at most ``size`` remain.
+        """
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return
+        now = time.time()
+        entries = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                if self._expired(filename, now):
+                    self._remove(filename)
+                else:
+                    entries.append((os.path.getmtime(filename), filename))
+            except OSError:
+                continue
+        entries.sort()
+        for _, filename in entries[:max(len(entries) - self.size, 0)]:
+            self._remove(filename)
+
+    def _remove(self, filename):
+        try:
+            os.remove(filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
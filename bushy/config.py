@@ -0,0 +1,105 @@
+""" A snapshot of the git configuration, read once per invocation.
+"""
+
+import subprocess
+from bushy.trace import span
+
+__all__ = ['GitConfig',
+           'get_config',
+           ]
+
+TRUE_VALUES = ('true', 'yes', 'on', '1')
+FALSE_VALUES = ('false', 'no', 'off', '0', '')
+INT_SUFFIXES = {'k': 1024,
+                'm': 1024 ** 2,
+                'g': 1024 ** 3,
+                }
+
+
+class GitConfig(object):
+
+    def __init__(self, values=None):
+        self.values = values or {}
+
+    @classmethod
+    def parse(cls, raw):
+        """ Parse the output of ``git config --list -z``. Entries are NUL
+            terminated with the key and value separated by a newline.
+        """
+        values = {}
+        for entry in raw.split('\0'):
+            if not entry:
+                continue
+            if '\n' in entry:
+                key, val = entry.split('\n', 1)
+            else:
+                # a bare ``key`` with no ``=`` is an implicit true
+                key, val = entry, None
+            # later (more local) files override earlier ones, as in git
+            values[key] = val
+        return cls(values)
+
+    @classmethod
+    def read(cls):
+        with span('config', 'git config --list'):
+            return cls._read()
+
+    @classmethod
+    def _read(cls):
+        try:
+            proc = subprocess.Popen(['git', 'config', '--list', '-z'],
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+        except OSError:
+            return cls()
+        out, _ = proc.communicate()
+        if proc.returncode != 0:
+            return cls()
+        return cls.parse(out)
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def get(self, key, default=None):
+        if key not in self.values:
+            return default
+        val = self.values[key]
+        if val is None:
+            return ''
+        return val
+
+    def get_bool(self, key, default=False):
+        if key not in self.values:
+            return default
+        val = self.values[key]
+        if val is None:
+            return True
+        val = val.strip().lower()
+        if val in TRUE_VALUES:
+            return True
+        if val in FALSE_VALUES:
+            return False
+        raise ValueError('bad boolean config value %r for %s' % (val, key))
+
+    def get_int(self, key, default=None):
+        if key not in self.values or not self.values[key]:
+            return default
+        val = self.values[key].strip().lower()
+        multiplier = INT_SUFFIXES.get(val[-1:], 1)
+        if multiplier != 1:
+            val = val[:-1]
+        try:
+            return int(val) * multiplier
+        except ValueError:
+            raise ValueError('bad numeric config value %r for %s' % (val, key))
+
+
+_config = None
+
+def get_config():
+    """ The configuration for this process, only read from git on first use.
+    """
+    global _config
+    if _config is None:
+        _config = GitConfig.read()
+    return _config
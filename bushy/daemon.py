@@ -0,0 +1,353 @@
+""" An optional long running process which runs commands on behalf of the
+console scripts, so imports and connections to the tracker stay warm
+between commands::
+
+    $ bushy-daemon &
+
+The scripts send their arguments, working directory and the environment
+variables the commands read (see ``ENVIRONMENT``) over a per user Unix socket
+and relay the command's input and output. When no daemon is listening they
+run the command in process as before.
+
+The socket is kept in ``$XDG_RUNTIME_DIR``, or when that isn't set in the
+repository's ``.git/bushy/daemon/``. Neither end uses it unless it and its
+directory belong to the user and the directory is private to them.
+
+Commands are run one at a time, as each one changes the daemon's working
+directory, environment and standard streams to match its client's.
+"""
+
+import os
+import sys
+import json
+import stat
+import errno
+import socket
+import optparse
+import traceback
+from bushy.util import to_text, makedirs
+
+__all__ = ['Daemon',
+           'call',
+           'main',
+           'socket_path',
+           ]
+
+DEFAULT_IDLE_TIMEOUT = 3600
+
+# the environment variables passed on to the daemon, as read by the
+# commands and the git they run, along with any starting with ``GIT_``
+ENVIRONMENT = ('HOME',
+               'PATH',
+               'LANG',
+               'LC_ALL',
+               'LC_CTYPE',
+               'LC_MESSAGES',
+               'TZ',
+               'XDG_CONFIG_HOME',
+               )
+
+
+def forwarded(name):
+    """ Whether the environment variable ``name`` is passed on to the
+        daemon.
+    """
+    return name in ENVIRONMENT or name.startswith('GIT_')
+
+
+def socket_path(git_dir=None):
+    """ The per user socket, in ``$XDG_RUNTIME_DIR`` when it is set and
+        otherwise in the repository's git directory, or ``None`` outside of
+        a repository.
+    """
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'bushy.sock')
+    if git_dir is None:
+        from bushy.git import Git
+        git_dir = Git().common_dir
+    if not git_dir:
+        return None
+    return os.path.join(git_dir, 'bushy', 'daemon', 'bushy.sock')
+
+
+def check_private(path):
+    """ Raise a ``RuntimeError`` unless the directory holding the socket
+        ``path`` and the socket, if it exists, belong to this user and the
+        directory is private to them, so no one else can listen in their
+        place or connect and run commands as them.
+    """
+    directory = os.path.dirname(path)
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid()
+        or stat.S_IMODE(info.st_mode) != 0700):
+        raise RuntimeError('%s must be a directory owned by you with mode 0700' % directory)
+    try:
+        info = os.lstat(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        return
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise RuntimeError('%s must be a socket owned by you' % path)
+
+
+class Connection(object):
+    """ Newline delimited JSON messages over a socket.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.wfile = sock.makefile('wb', 0)
+
+    def send(self, **msg):
+        self.wfile.write(json.dumps(msg) + '\n')
+
+    def receive(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def close(self):
+        self.rfile.close()
+        self.wfile.close()
+        self.sock.close()
+
+
+def _bytes(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+class Output(object):
+    """ Stands in for a command's stdout or stderr, passing each write on
+        to the client as an ``out`` or ``err`` message.
+    """
+
+    def __init__(self, conn, stream):
+        self.conn = conn
+        self.stream = stream
+
+    def write(self, data):
+        if data:
+            self.conn.send(**{self.stream: to_text(data)})
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+class Input(object):
+    """ Stands in for a command's stdin, asking the client for each line as
+        it is needed (e.g. by ``raw_input``).
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def readline(self, size=-1):
+        self.conn.send(**{'in': True})
+        msg = self.conn.receive()
+        if msg is None:
+            return ''
+        return msg['in'].encode('utf-8')
+
+    def isatty(self):
+        return False
+
+
+def call(name, argv, path=None, stdin=None, stdout=None, stderr=None):
+    """ Run the command class ``name`` (e.g. ``'Feature'``) with ``argv``
+        in the daemon, relaying its input and output. Returns its exit
+        status, or ``None`` when no daemon is listening.
+    """
+    path = path or socket_path()
+    if path is None or not os.path.exists(path):
+        return None
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    stderr = stderr or sys.stderr
+    try:
+        check_private(path)
+    except (RuntimeError, OSError) as e:
+        stderr.write('Not using the bushy daemon: %s\n' % e)
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+
+    conn = Connection(sock)
+    try:
+        conn.send(command=name,
+                  argv=list(argv),
+                  cwd=os.getcwd(),
+                  env=dict((k, v) for k, v in os.environ.items() if forwarded(k)))
+        while True:
+            msg = conn.receive()
+            if msg is None:
+                stderr.write('The bushy daemon stopped before the command finished\n')
+                return 1
+            if 'out' in msg:
+                stdout.write(msg['out'].encode('utf-8'))
+                stdout.flush()
+            elif 'err' in msg:
+                stderr.write(msg['err'].encode('utf-8'))
+            elif 'in' in msg:
+                conn.send(**{'in': to_text(stdin.readline())})
+            elif 'exit' in msg:
+                return msg['exit']
+    finally:
+        conn.close()
+
+
+class Daemon(object):
+
+    def __init__(self, path=None, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.path = path or socket_path()
+        if self.path is None:
+            raise RuntimeError('Set XDG_RUNTIME_DIR, or start the daemon in a repository')
+        self.idle_timeout = idle_timeout
+        self.sock = None
+
+    def bind(self):
+        """ Listen on the socket, replacing a stale one left by a daemon
+            which didn't exit cleanly.
+        """
+        directory = os.path.dirname(self.path)
+        parent = os.path.dirname(directory)
+        makedirs(parent)
+        try:
+            os.mkdir(directory, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        check_private(self.path)
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.remove(self.path)
+            else:
+                raise RuntimeError('A bushy daemon is already listening on %s' % self.path)
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # only the user may connect, as commands run with their credentials
+        umask = os.umask(0177)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen(5)
+        self.sock = sock
+
+    def serve(self):
+        """ Handle commands until none arrive for ``idle_timeout`` seconds.
+        """
+        if self.sock is None:
+            self.bind()
+        try:
+            while True:
+                self.sock.settimeout(self.idle_timeout)
+                try:
+                    client, address = self.sock.accept()
+                except socket.timeout:
+                    break
+                client.settimeout(None)
+                self.handle(client)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def handle(self, sock):
+        conn = Connection(sock)
+        try:
+            request = conn.receive()
+            if request is not None:
+                status = self.run(request, conn)
+                conn.send(exit=status)
+        except socket.error:
+            pass # the client went away
+        finally:
+            conn.close()
+
+    def run(self, request, conn):
+        """ Run the requested command as its client would have, returning
+            its exit status.
+        """
+        import bushy.config
+        from bushy.scripts import dispatch
+
+        cwd = os.getcwd()
+        environ = dict(os.environ)
+        streams = sys.stdin, sys.stdout, sys.stderr
+        try:
+            os.chdir(_bytes(request['cwd']))
+            # the client's values replace the daemon's own, which are kept
+            # for everything the client doesn't send
+            for name in environ:
+                if forwarded(name):
+                    del os.environ[name]
+            os.environ.update((_bytes(k), _bytes(v)) for k, v in request['env'].items()
+                              if forwarded(k))
+            sys.stdin = Input(conn)
+            sys.stdout = Output(conn, 'out')
+            sys.stderr = Output(conn, 'err')
+            # the settings differ between repositories, so they're read again
+            # (the HTTP client and its connections are kept)
+            bushy.config._config = None
+            try:
+                dispatch(request['command'],
+                         input=sys.stdin, output=sys.stdout,
+                         args=[_bytes(arg) for arg in request['argv']])
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    return e.code or 0
+                sys.stderr.write('%s\n' % e.code)
+                return 1
+            except Exception:
+                traceback.print_exc()
+                return 1
+            return 0
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = streams
+            os.environ.clear()
+            os.environ.update(environ)
+            os.chdir(cwd)
+
+
+def main(args=None):
+    """ The ``bushy-daemon`` console script.
+    """
+    parser = optparse.OptionParser(description='Run bushy commands from a long running process.')
+    parser.add_option('-s', '--socket', dest='path', default=socket_path(), help='The Unix socket to listen on [%default]')
+    parser.add_option('-t', '--idle-timeout', dest='idle_timeout', type='float', default=DEFAULT_IDLE_TIMEOUT, help='Exit after this many seconds without a command [%default]')
+    options, args = parser.parse_args(args)
+
+    try:
+        daemon = Daemon(options.path, options.idle_timeout)
+        daemon.bind()
+    except (RuntimeError, OSError) as e:
+        parser.error(str(e))
+    daemon.serve()
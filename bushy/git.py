@@ -0,0 +1,207 @@
+""" Running git and reading repository state.
+
+Commands are run directly (no shell) with their exit status, output and
+errors kept apart. Where git's on-disk format is simple enough (HEAD, loose
+refs and packed-refs) it is read directly rather than starting a process.
+"""
+
+import os
+import subprocess
+from collections import namedtuple
+
+__all__ = ['Git',
+           'Head',
+           'Result',
+           'run',
+           ]
+
+
+Head = namedtuple('Head', 'ref sha')
+
+
+class Result(namedtuple('Result', 'status out err')):
+
+    @property
+    def ok(self):
+        return self.status == 0
+
+
+def run(argv, cwd=None):
+    """ Run ``argv`` without a shell, returning its ``Result``.
+    """
+    try:
+        proc = subprocess.Popen(argv, cwd=cwd,
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+    except OSError as e:
+        return Result(127, '', str(e))
+    out, err = proc.communicate()
+    return Result(proc.returncode, out, err)
+
+
+class Git(object):
+
+    def __init__(self, runner=run, path=None):
+        self.runner = runner
+        self.path = path or os.getcwd()
+
+    def __call__(self, *args):
+        """ Run ``git`` with ``args``, e.g. ``git('checkout', '-b', name)``.
+        """
+        # any command may move HEAD or create and delete branches
+        self._head = None
+        self._branches = None
+        return self.runner(['git'] + list(args))
+
+    _git_dir = False
+    @property
+    def git_dir(self):
+        """ The repository's git directory, or ``None`` outside of one.
+        """
+        if self._git_dir is False:
+            self._git_dir = self._find_git_dir()
+        return self._git_dir
+
+    def _find_git_dir(self):
+        if os.environ.get('GIT_DIR'):
+            return os.path.abspath(os.environ['GIT_DIR'])
+        path = os.path.abspath(self.path)
+        while True:
+            candidate = os.path.join(path, '.git')
+            if os.path.isdir(candidate):
+                return candidate
+            if os.path.isfile(candidate):
+                # a linked worktree or submodule: ``gitdir: <path>``
+                content = self._read_file(candidate)
+                if content.startswith('gitdir: '):
+                    return os.path.normpath(os.path.join(path, content[8:]))
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        # anything unusual (bare repositories, GIT_WORK_TREE, ...) is left
+        # to git itself
+        result = self('rev-parse', '--git-dir')
+        if not result.ok:
+            return None
+        return os.path.abspath(os.path.join(self.path, result.out.strip()))
+
+    def _read_file(self, filename):
+        try:
+            f = open(filename)
+            try:
+                return f.read().strip()
+            finally:
+                f.close()
+        except IOError:
+            return ''
+
+    _common_dir = False
+    @property
+    def common_dir(self):
+        """ The directory holding refs shared by all worktrees. For a linked
+            worktree this differs from ``git_dir``, which holds its HEAD.
+        """
+        if self._common_dir is False:
+            common_dir = self.git_dir
+            if common_dir is not None:
+                commondir = self._read_file(os.path.join(common_dir, 'commondir'))
+                if commondir:
+                    common_dir = os.path.normpath(os.path.join(common_dir, commondir))
+            self._common_dir = common_dir
+        return self._common_dir
+
+    def packed_refs(self):
+        refs = {}
+        if self.common_dir is None:
+            return refs
+        packed = self._read_file(os.path.join(self.common_dir, 'packed-refs'))
+        for line in packed.splitlines():
+            if line.startswith('#') or line.startswith('^'):
+                continue
+            sha, _, ref = line.partition(' ')
+            if ref:
+                refs[ref] = sha
+        return refs
+
+    _branches = None
+    @property
+    def branches(self):
+        """ The names of all local branches, collected once (until the next
+            git command) from the loose refs and packed-refs.
+        """
+        if self._branches is None:
+            self._branches = self._read_branches()
+        return self._branches
+
+    def _read_branches(self):
+        prefix = 'refs/heads/'
+        if self.common_dir is None:
+            result = self('for-each-ref', '--format=%(refname)', prefix)
+            return frozenset(line[len(prefix):]
+                             for line in result.out.splitlines()
+                             if line.startswith(prefix))
+        branches = set(ref[len(prefix):] for ref in self.packed_refs()
+                       if ref.startswith(prefix))
+        heads = os.path.join(self.common_dir, 'refs', 'heads')
+        for dirpath, dirnames, filenames in os.walk(heads):
+            path = os.path.relpath(dirpath, heads).replace(os.sep, '/')
+            for filename in filenames:
+                if filename.endswith('.lock'):
+                    continue
+                if path == '.':
+                    branches.add(filename)
+                else:
+                    branches.add('%s/%s' % (path, filename))
+        return frozenset(branches)
+
+    def branch_exists(self, name):
+        return name in self.branches
+
+    def story_branches(self, story_id):
+        """ The sorted names of branches for ``story_id``, i.e. named
+            ``<story_id>-<anything>``.
+        """
+        prefix = '%s-' % story_id
+        return sorted(name for name in self.branches if name.startswith(prefix))
+
+    _head = None
+    @property
+    def head(self):
+        """ What HEAD points at, read once until the next git command: a
+            ``Head`` with the symbolic ``ref`` (e.g. ``refs/heads/master``)
+            or, when detached, just the commit ``sha``.
+        """
+        if self._head is None:
+            self._head = self._read_head()
+        return self._head
+
+    def _read_head(self):
+        if self.git_dir is None:
+            result = self('symbolic-ref', '--quiet', 'HEAD')
+            if result.ok:
+                return Head(result.out.strip(), None)
+            result = self('rev-parse', '--verify', '--quiet', 'HEAD')
+            return Head(None, result.ok and result.out.strip() or None)
+        filename = os.path.join(self.git_dir, 'HEAD')
+        if os.path.islink(filename):
+            # very old repositories symlink HEAD to the branch's ref
+            return Head(os.readlink(filename), None)
+        head = self._read_file(filename)
+        if head.startswith('ref: '):
+            return Head(head[len('ref: '):].strip(), None)
+        return Head(None, head or None)
+
+    @property
+    def detached(self):
+        return self.head.ref is None
+
+    def current_branch(self):
+        """ The name of the checked out branch, or ``''`` when HEAD is
+            detached.
+        """
+        ref = self.head.ref
+        if ref is not None and ref.startswith('refs/heads/'):
+            return ref[len('refs/heads/'):]
+        return ''
@@ -0,0 +1,293 @@
+""" A full-text index of stories, kept under ``.git/bushy/search/``.
+
+The index holds the words of each story's name, description and notes, and
+is kept up to date from the stories each command reads or changes, so a
+search never has to ask the tracker. It is laid out so a search only reads
+what it needs:
+
+``meta.json``
+    the number of stories indexed
+``docs/<bucket>.json``
+    a summary of each story (name, type and state) to show with a hit, and
+    a fingerprint of its text to tell when it has changed
+``text/<bucket>.json``
+    the indexed text of each story, read only to update the index
+``terms/<shard>.json``
+    the stories each word appears in, with its weight in each, sharded by
+    the word's first two characters
+
+Stories are spread over the buckets by id.
+
+Hits are ranked by the weight of each word in the story (words in the name
+count for more), scaled down for words found in many stories.
+"""
+
+import os
+import json
+import math
+from hashlib import sha1
+from binascii import hexlify
+from bushy.backlog import tokenize
+from bushy.util import to_text, dump_json, lock
+
+__all__ = ['SearchIndex',
+           ]
+
+# how much each occurrence of a word in a field counts
+WEIGHTS = {'name': 3,
+           'description': 1,
+           'notes': 1,
+           }
+
+# the fields shown with a hit
+SUMMARY_FIELDS = ('id',
+                  'story_type',
+                  'current_state',
+                  'name',
+                  )
+
+# the number of files the stories' summaries and text are each spread over
+BUCKETS = 64
+
+# a word which only starts an indexed word counts for less
+PREFIX_FACTOR = 0.5
+
+
+def shard(term):
+    """ The name of the file holding ``term``'s postings: its first two
+        characters, hex encoded to be safe as a file name.
+    """
+    return hexlify(term[:2].encode('utf-8'))
+
+def bucket(story_id):
+    return str(int(story_id) % BUCKETS)
+
+def weigh(text):
+    """ The weight of each word in a story's indexed ``text``.
+    """
+    weights = {}
+    for field, weight in WEIGHTS.items():
+        for word in tokenize(text.get(field)):
+            weights[word] = weights.get(word, 0) + weight
+    return weights
+
+def fingerprint(text):
+    digest = sha1()
+    for field in sorted(WEIGHTS):
+        value = text.get(field) or u''
+        digest.update(value.encode('utf-8') + '\0')
+    # enough to tell one version of a story's text from the next
+    return digest.hexdigest()[:16]
+
+
+class SearchIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        self._clear()
+
+    @classmethod
+    def for_repository(cls, git_dir):
+        """ The index kept in ``git_dir``, or ``None`` outside a repository.
+        """
+        if not git_dir:
+            return None
+        return cls(os.path.join(git_dir, 'bushy', 'search'))
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.path, 'meta.json'))
+
+    def _load(self, name, default=None):
+        try:
+            f = open(os.path.join(self.path, name))
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return default
+
+    def _dump(self, name, data):
+        dump_json(os.path.join(self.path, name), data)
+
+    def _lock(self):
+        return lock(os.path.join(self.path, 'lock'))
+
+    def _clear(self):
+        self._count = None
+        self._files = {}
+
+    def _file(self, name):
+        if name not in self._files:
+            self._files[name] = self._load(name, {})
+        return self._files[name]
+
+    @property
+    def count(self):
+        """ The number of stories indexed.
+        """
+        if self._count is None:
+            self._count = self._load('meta.json', {}).get('count', 0)
+        return self._count
+
+    def docs(self, story_id):
+        """ The summaries of the stories in ``story_id``'s bucket, keyed by
+            id.
+        """
+        return self._file(os.path.join('docs', '%s.json' % bucket(story_id)))
+
+    def texts(self, story_id):
+        """ The indexed text of the stories in ``story_id``'s bucket, keyed
+            by id.
+        """
+        return self._file(os.path.join('text', '%s.json' % bucket(story_id)))
+
+    def postings(self, name):
+        """ The postings in the shard ``name``, keyed by word.
+        """
+        return self._file(os.path.join('terms', '%s.json' % name))
+
+    def reset(self, records):
+        """ Replace the index with one of ``records`` (as stored by
+            ``dump_fields``).
+        """
+        lock = self._lock()
+        try:
+            self._clear()
+            for directory in ('docs', 'terms', 'text'):
+                directory = os.path.join(self.path, directory)
+                if os.path.isdir(directory):
+                    for name in os.listdir(directory):
+                        os.remove(os.path.join(directory, name))
+            self._count = 0
+            self._update(dict((str(record['id']), record) for record in records))
+            # written even when there are no stories, so the index exists
+            self._dump('meta.json', {'count': self._count})
+        finally:
+            lock.close()
+
+    def update(self, changes):
+        """ Bring the index up to date with ``changes``, the changed fields
+            of each story keyed by its id, or ``None`` for a deleted story.
+            Fields which aren't given keep their indexed values.
+        """
+        if not changes:
+            return
+        lock = self._lock()
+        try:
+            # another process may have changed it since it was read
+            self._clear()
+            self._update(dict((str(story_id), fields) for story_id, fields in changes.items()))
+        finally:
+            lock.close()
+
+    def _update(self, changes):
+        dirty = set()
+        count = self.count
+        for story_id, fields in changes.items():
+            docs = self.docs(story_id)
+            doc = docs.get(story_id)
+            if fields is None:
+                if doc is not None:
+                    self._reindex(story_id, None, dirty)
+                    del docs[story_id]
+                    dirty.add(os.path.join('docs', '%s.json' % bucket(story_id)))
+                    self._count -= 1
+                continue
+            summary = dict(doc or {}, id=int(story_id))
+            summary.update((key, to_text(fields[key])) for key in SUMMARY_FIELDS[1:] if key in fields)
+            text = dict((key, to_text(fields[key])) for key in WEIGHTS if key in fields)
+            if text and len(text) < len(WEIGHTS) and doc is not None:
+                # only some of the text changed
+                text = dict(self.texts(story_id).get(story_id) or {}, **text)
+            if text and fingerprint(text) != summary.get('text'):
+                summary['text'] = fingerprint(text)
+                self._reindex(story_id, text, dirty)
+            if summary != doc:
+                if doc is None:
+                    self._count += 1
+                docs[story_id] = summary
+                dirty.add(os.path.join('docs', '%s.json' % bucket(story_id)))
+        for name in dirty:
+            self._dump(name, self._files[name])
+        if self._count != count:
+            self._dump('meta.json', {'count': self._count})
+
+    def _reindex(self, story_id, text, dirty):
+        """ Replace the postings of a story's old ``text`` with its new
+            ones, adding the files changed to ``dirty``.
+        """
+        texts = self.texts(story_id)
+        old = texts.get(story_id)
+        old_weights = old and weigh(old) or {}
+        new_weights = text is not None and weigh(text) or {}
+        shards = {}
+        for term in set(old_weights) | set(new_weights):
+            if old_weights.get(term) == new_weights.get(term):
+                continue
+            name = shard(term)
+            postings = shards.get(name)
+            if postings is None:
+                postings = shards[name] = self.postings(name)
+            if term in new_weights:
+                postings.setdefault(term, {})[story_id] = new_weights[term]
+            elif term in postings:
+                postings[term].pop(story_id, None)
+                if not postings[term]:
+                    del postings[term]
+        dirty.update(os.path.join('terms', '%s.json' % name) for name in shards)
+        if text is None:
+            texts.pop(story_id, None)
+        else:
+            texts[story_id] = text
+        dirty.add(os.path.join('text', '%s.json' % bucket(story_id)))
+
+    def _matches(self, term):
+        """ ``(postings, factor)`` for the indexed words matching ``term``:
+            the word itself, and the words it starts.
+        """
+        names = [shard(term)]
+        if len(term) < 2:
+            directory = os.path.join(self.path, 'terms')
+            prefix = names[0]
+            try:
+                names = [name[:-5] for name in os.listdir(directory)
+                         if name.startswith(prefix) and name.endswith('.json')]
+            except OSError:
+                names = []
+        for name in names:
+            for word, postings in self.postings(name).iteritems():
+                if word == term:
+                    yield postings, 1
+                elif word.startswith(term):
+                    yield postings, PREFIX_FACTOR
+
+    def search(self, query, limit=None):
+        """ The summaries of the stories containing every word of
+            ``query`` (or a word it starts), best first.
+        """
+        terms = tokenize(query)
+        total = self.count
+        if not terms or not total:
+            return []
+        scores = None
+        for term in terms:
+            ranks = {}
+            for postings, factor in self._matches(term):
+                idf = math.log(1 + float(total) / len(postings))
+                for story_id, weight in postings.iteritems():
+                    rank = factor * idf * weight / (weight + 1.5)
+                    if rank > ranks.get(story_id, 0):
+                        ranks[story_id] = rank
+            if scores is None:
+                scores = ranks
+            else:
+                scores = dict((story_id, score + ranks[story_id])
+                              for story_id, score in scores.iteritems() if story_id in ranks)
+            if not scores:
+                return []
+        hits = sorted(scores, key=lambda story_id: (-scores[story_id], int(story_id)))
+        if limit is not None:
+            hits = hits[:limit]
+        docs = [self.docs(story_id).get(story_id) for story_id in hits]
+        return [doc for doc in docs if doc is not None]
@@ -0,0 +1,159 @@
+""" A local copy of every story in a project, kept under ``.git/bushy/``.
+
+The mirror records the project version it reflects. Each command asks the
+tracker's activity feed for the changes since that version and applies
+them, rather than listing stories again; listings and single stories are
+then answered from the mirror. It is rebuilt from a full listing only when
+the feed can't account for every change since (e.g. older activity has been
+pruned, or more changed than fits in one request).
+
+Stories are kept in the order of the listing which built the mirror, i.e.
+Tracker's priority order, and are moved when the feed reports a move.
+"""
+
+import os
+import json
+from collections import namedtuple
+from bushy.util import to_text, dump_json
+
+__all__ = ['Change',
+           'Mirror',
+           ]
+
+# ``action`` is one of 'update', 'delete', 'move' (``fields`` holds the
+# ``before_id`` and / or ``after_id`` of the new position) or 'resync' for a
+# change which can't be applied without listing the stories again
+Change = namedtuple('Change', 'action story_id fields')
+
+# filters which can be answered from the mirror, and the fields they match
+FILTERS = {'state': 'current_state',
+           'type': 'story_type',
+           'owned_by': 'owned_by',
+           }
+
+
+class Mirror(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.order = []
+        self.stories = {}
+        self._loaded = False
+
+    @classmethod
+    def for_repository(cls, git_dir):
+        """ The mirror kept in ``git_dir``, or ``None`` outside a repository.
+        """
+        if not git_dir:
+            return None
+        return cls(os.path.join(git_dir, 'bushy', 'mirror'))
+
+    def load(self):
+        """ Read the stored mirror, if there is one. A mirror which can't be
+            read is treated as empty, so it is rebuilt.
+        """
+        if self._loaded:
+            return self
+        self._loaded = True
+        try:
+            f = open(self.path)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return self
+        self.version = data['version']
+        self.order = data['order']
+        self.stories = data['stories']
+        return self
+
+    def save(self):
+        dump_json(self.path, {'version': self.version,
+                              'order': self.order,
+                              'stories': self.stories,
+                              })
+
+    def reset(self, version, records):
+        """ Replace the contents with ``records``, in order, as of
+            ``version``.
+        """
+        self.version = version
+        self.order = [record['id'] for record in records]
+        self.stories = dict((str(record['id']), record) for record in records)
+        self._loaded = True
+
+    def get(self, story_id):
+        return self.stories.get(str(story_id))
+
+    def update(self, story_id, fields):
+        key = str(story_id)
+        if key not in self.stories:
+            # a new story, placed last until a move says otherwise
+            self.stories[key] = {'id': int(story_id)}
+            self.order.append(int(story_id))
+        self.stories[key].update(fields)
+
+    def remove(self, story_id):
+        if self.stories.pop(str(story_id), None) is not None:
+            self.order.remove(int(story_id))
+
+    def move(self, story_id, before_id=None, after_id=None):
+        """ Place a story ahead of ``before_id`` or following ``after_id``,
+            leaving it where it is if neither is in the mirror.
+        """
+        story_id = int(story_id)
+        if str(story_id) not in self.stories:
+            return
+        order = [other for other in self.order if other != story_id]
+        if before_id is not None and int(before_id) in order:
+            position = order.index(int(before_id))
+        elif after_id is not None and int(after_id) in order:
+            position = order.index(int(after_id)) + 1
+        else:
+            return
+        order.insert(position, story_id)
+        self.order = order
+
+    def apply(self, change):
+        if change.action == 'delete':
+            self.remove(change.story_id)
+        elif change.action == 'move':
+            self.move(change.story_id, **change.fields)
+        elif change.action == 'update':
+            self.update(change.story_id, change.fields)
+        else:
+            raise ValueError('Unable to apply a %s change' % change.action)
+
+    def query(self, qs):
+        """ Iterate over the records matching the filter ``qs`` in priority
+            order, or return ``None`` if it uses a filter the mirror can't
+            answer. ``state`` and ``type`` accept a comma separated list.
+        """
+        ids = None
+        tests = []
+        for key, value in qs.items():
+            if key == 'includedone':
+                continue # done stories are mirrored too
+            elif key == 'id':
+                ids = set(int(v) for v in str(value).split(',') if v.strip())
+            elif key == 'owned_by':
+                tests.append((FILTERS[key], set([to_text(value)])))
+            elif key in FILTERS:
+                tests.append((FILTERS[key], set(to_text(v).strip() for v in to_text(value).split(','))))
+            else:
+                return None
+        return self._query(ids, tests)
+
+    def _query(self, ids, tests):
+        stories = self.stories
+        for story_id in self.order:
+            if ids is not None and story_id not in ids:
+                continue
+            record = stories[str(story_id)]
+            for field, values in tests:
+                if to_text(record.get(field)) not in values:
+                    break
+            else:
+                yield record
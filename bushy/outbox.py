@@ -0,0 +1,178 @@
+""" A durable queue of changes waiting to be sent to the tracker.
+
+Changes are appended to a journal (``.git/bushy/outbox``) as JSON lines so
+a command doesn't have to wait on the tracker, and nothing is lost when it
+can't be reached. Once a change has been sent a line marking it done is
+appended; the journal is emptied when nothing is left pending.
+
+Changes to the same story are sent in the order they were made. Sending
+stops at the first change to a story which couldn't be delivered, so later
+ones aren't applied out of order. Such a change is marked as ``attempted``,
+as the tracker may have made it before the request failed.
+"""
+
+import os
+import json
+import time
+from bushy.util import lock
+
+__all__ = ['Outbox',
+           ]
+
+
+class Outbox(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.written = 0
+
+    @classmethod
+    def for_repository(cls, git_dir):
+        """ The outbox of the repository, or ``None`` outside of one.
+        """
+        if not git_dir:
+            return None
+        return cls(os.path.join(git_dir, 'bushy', 'outbox'))
+
+    def _open(self):
+        return lock(self.path, 'a+')
+
+    def _append(self, f, entry):
+        f.seek(0, os.SEEK_END)
+        f.write(json.dumps(entry, sort_keys=True) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+    def append(self, story, method, url, body, content_type=None, **extra):
+        """ Queue a request changing ``story``, returning its id. Any
+            ``extra`` values are kept with the entry for whoever sends it.
+        """
+        f = self._open()
+        try:
+            f.seek(0, os.SEEK_END)
+            # the offset is unique until the journal is emptied, which only
+            # happens once every entry is done
+            entry_id = f.tell()
+            entry = dict(extra)
+            entry.update({'id': entry_id,
+                          'story': story,
+                          'method': method,
+                          'url': url,
+                          'body': body,
+                          'content_type': content_type,
+                          'queued': time.time(),
+                          })
+            self._append(f, entry)
+        finally:
+            f.close()
+        self.written += 1
+        return entry_id
+
+    def _read(self, f):
+        f.seek(0)
+        entries = []
+        done = {}
+        attempted = set()
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue # a line cut short by a crash
+            if 'done' in record:
+                done[record['done']] = record.get('error')
+            elif 'attempted' in record:
+                attempted.add(record['attempted'])
+            else:
+                entries.append(record)
+        for entry in entries:
+            if entry['id'] in attempted:
+                entry['attempted'] = True
+        return entries, done
+
+    def pending(self):
+        """ The entries not yet done, in the order they were queued.
+        """
+        if not os.path.exists(self.path):
+            return []
+        f = self._open()
+        try:
+            entries, done = self._read(f)
+        finally:
+            f.close()
+        return [entry for entry in entries if entry['id'] not in done]
+
+    def attempted(self, entry_id):
+        """ Mark an entry as having been sent without knowing whether it
+            arrived.
+        """
+        f = self._open()
+        try:
+            self._append(f, {'attempted': entry_id})
+        finally:
+            f.close()
+
+    def done(self, entry_id, error=None):
+        """ Mark an entry as sent, or as given up on with ``error``.
+        """
+        f = self._open()
+        try:
+            record = {'done': entry_id}
+            if error is not None:
+                record['error'] = error
+            self._append(f, record)
+            entries, done = self._read(f)
+            if all(entry['id'] in done for entry in entries):
+                f.seek(0)
+                f.truncate()
+        finally:
+            f.close()
+
+    def lock(self):
+        """ Hold the lock for sending the queue, so two processes don't send
+            the same change. Returns the lock (close it to release), or
+            ``None`` if another process is already sending.
+        """
+        return lock(self.path + '.lock', blocking=False)
+
+    def flush(self, send, pool=None):
+        """ Send the pending entries with ``send(entry)``, which returns
+            ``None`` once the entry is delivered, ``False`` if it should be
+            retried later (it is marked as attempted) or an error message if
+            it can never succeed.
+            Stories are sent concurrently on ``pool`` if one is given.
+
+            Returns ``(sent, failed, remaining)`` lists of entries.
+        """
+        by_story = {}
+        order = []
+        for entry in self.pending():
+            if entry['story'] not in by_story:
+                by_story[entry['story']] = []
+                order.append(entry['story'])
+            by_story[entry['story']].append(entry)
+
+        def flush_story(entries):
+            sent, failed = [], []
+            for i, entry in enumerate(entries):
+                error = send(entry)
+                if error is False:
+                    self.attempted(entry['id'])
+                    return sent, failed, entries[i:]
+                self.done(entry['id'], error)
+                if error is None:
+                    sent.append(entry)
+                else:
+                    failed.append(dict(entry, error=error))
+            return sent, failed, []
+
+        queues = [by_story[story] for story in order]
+        if pool is not None:
+            results = pool.map(flush_story, queues)
+        else:
+            results = map(flush_story, queues)
+        sent, failed, remaining = [], [], []
+        for s, f, r in results:
+            sent.extend(s)
+            failed.extend(f)
+            remaining.extend(r)
+        return sent, failed, remaining
@@ -1,41 +1,174 @@
-from commands import getoutput
+""" Console script entry points. Each looks up the configured platform and
+runs its command class, importing the platform's module only once the
+configuration is known to be valid.
+"""
 
-SUPPORTED_PLATFORMS = ['pivotal',
-                       ]
+import os
+import sys
+from ConfigParser import RawConfigParser, Error as ConfigParserError
+from bushy import trace
+from bushy.config import get_config
 
-def feature():
-    platform = getoutput('git config --get bushy.platform')
-    platform = platform.strip()
+__all__ = ['bug',
+           'bushy',
+           'dispatch',
+           'feature',
+           'find_platforms',
+           'finish',
+           'run',
+           ]
 
-    if platform not in SUPPORTED_PLATFORMS:
-        raise NotImplementedError('The platform %s is not supported, please update your configuration with one of the following platforms: %s' % (platform, ', '.join(SUPPORTED_PLATFORMS)))
-    
-    api = __import__('bushy._%s' % platform, fromlist=['Feature'])
-    
-    command = api.Feature()
-    return command()
+# platforms shipped with bushy, found without scanning for entry points
+PLATFORMS = {'pivotal': 'bushy._pivotal',
+             }
 
-def bug():
-    platform = getoutput('git config --get bushy.platform')
-    platform = platform.strip()
+SUPPORTED_PLATFORMS = sorted(PLATFORMS)
+
+ENTRY_POINT_GROUP = 'bushy.platforms'
+
+
+def _metadata_dirs(path):
+    if path.endswith('.egg'):
+        # an egg directory on sys.path itself (zipped eggs can't be read
+        # without unpacking them, and are skipped)
+        yield os.path.join(path, 'EGG-INFO')
+        return
+    try:
+        names = os.listdir(path)
+    except OSError:
+        return
+    for name in names:
+        if name.endswith('.egg-info') or name.endswith('.dist-info'):
+            yield os.path.join(path, name)
+        elif name.endswith('.egg'):
+            yield os.path.join(path, name, 'EGG-INFO')
+
+
+def _entry_points():
+    """ ``(name, module name)`` for each platform registered by an installed
+        distribution under the ``bushy.platforms`` entry point group.
+
+        The distributions' ``entry_points.txt`` files are read directly, as
+        importing ``pkg_resources`` takes longer than a typical run.
+    """
+    found = []
+    seen = set()
+    for path in sys.path:
+        for metadata in _metadata_dirs(os.path.abspath(path or os.curdir)):
+            filename = os.path.join(metadata, 'entry_points.txt')
+            if filename in seen or not os.path.isfile(filename):
+                continue
+            seen.add(filename)
+            parser = RawConfigParser()
+            parser.optionxform = str
+            try:
+                parser.read(filename)
+            except ConfigParserError:
+                continue
+            if not parser.has_section(ENTRY_POINT_GROUP):
+                continue
+            for name, value in parser.items(ENTRY_POINT_GROUP):
+                # ``module`` or ``module:attribute``; only the module is used
+                found.append((name, value.split(':')[0].strip()))
+    return found
+
+
+def find_platforms():
+    """ A mapping of every available platform name to the module providing
+        its ``Feature``, ``Bug`` and ``Finish`` commands.
+    """
+    platforms = dict(_entry_points())
+    platforms.update(PLATFORMS)
+    return platforms
+
+
+def find_platform(platform):
+    if platform in PLATFORMS:
+        return PLATFORMS[platform]
+    platforms = find_platforms()
+    if platform not in platforms:
+        raise NotImplementedError('The platform %s is not supported, please update your configuration with one of the following platforms: %s' % (platform, ', '.join(sorted(platforms))))
+    return platforms[platform]
 
-    if platform not in SUPPORTED_PLATFORMS:
-        raise NotImplementedError('The platform %s is not supported, please update your configuration with one of the following platforms: %s' % (platform, ', '.join(SUPPORTED_PLATFORMS)))
-    
-    api = __import__('bushy._%s' % platform, fromlist=['Bug'])
 
-    command = api.Bug()
-    return command()
+def dispatch(name, platform=None, **kw):
+    """ Run the command class ``name`` (e.g. ``'Feature'``) of ``platform``,
+        by default the ``bushy.platform`` git setting. Keyword arguments are
+        passed on to the command class.
+    """
+    tracer = trace.start()
+    command = None
+    try:
+        with trace.span('command', name):
+            if platform is None:
+                platform = get_config().get('bushy.platform', '').strip()
+
+            module = find_platform(platform)
+            api = __import__(module, fromlist=[name])
+
+            command = getattr(api, name)(**kw)
+            try:
+                return command()
+            finally:
+                # commands of other platforms needn't provide it
+                close = getattr(command, 'close', None)
+                if close is not None:
+                    close()
+    finally:
+        trace.stop()
+        report(tracer, name, command)
+
+
+def report(tracer, name, command):
+    """ Print the command's timings if it was run with ``--profile``, and
+        append them to the ``bushy.trace-file`` if one is set.
+    """
+    options = getattr(command, 'options', None) or {}
+    if options.get('profile'):
+        sys.stderr.write(tracer.report('Profile of %s' % name))
+    path = get_config().get('bushy.trace-file')
+    if path:
+        try:
+            tracer.export(os.path.expanduser(path), command=name)
+        except IOError as e:
+            sys.stderr.write('Unable to write the trace to %s: %s\n' % (path, e))
+
+
+def run(name):
+    """ Run the command class ``name`` in the bushy daemon if one is
+        listening, otherwise in this process.
+    """
+    from bushy.daemon import call
+    status = call(name, sys.argv)
+    if status is None:
+        return dispatch(name)
+    return status
+
+
+# ``git bushy <subcommand>``
+SUBCOMMANDS = {'search': 'Search',
+               'sync': 'Sync',
+               }
+
+def feature():
+    return run('Feature')
+
+def bug():
+    return run('Bug')
 
 def finish():
-    platform = getoutput('git config --get bushy.platform')
-    platform = platform.strip()
+    return run('Finish')
 
-    if platform not in SUPPORTED_PLATFORMS:
-        raise NotImplementedError('The platform %s is not supported, please update your configuration with one of the following platforms: %s' % (platform, ', '.join(SUPPORTED_PLATFORMS)))
-    
-    api = __import__('bushy._%s' % platform, fromlist=['Finish'])
+def bushy():
+    """ ``git bushy <subcommand>``, for commands outside of the feature /
+        bug / finish cycle.
+    """
+    name = len(sys.argv) > 1 and sys.argv[1] or ''
+    if name not in SUBCOMMANDS:
+        sys.stderr.write('usage: git bushy <%s> [options]\n' % '|'.join(sorted(SUBCOMMANDS)))
+        return 2
+    return run(SUBCOMMANDS[name])
 
-    command = api.Finish()
-    return command()
 
+if __name__ == '__main__':
+    sys.exit(bushy())
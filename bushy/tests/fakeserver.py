@@ -0,0 +1,91 @@
+""" A local HTTP server for exercising the transport and tracker code
+without touching the network.
+"""
+
+import time
+import threading
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+
+class FakeServer(object):
+    """ Replies to each request with the next queued response (or the
+        default when the queue is empty) and records every request and
+        connection it receives.
+
+        A response may also be a callable taking the request
+        ``(method, path, headers, body)`` and returning a response.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.connections = 0
+        self.responses = []
+        self.default = (200, {}, '')
+        self.delay = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def respond(self, status=200, body='', headers=None, delay=0):
+        self.responses.append((status, headers or {}, body, delay))
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                BaseHTTPRequestHandler.setup(self)
+                with fake._lock:
+                    fake.connections += 1
+
+            def _handle(self):
+                length = int(self.headers.get('content-length') or 0)
+                body = self.rfile.read(length) if length else ''
+                request = (self.command, self.path, dict(self.headers), body)
+                with fake._lock:
+                    fake.requests.append(request)
+                    if fake.responses:
+                        response = fake.responses.pop(0)
+                    else:
+                        response = fake.default
+                if callable(response):
+                    response = response(request)
+                status, headers, body = response[:3]
+                delay = len(response) > 3 and response[3] or fake.delay
+                if delay:
+                    time.sleep(delay)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+            def handle_error(self, request, client_address):
+                # clients hanging up early (e.g. timeout tests) is expected
+                pass
+
+        self._server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self._server.serve_forever, args=(0.01,))
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,94 @@
+import unittest
+
+class TestTokenize(unittest.TestCase):
+    def _callFUT(self, text):
+        from bushy.backlog import tokenize
+        return tokenize(text)
+
+    def test_words(self):
+        self.assertEqual(self._callFUT('Log in with OAuth-2'), [u'log', u'in', u'with', u'oauth', u'2'])
+
+    def test_empty(self):
+        self.assertEqual(self._callFUT(None), [])
+        self.assertEqual(self._callFUT(''), [])
+
+    def test_unicode(self):
+        self.assertEqual(self._callFUT('Caf\xc3\xa9 menu'), [u'caf\xe9', u'menu'])
+
+
+class TestOneEdit(unittest.TestCase):
+    def _callFUT(self, a, b):
+        from bushy.backlog import one_edit
+        return one_edit(a, b)
+
+    def test_edits(self):
+        self.assertTrue(self._callFUT('login', 'logon'))
+        self.assertTrue(self._callFUT('login', 'logins'))
+        self.assertTrue(self._callFUT('login', 'lgin'))
+        self.assertFalse(self._callFUT('login', 'login'))
+        self.assertFalse(self._callFUT('login', 'logout'))
+
+
+class TestBacklog(unittest.TestCase):
+    def _makeOne(self):
+        from bushy.backlog import Backlog
+        from bushy._pivotal import EMPTY_STORY
+        stories = [EMPTY_STORY._replace(id=1, name='Login page', description='A form to sign in',
+                                        estimate=2, labels='ui,needs design'),
+                   EMPTY_STORY._replace(id=2, name='Logout', owned_by='Mr Test', estimate=1),
+                   EMPTY_STORY._replace(id=3, name='Export reports', description='Login required',
+                                        estimate=2, labels='reports'),
+                   ]
+        return Backlog(stories)
+
+    def _ids(self, stories):
+        return [story.id for story in stories]
+
+    def test_empty_query(self):
+        backlog = self._makeOne()
+
+        self.assertEqual(self._ids(backlog.search('')), [1, 2, 3])
+        self.assertEqual(self._ids(backlog.search('', limit=2)), [1, 2])
+        self.assertEqual(len(backlog), 3)
+
+    def test_prefix(self):
+        backlog = self._makeOne()
+
+        # a match in the name ranks above one in the description
+        self.assertEqual(self._ids(backlog.search('login')), [1, 3])
+        self.assertEqual(self._ids(backlog.search('log')), [1, 2, 3])
+        self.assertEqual(self._ids(backlog.search('LOGIN form')), [1])
+        self.assertEqual(self._ids(backlog.search('missing')), [])
+
+    def test_fields(self):
+        backlog = self._makeOne()
+
+        self.assertEqual(self._ids(backlog.search('label:ui')), [1])
+        self.assertEqual(self._ids(backlog.search('label:design')), [1])
+        self.assertEqual(self._ids(backlog.search('owner:test')), [2])
+        self.assertEqual(self._ids(backlog.search('estimate:2')), [1, 3])
+        self.assertEqual(self._ids(backlog.search('estimate:2 export')), [3])
+        # an unknown field is searched for as words
+        self.assertEqual(self._ids(backlog.search('reports:')), [3])
+
+    def test_typo(self):
+        backlog = self._makeOne()
+
+        self.assertEqual(self._ids(backlog.search('exprot')), [])
+        self.assertEqual(self._ids(backlog.search('reprts')), [3])
+
+    def test_memo(self):
+        backlog = self._makeOne()
+
+        hits = backlog.match('log')
+
+        self.assertTrue(backlog.match('log') is hits)
+
+    def test_discard(self):
+        backlog = self._makeOne()
+
+        backlog.discard(1)
+
+        self.assertEqual(self._ids(backlog.search('login')), [3])
+        self.assertEqual(self._ids(backlog.search('')), [2, 3])
+        self.assertEqual(len(backlog), 2)
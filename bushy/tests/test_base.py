@@ -8,15 +8,16 @@ class TestBase(unittest.TestCase):
         self._input = StringIO()
         self._output = StringIO()
         
-    def _patch_getoutput(self, value):
+    def _patch_run(self):
         import bushy.base
-        self._getoutput = bushy.base.getoutput
-        bushy.base.getoutput = lambda x: x
+        from bushy.git import Result
+        self._run = bushy.base.run
+        bushy.base.run = lambda argv: Result(0, ' '.join(argv), '')
 
     def tearDown(self):
-        if hasattr(self, '_getoutput'):
+        if hasattr(self, '_run'):
             import bushy.base
-            bushy.base.getoutput = self._getoutput
+            bushy.base.run = self._run
     
     def _makeOne(self, args):
         return DummyBase(self._input, self._output, args)
@@ -94,24 +95,44 @@ class TestBase(unittest.TestCase):
         self.assertEqual(out, 'hello world\n')
 
     def test_sys(self):
-        self._patch_getoutput('')
+        self._patch_run()
         base = self._makeOne([])
 
-        self.assertEqual(base.sys('foo'), 'foo')
+        self.assertEqual(base.sys('foo', 'bar').out, 'foo bar')
         self._output.seek(0)
         out = self._output.read()
         self.assertEqual(out, '')
     
     def test_sys_verbose(self):
-        self._patch_getoutput('')
+        self._patch_run()
         base = self._makeOne([])
 
         base.options['verbose'] = True
 
-        self.assertEqual(base.sys('foo'), 'foo')
+        self.assertEqual(base.sys('foo', 'bar').out, 'foo bar')
         self._output.seek(0)
         out = self._output.read()
-        self.assertEqual(out, 'Running command: foo\n')
+        self.assertEqual(out, 'Running command: foo bar\n')
+
+    def test_sys_no_shell(self):
+        base = self._makeOne([])
+
+        result = base.sys('echo', '$HOME; false')
+
+        self.assertEqual(result.status, 0)
+        self.assertEqual(result.out, '$HOME; false\n')
+
+    def test_git(self):
+        self._patch_run()
+        base = self._makeOne([])
+
+        base.options['verbose'] = True
+
+        self.assertTrue(base.git is base.git)
+        self.assertEqual(base.git('checkout', 'master').out, 'git checkout master')
+        self._output.seek(0)
+        out = self._output.read()
+        self.assertEqual(out, 'Running command: git checkout master\n')
         
 
 class DummyBase(Base):
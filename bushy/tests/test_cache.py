@@ -0,0 +1,158 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+class TestStoryCache(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def _makeOne(self, **kw):
+        from bushy.cache import StoryCache
+        return StoryCache(os.path.join(self._tmpdir, 'stories'), **kw)
+
+    def _age(self, cache, key, seconds):
+        filename = cache.filename(key)
+        mtime = time.time() - seconds
+        os.utime(filename, (mtime, mtime))
+
+    def test_miss(self):
+        cache = self._makeOne()
+
+        self.assertEqual(cache.get('url'), None)
+
+    def test_put_get(self):
+        cache = self._makeOne()
+
+        cache.put('url', [{'id': 1}], etag='"abc"', last_modified='yesterday')
+        entry = cache.get('url')
+
+        self.assertEqual(entry['records'], [{'id': 1}])
+        self.assertEqual(entry['etag'], '"abc"')
+        self.assertEqual(entry['last_modified'], 'yesterday')
+        self.assertEqual(cache.get('other'), None)
+
+    def test_expired(self):
+        cache = self._makeOne(ttl=60)
+
+        cache.put('url', [])
+        self._age(cache, 'url', 120)
+
+        self.assertEqual(cache.get('url'), None)
+        self.assertFalse(os.path.exists(cache.filename('url')))
+
+    def test_touch(self):
+        cache = self._makeOne(ttl=60)
+
+        cache.put('url', [])
+        self._age(cache, 'url', 120)
+        cache.touch('url')
+
+        self.assertNotEqual(cache.get('url'), None)
+
+    def test_corrupt(self):
+        cache = self._makeOne()
+
+        cache.put('url', [])
+        f = open(cache.filename('url'), 'w')
+        f.write('{not json')
+        f.close()
+
+        self.assertEqual(cache.get('url'), None)
+
+    def test_evict_size(self):
+        cache = self._makeOne(size=2)
+
+        cache.put('a', [])
+        self._age(cache, 'a', 30)
+        cache.put('b', [])
+        self._age(cache, 'b', 20)
+        cache.put('c', [])
+
+        self.assertEqual(cache.get('a'), None)
+        self.assertNotEqual(cache.get('b'), None)
+        self.assertNotEqual(cache.get('c'), None)
+
+    def test_evict_expired(self):
+        cache = self._makeOne(ttl=60)
+
+        cache.put('a', [])
+        self._age(cache, 'a', 120)
+        cache.put('b', [])
+
+        self.assertFalse(os.path.exists(cache.filename('a')))
+
+    def test_unwritable(self):
+        from bushy.cache import StoryCache
+        path = os.path.join(self._tmpdir, 'file')
+        open(path, 'w').close()
+        cache = StoryCache(os.path.join(path, 'stories'))
+
+        self.assertEqual(cache.put('url', []), None)
+        self.assertEqual(cache.get('url'), None)
+
+    def test_lookup(self):
+        cache = self._makeOne()
+
+        cache.put('list', [{'id': 1, 'name': 'one'}, {'id': 2, 'name': 'two'}])
+
+        self.assertEqual(cache.lookup(2), {'id': 2, 'name': 'two'})
+        self.assertEqual(cache.lookup('1'), {'id': 1, 'name': 'one'})
+        self.assertEqual(cache.lookup(3), None)
+
+    def test_lookup_replaced(self):
+        cache = self._makeOne()
+
+        cache.put('list', [{'id': 1}, {'id': 2}])
+        cache.put('other', [{'id': 2, 'name': 'newer'}])
+        cache.put('list', [{'id': 1}])
+
+        self.assertEqual(cache.lookup(2), {'id': 2, 'name': 'newer'})
+        self.assertEqual(cache.lookup(1), {'id': 1})
+
+    def test_lookup_concurrent(self):
+        import threading
+        cache = self._makeOne()
+
+        threads = [threading.Thread(target=cache.put, args=('list%d' % i, [{'id': i}]))
+                   for i in range(1, 21)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # no listing was lost from the index
+        for i in range(1, 21):
+            self.assertEqual(self._makeOne().lookup(i), {'id': i})
+
+    def test_lookup_evicted(self):
+        cache = self._makeOne(ttl=60)
+
+        cache.put('list', [{'id': 1}])
+        self._age(cache, 'list', 120)
+
+        self.assertEqual(cache.lookup(1), None)
+
+    def test_lookup_dropped(self):
+        cache = self._makeOne()
+
+        cache.put('list', [{'id': 1}, {'id': 2}])
+        cache.put('list', [{'id': 1}])
+
+        # only the ids of the rewritten listing are indexed
+        self.assertEqual(sorted(os.listdir(os.path.join(cache.path, 'ids'))), ['1'])
+        self.assertEqual(cache.lookup(2), None)
+        self.assertEqual(cache.lookup('not an id'), None)
+
+    def test_lookup_stale(self):
+        cache = self._makeOne()
+
+        cache.put('list', [{'id': 1}])
+        os.remove(cache.filename('list'))
+
+        self.assertEqual(cache.lookup(1), None)
+        self.assertFalse(os.path.exists(os.path.join(cache.path, 'ids', '1')))
@@ -0,0 +1,85 @@
+import unittest
+
+class TestGitConfig(unittest.TestCase):
+    def _makeOne(self, raw):
+        from bushy.config import GitConfig
+        return GitConfig.parse(raw)
+
+    def test_parse(self):
+        config = self._makeOne('bushy.platform\npivotal\0'
+                               'bushy-pivotal.full-name\nMr Test\0')
+
+        self.assertEqual(config.get('bushy.platform'), 'pivotal')
+        self.assertEqual(config.get('bushy-pivotal.full-name'), 'Mr Test')
+        self.assertEqual(config.get('bushy-pivotal.api-token'), None)
+        self.assertEqual(config.get('bushy-pivotal.api-token', 'x'), 'x')
+
+    def test_parse_empty(self):
+        config = self._makeOne('')
+
+        self.assertEqual(config.values, {})
+
+    def test_parse_multiline_value(self):
+        config = self._makeOne('alias.lg\nlog\n--graph\0')
+
+        self.assertEqual(config.get('alias.lg'), 'log\n--graph')
+
+    def test_parse_override(self):
+        config = self._makeOne('bushy.platform\nglobal\0'
+                               'bushy.platform\nlocal\0')
+
+        self.assertEqual(config.get('bushy.platform'), 'local')
+
+    def test_bare_key(self):
+        config = self._makeOne('bushy-pivotal.only-mine\0')
+
+        self.assertTrue('bushy-pivotal.only-mine' in config)
+        self.assertEqual(config.get('bushy-pivotal.only-mine'), '')
+        self.assertEqual(config.get_bool('bushy-pivotal.only-mine'), True)
+
+    def test_get_bool(self):
+        config = self._makeOne('a.yes\nYes\0a.on\non\0a.one\n1\0'
+                               'a.no\nfalse\0a.empty\n\0a.bad\nmaybe\0')
+
+        self.assertEqual(config.get_bool('a.yes'), True)
+        self.assertEqual(config.get_bool('a.on'), True)
+        self.assertEqual(config.get_bool('a.one'), True)
+        self.assertEqual(config.get_bool('a.no'), False)
+        self.assertEqual(config.get_bool('a.empty'), False)
+        self.assertEqual(config.get_bool('a.missing'), False)
+        self.assertEqual(config.get_bool('a.missing', True), True)
+        self.assertRaises(ValueError, config.get_bool, 'a.bad')
+
+    def test_get_int(self):
+        config = self._makeOne('a.plain\n300\0a.kilo\n2k\0a.bad\nlots\0')
+
+        self.assertEqual(config.get_int('a.plain'), 300)
+        self.assertEqual(config.get_int('a.kilo'), 2048)
+        self.assertEqual(config.get_int('a.missing'), None)
+        self.assertEqual(config.get_int('a.missing', 5), 5)
+        self.assertRaises(ValueError, config.get_int, 'a.bad')
+
+
+class TestGetConfig(unittest.TestCase):
+    def setUp(self):
+        import bushy.config
+        self._config = bushy.config._config
+        self._read = bushy.config.GitConfig.read
+        self.reads = []
+        def read():
+            self.reads.append(1)
+            return bushy.config.GitConfig({'bushy.platform': 'pivotal'})
+        bushy.config._config = None
+        bushy.config.GitConfig.read = staticmethod(read)
+
+    def tearDown(self):
+        import bushy.config
+        bushy.config._config = self._config
+        bushy.config.GitConfig.read = self._read
+
+    def test_snapshot(self):
+        from bushy.config import get_config
+
+        self.assertEqual(get_config().get('bushy.platform'), 'pivotal')
+        self.assertEqual(get_config().get('bushy.platform'), 'pivotal')
+        self.assertEqual(len(self.reads), 1)
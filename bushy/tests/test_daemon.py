@@ -0,0 +1,209 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from StringIO import StringIO
+
+class Feature(object):
+    """ A dummy platform command, run by the daemon in place of the real
+        ones.
+    """
+
+    def __init__(self, input=sys.stdin, output=sys.stdout, args=sys.argv):
+        self.output = output
+        self.args = args
+
+    def __call__(self):
+        self.output.write('args: %s\n' % ' '.join(self.args[1:]))
+        self.output.write('cwd: %s\n' % os.path.basename(os.getcwd()))
+        self.output.write('env: %s\n' % os.environ.get('GIT_BUSHY_TEST'))
+        if '--ask' in self.args:
+            name = raw_input('Name: ')
+            self.output.write('Hello %s\n' % name)
+        if '--exit' in self.args:
+            sys.exit(3)
+        if '--fail' in self.args:
+            raise ValueError('failed')
+
+class TestDaemon(unittest.TestCase):
+    def setUp(self):
+        import bushy.config
+        import bushy.scripts
+        self._tmpdir = tempfile.mkdtemp()
+        self._config = bushy.config._config
+        self._platforms = bushy.scripts.PLATFORMS.copy()
+        bushy.scripts.PLATFORMS['dummy'] = 'bushy.tests.test_daemon'
+        self.path = os.path.join(self._tmpdir, 'run', 'bushy.sock')
+        self.cwd = os.path.join(self._tmpdir, 'project')
+        os.mkdir(self.cwd)
+        f = open(os.path.join(self._tmpdir, 'config'), 'w')
+        f.write('[bushy]\n\tplatform = dummy\n')
+        f.close()
+        self._environ = os.environ.copy()
+        os.environ['GIT_CONFIG'] = os.path.join(self._tmpdir, 'config')
+
+    def tearDown(self):
+        import bushy.config
+        import bushy.scripts
+        os.environ.clear()
+        os.environ.update(self._environ)
+        bushy.config._config = self._config
+        bushy.scripts.PLATFORMS.clear()
+        bushy.scripts.PLATFORMS.update(self._platforms)
+        shutil.rmtree(self._tmpdir)
+
+    def _makeOne(self, **kw):
+        from bushy.daemon import Daemon
+        daemon = Daemon(self.path, **kw)
+        daemon.bind()
+        thread = threading.Thread(target=daemon.serve)
+        thread.daemon = True
+        thread.start()
+        return daemon, thread
+
+    def _stop(self, daemon, thread):
+        import socket
+        daemon.idle_timeout = 0.01
+        # wake the daemon up so it notices the shorter timeout
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        sock.close()
+        thread.join(1)
+
+    def _callFUT(self, argv, input=''):
+        from bushy.daemon import call
+        stdout = StringIO()
+        stderr = StringIO()
+        cwd = os.getcwd()
+        os.chdir(self.cwd)
+        try:
+            status = call('Feature', ['git-feature'] + argv, self.path,
+                          stdin=StringIO(input), stdout=stdout, stderr=stderr)
+        finally:
+            os.chdir(cwd)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def test_no_daemon(self):
+        self.assertEqual(self._callFUT([]), (None, '', ''))
+
+    def test_socket_path(self):
+        from bushy.daemon import socket_path
+        os.environ['XDG_RUNTIME_DIR'] = '/run/user/1000'
+        self.assertEqual(socket_path('/repo/.git'), '/run/user/1000/bushy.sock')
+        del os.environ['XDG_RUNTIME_DIR']
+        self.assertEqual(socket_path('/repo/.git'), '/repo/.git/bushy/daemon/bushy.sock')
+        self.assertEqual(socket_path(''), None)
+
+    def test_bind_private(self):
+        import stat
+        daemon, thread = self._makeOne()
+        self._stop(daemon, thread)
+
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode), 0700)
+
+    def test_shared_directory(self):
+        from bushy.daemon import Daemon
+        daemon, thread = self._makeOne()
+        os.chmod(os.path.dirname(self.path), 0755)
+
+        status, out, err = self._callFUT([])
+        self.assertRaises(RuntimeError, Daemon(self.path).bind)
+        os.chmod(os.path.dirname(self.path), 0700)
+        self._stop(daemon, thread)
+
+        # the socket isn't trusted when others could have replaced it
+        self.assertEqual(status, None)
+        self.assertTrue(err.startswith('Not using the bushy daemon: '))
+
+    def test_not_a_socket(self):
+        os.mkdir(os.path.dirname(self.path), 0700)
+        open(self.path, 'w').close()
+
+        status, out, err = self._callFUT([])
+
+        self.assertEqual(status, None)
+        self.assertTrue(err.endswith('must be a socket owned by you\n'))
+
+    def test_stale_socket(self):
+        import socket
+        os.mkdir(os.path.dirname(self.path), 0700)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.close()
+
+        self.assertEqual(self._callFUT([]), (None, '', ''))
+
+        daemon, thread = self._makeOne()
+        self.assertEqual(self._callFUT([])[0], 0)
+        self._stop(daemon, thread)
+
+    def test_already_running(self):
+        from bushy.daemon import Daemon
+        daemon, thread = self._makeOne()
+
+        self.assertRaises(RuntimeError, Daemon(self.path).bind)
+        self._stop(daemon, thread)
+
+    def test_call(self):
+        os.environ['GIT_BUSHY_TEST'] = 'from client'
+        daemon, thread = self._makeOne()
+
+        status, out, err = self._callFUT(['-s', '12345'])
+        os.environ['GIT_BUSHY_TEST'] = 'changed'
+        second = self._callFUT([])
+        self._stop(daemon, thread)
+
+        self.assertEqual(status, 0)
+        self.assertEqual(out, 'args: -s 12345\ncwd: project\nenv: from client\n')
+        self.assertEqual(err, '')
+        self.assertEqual(second[1], 'args: \ncwd: project\nenv: changed\n')
+        # the daemon's own state is restored afterwards
+        self.assertTrue(sys.stdout is not None and not hasattr(sys.stdout, 'conn'))
+        self.assertFalse(thread.isAlive())
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_environment(self):
+        os.environ['GIT_BUSHY_TEST'] = 'from client'
+        os.environ['TRACKER_TOKEN'] = 'secret'
+        daemon, thread = self._makeOne()
+        requests = []
+        run = daemon.run
+        daemon.run = lambda request, conn: requests.append(request) or run(request, conn)
+
+        self._callFUT([])
+        self._stop(daemon, thread)
+
+        # only the variables the commands read are sent to the daemon
+        env = requests[0]['env']
+        self.assertEqual(env['GIT_BUSHY_TEST'], 'from client')
+        self.assertEqual(env['PATH'], os.environ['PATH'])
+        self.assertFalse('TRACKER_TOKEN' in env)
+
+    def test_input(self):
+        daemon, thread = self._makeOne()
+
+        status, out, err = self._callFUT(['--ask'], input='Mr Test\n')
+        self._stop(daemon, thread)
+
+        self.assertEqual(out.splitlines()[-1], 'Name: Hello Mr Test')
+
+    def test_exit_status(self):
+        daemon, thread = self._makeOne()
+
+        exited = self._callFUT(['--exit'])
+        failed = self._callFUT(['--fail'])
+        self._stop(daemon, thread)
+
+        self.assertEqual(exited[0], 3)
+        self.assertEqual(failed[0], 1)
+        self.assertTrue(failed[2].endswith('ValueError: failed\n'))
+
+    def test_idle_timeout(self):
+        daemon, thread = self._makeOne(idle_timeout=0.01)
+
+        thread.join(1)
+
+        self.assertFalse(thread.isAlive())
+        self.assertFalse(os.path.exists(self.path))
@@ -0,0 +1,186 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestRun(unittest.TestCase):
+    def _callFUT(self, argv):
+        from bushy.git import run
+        return run(argv)
+
+    def test_output(self):
+        result = self._callFUT(['git', '--version'])
+
+        self.assertTrue(result.ok)
+        self.assertTrue(result.out.startswith('git version'))
+        self.assertEqual(result.err, '')
+
+    def test_error(self):
+        result = self._callFUT(['git', 'not-a-command'])
+
+        self.assertFalse(result.ok)
+        self.assertNotEqual(result.err, '')
+
+    def test_missing(self):
+        result = self._callFUT(['/no/such/command'])
+
+        self.assertEqual(result.status, 127)
+
+
+class TestGit(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self.repo = os.path.join(self._tmpdir, 'repo')
+        os.mkdir(self.repo)
+        self._environ = os.environ.pop('GIT_DIR', None)
+        git = self._makeOne(self.repo)
+        git('init', '-q')
+        git('symbolic-ref', 'HEAD', 'refs/heads/master')
+        git('-c', 'user.name=Test', '-c', 'user.email=test@example.com',
+            'commit', '-q', '--allow-empty', '-m', 'initial')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+        if self._environ is not None:
+            os.environ['GIT_DIR'] = self._environ
+
+    def _makeOne(self, path):
+        from bushy.git import Git, run
+        return Git(runner=lambda argv: run(argv, cwd=path), path=path)
+
+    def test_git_dir(self):
+        subdir = os.path.join(self.repo, 'a', 'b')
+        os.makedirs(subdir)
+        git = self._makeOne(subdir)
+
+        self.assertEqual(git.git_dir, os.path.join(self.repo, '.git'))
+        self.assertEqual(git.common_dir, os.path.join(self.repo, '.git'))
+
+    def test_no_repository(self):
+        git = self._makeOne(self._tmpdir)
+        git._find_git_dir = lambda: None
+
+        self.assertEqual(git.git_dir, None)
+        self.assertEqual(git.packed_refs(), {})
+
+    def test_current_branch(self):
+        git = self._makeOne(self.repo)
+
+        self.assertEqual(git.current_branch(), 'master')
+
+        git('checkout', '-q', '-b', '12345-feature')
+
+        self.assertEqual(git.current_branch(), '12345-feature')
+
+    def test_detached(self):
+        git = self._makeOne(self.repo)
+        git('checkout', '-q', '--detach')
+
+        self.assertEqual(git.current_branch(), '')
+
+    def test_branch_exists(self):
+        git = self._makeOne(self.repo)
+        git('branch', 'loose')
+        git('branch', 'packed')
+        git('pack-refs', '--all')
+        git('branch', 'loose-after-pack')
+
+        self.assertTrue(git.branch_exists('master'))
+        self.assertTrue(git.branch_exists('packed'))
+        self.assertTrue(git.branch_exists('loose-after-pack'))
+        self.assertFalse(git.branch_exists('pack'))
+        self.assertFalse(git.branch_exists('missing'))
+        self.assertTrue('refs/heads/packed' in git.packed_refs())
+
+    def test_worktree(self):
+        git = self._makeOne(self.repo)
+        worktree = os.path.join(self._tmpdir, 'worktree')
+        result = git('worktree', 'add', '-q', '-b', '12345-feature', worktree)
+        if not result.ok: # pragma: no cover
+            return # git too old for worktrees
+
+        git = self._makeOne(worktree)
+
+        self.assertEqual(git.current_branch(), '12345-feature')
+        self.assertEqual(os.path.realpath(git.common_dir),
+                         os.path.realpath(os.path.join(self.repo, '.git')))
+        self.assertTrue(git.branch_exists('master'))
+
+    def test_head_read_once(self):
+        git = self._makeOne(self.repo)
+        reads = []
+        read_file = git._read_file
+        git._read_file = lambda filename: reads.append(filename) or read_file(filename)
+
+        self.assertEqual(git.head.ref, 'refs/heads/master')
+        self.assertEqual(git.current_branch(), 'master')
+        self.assertFalse(git.detached)
+        self.assertEqual(len([r for r in reads if r.endswith('HEAD')]), 1)
+
+    def test_head_after_command(self):
+        git = self._makeOne(self.repo)
+        self.assertEqual(git.current_branch(), 'master')
+
+        git('checkout', '-q', '-b', '12345-feature')
+
+        self.assertEqual(git.current_branch(), '12345-feature')
+
+    def test_head_detached(self):
+        git = self._makeOne(self.repo)
+        sha = git('rev-parse', 'HEAD').out.strip()
+        git('checkout', '-q', '--detach')
+
+        self.assertTrue(git.detached)
+        self.assertEqual(git.head.sha, sha)
+
+    def test_head_symlink(self):
+        git = self._makeOne(self.repo)
+        head = os.path.join(self.repo, '.git', 'HEAD')
+        os.remove(head)
+        os.symlink('refs/heads/master', head)
+
+        self.assertEqual(git.current_branch(), 'master')
+
+    def test_branches(self):
+        git = self._makeOne(self.repo)
+        git('branch', 'packed')
+        git('branch', 'topic/packed')
+        git('pack-refs', '--all')
+        git('branch', 'topic/loose')
+        git('branch', '-D', 'packed')
+
+        self.assertEqual(git.branches, set(['master', 'topic/packed', 'topic/loose']))
+
+    def test_branches_indexed_once(self):
+        git = self._makeOne(self.repo)
+        reads = []
+        read_branches = git._read_branches
+        git._read_branches = lambda: reads.append(1) or read_branches()
+
+        git.branch_exists('master')
+        git.branch_exists('missing')
+        git.story_branches(12345)
+        self.assertEqual(len(reads), 1)
+
+        git('branch', 'new')
+
+        self.assertTrue(git.branch_exists('new'))
+        self.assertEqual(len(reads), 2)
+
+    def test_story_branches(self):
+        git = self._makeOne(self.repo)
+        git('branch', '123-feature')
+        git('branch', '1123-feature')
+        git('branch', '123-login-form')
+        git('branch', '1234-bug')
+
+        self.assertEqual(git.story_branches(123), ['123-feature', '123-login-form'])
+        self.assertEqual(git.story_branches('1123'), ['1123-feature'])
+        self.assertEqual(git.story_branches(12), [])
+
+    def test_branches_without_git_dir(self):
+        git = self._makeOne(self.repo)
+        git._git_dir = git._common_dir = None
+        git('branch', '123-feature')
+
+        self.assertEqual(git.branches, set(['master', '123-feature']))
@@ -0,0 +1,124 @@
+import unittest
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._tmpdir)
+
+    def _makeOne(self):
+        import os
+        from bushy.index import SearchIndex
+        return SearchIndex(os.path.join(self._tmpdir, 'bushy', 'search'))
+
+    def _makeFilled(self):
+        index = self._makeOne()
+        index.reset([{'id': 1, 'story_type': 'feature', 'current_state': 'unstarted',
+                      'name': 'Login page', 'description': 'A form to sign in', 'notes': ''},
+                     {'id': 2, 'story_type': 'bug', 'current_state': 'started',
+                      'name': 'Export fails', 'description': 'The login token expires',
+                      'notes': 'Seen on the reports page\nAnd the login page'},
+                     {'id': 3, 'story_type': 'chore', 'current_state': 'accepted',
+                      'name': 'Upgrade the server', 'description': None, 'notes': ''},
+                     ])
+        return index
+
+    def _ids(self, hits):
+        return [hit['id'] for hit in hits]
+
+    def test_for_repository(self):
+        import os
+        from bushy.index import SearchIndex
+
+        self.assertEqual(SearchIndex.for_repository(None), None)
+        self.assertEqual(SearchIndex.for_repository(self._tmpdir).path,
+                         os.path.join(self._tmpdir, 'bushy', 'search'))
+
+    def test_exists(self):
+        index = self._makeOne()
+        self.assertFalse(index.exists())
+
+        index.reset([])
+
+        self.assertTrue(index.exists())
+        self.assertEqual(index.search('login'), [])
+
+    def test_search(self):
+        self._makeFilled()
+        index = self._makeOne()
+
+        # a word in the name counts for more than in the description or notes
+        self.assertEqual(self._ids(index.search('login')), [1, 2])
+        self.assertEqual(self._ids(index.search('login reports')), [2])
+        self.assertEqual(self._ids(index.search('LOGIN', limit=1)), [1])
+        self.assertEqual(self._ids(index.search('missing')), [])
+        self.assertEqual(index.search(''), [])
+        hit = index.search('upgrade')[0]
+        self.assertEqual((hit['story_type'], hit['current_state'], hit['name']),
+                         ('chore', 'accepted', 'Upgrade the server'))
+
+    def test_prefix(self):
+        index = self._makeFilled()
+
+        self.assertEqual(self._ids(index.search('exp')), [2])
+        self.assertEqual(self._ids(index.search('e')), [2])
+        # the whole word ranks above one it starts
+        self.assertEqual(self._ids(index.search('page')), [1, 2])
+
+    def test_shards(self):
+        import os
+        from bushy.index import shard
+        index = self._makeFilled()
+
+        self.assertEqual(shard(u'login'), '6c6f')
+        self.assertTrue(os.path.exists(os.path.join(index.path, 'terms', '6c6f.json')))
+        self.assertEqual(self._makeOne().postings('6c6f')[u'login'], {'1': 3, '2': 2})
+
+    def test_update(self):
+        index = self._makeFilled()
+
+        index.update({1: {'name': 'Sign in page', 'current_state': 'started'},
+                      3: {'notes': 'Login to the server first'},
+                      })
+
+        index = self._makeOne()
+        self.assertEqual(self._ids(index.search('login')), [2, 3])
+        self.assertEqual(self._ids(index.search('sign')), [1])
+        # the description wasn't changed
+        self.assertEqual(self._ids(index.search('form')), [1])
+        self.assertEqual(index.search('sign')[0]['current_state'], 'started')
+
+    def test_update_new(self):
+        index = self._makeFilled()
+
+        index.update({4: {'name': 'Logout', 'story_type': 'feature'}})
+
+        self.assertEqual(self._ids(self._makeOne().search('logout')), [4])
+        self.assertEqual(self._makeOne().count, 4)
+
+    def test_update_delete(self):
+        index = self._makeFilled()
+
+        index.update({2: None, 5: None})
+
+        index = self._makeOne()
+        self.assertEqual(self._ids(index.search('login')), [1])
+        self.assertEqual(index.postings('6578').get(u'export'), None)
+        self.assertEqual(index.count, 2)
+
+    def test_update_unchanged(self):
+        import os
+        index = self._makeFilled()
+        text = os.path.join(index.path, 'text', '1.json')
+        os.utime(text, (0, 0))
+
+        index.update({1: {'name': 'Login page', 'description': 'A form to sign in', 'notes': ''}})
+        self.assertEqual(os.path.getmtime(text), 0)
+
+        # only the summary changed
+        index.update({1: {'name': 'Login page', 'current_state': 'finished'}})
+        self.assertEqual(os.path.getmtime(text), 0)
+        self.assertEqual(self._makeOne().search('login')[0]['current_state'], 'finished')
@@ -0,0 +1,109 @@
+import unittest
+
+class TestMirror(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._tmpdir)
+
+    def _makeOne(self):
+        import os
+        from bushy.mirror import Mirror
+        return Mirror(os.path.join(self._tmpdir, 'bushy', 'mirror'))
+
+    def _makeFilled(self):
+        mirror = self._makeOne()
+        mirror.reset(10, [{'id': 1, 'current_state': 'unstarted', 'story_type': 'feature', 'owned_by': u''},
+                          {'id': 2, 'current_state': 'started', 'story_type': 'bug', 'owned_by': u'Mr Test'},
+                          {'id': 3, 'current_state': 'unstarted', 'story_type': 'bug', 'owned_by': u'Mr Test'},
+                          ])
+        return mirror
+
+    def _ids(self, records):
+        return [record['id'] for record in records]
+
+    def test_for_repository(self):
+        import os
+        from bushy.mirror import Mirror
+
+        self.assertEqual(Mirror.for_repository(None), None)
+        self.assertEqual(Mirror.for_repository(self._tmpdir).path,
+                         os.path.join(self._tmpdir, 'bushy', 'mirror'))
+
+    def test_load_missing(self):
+        mirror = self._makeOne().load()
+
+        self.assertEqual(mirror.version, None)
+        self.assertEqual(mirror.stories, {})
+
+    def test_load_corrupt(self):
+        import os
+        os.makedirs(os.path.join(self._tmpdir, 'bushy'))
+        open(os.path.join(self._tmpdir, 'bushy', 'mirror'), 'w').write('{"version"')
+
+        self.assertEqual(self._makeOne().load().version, None)
+
+    def test_save_load(self):
+        self._makeFilled().save()
+
+        mirror = self._makeOne().load()
+
+        self.assertEqual(mirror.version, 10)
+        self.assertEqual(mirror.order, [1, 2, 3])
+        self.assertEqual(mirror.get(2)['owned_by'], 'Mr Test')
+
+    def test_query(self):
+        mirror = self._makeFilled()
+
+        self.assertEqual(self._ids(mirror.query({'state': 'unstarted'})), [1, 3])
+        self.assertEqual(self._ids(mirror.query({'state': 'unstarted', 'type': 'bug'})), [3])
+        self.assertEqual(self._ids(mirror.query({'state': 'started,unstarted', 'owned_by': 'Mr Test'})), [2, 3])
+        self.assertEqual(self._ids(mirror.query({'id': '3,1', 'includedone': 'true'})), [1, 3])
+        self.assertEqual(mirror.query({'label': 'urgent'}), None)
+
+    def test_update(self):
+        mirror = self._makeFilled()
+
+        mirror.update(1, {'current_state': 'started'})
+        mirror.update(4, {'current_state': 'unstarted', 'story_type': 'feature'})
+
+        self.assertEqual(mirror.get(1)['current_state'], 'started')
+        self.assertEqual(mirror.get(1)['story_type'], 'feature')
+        self.assertEqual(mirror.order, [1, 2, 3, 4])
+        self.assertEqual(mirror.get(4)['id'], 4)
+
+    def test_remove(self):
+        mirror = self._makeFilled()
+
+        mirror.remove(2)
+        mirror.remove(5)
+
+        self.assertEqual(mirror.order, [1, 3])
+        self.assertEqual(mirror.get(2), None)
+
+    def test_move(self):
+        mirror = self._makeFilled()
+
+        mirror.move(3, before_id=1)
+        self.assertEqual(mirror.order, [3, 1, 2])
+
+        mirror.move(3, after_id=2)
+        self.assertEqual(mirror.order, [1, 2, 3])
+
+        mirror.move(3, before_id=99)
+        self.assertEqual(mirror.order, [1, 2, 3])
+
+    def test_apply(self):
+        from bushy.mirror import Change
+        mirror = self._makeFilled()
+
+        mirror.apply(Change('update', 2, {'current_state': 'finished'}))
+        mirror.apply(Change('move', 2, {'before_id': 1}))
+        mirror.apply(Change('delete', 3, None))
+
+        self.assertEqual(mirror.order, [2, 1])
+        self.assertEqual(mirror.get(2)['current_state'], 'finished')
+        self.assertRaises(ValueError, mirror.apply, Change('resync', None, None))
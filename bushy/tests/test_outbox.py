@@ -0,0 +1,129 @@
+import unittest
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self._tmpdir)
+
+    def _makeOne(self):
+        import os
+        from bushy.outbox import Outbox
+        return Outbox(os.path.join(self._tmpdir, 'bushy', 'outbox'))
+
+    def test_for_repository(self):
+        import os
+        from bushy.outbox import Outbox
+
+        self.assertEqual(Outbox.for_repository(None), None)
+        self.assertEqual(Outbox.for_repository(self._tmpdir).path,
+                         os.path.join(self._tmpdir, 'bushy', 'outbox'))
+
+    def test_empty(self):
+        outbox = self._makeOne()
+
+        self.assertEqual(outbox.pending(), [])
+
+    def test_append(self):
+        outbox = self._makeOne()
+
+        first = outbox.append(1, 'PUT', 'http://url/1', '<story/>')
+        second = outbox.append(2, 'POST', 'http://url/2/notes', u'<note>\xe9</note>')
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(outbox.written, 2)
+        pending = self._makeOne().pending()
+        self.assertEqual([(e['id'], e['story'], e['method'], e['url'], e['body']) for e in pending],
+                         [(first, 1, 'PUT', 'http://url/1', '<story/>'),
+                          (second, 2, 'POST', 'http://url/2/notes', u'<note>\xe9</note>')])
+
+    def test_append_extra(self):
+        outbox = self._makeOne()
+
+        outbox.append(1, 'POST', 'http://url/1/notes', '<note/>', note=u'Done')
+
+        self.assertEqual(self._makeOne().pending()[0]['note'], u'Done')
+
+    def test_done(self):
+        import os
+        outbox = self._makeOne()
+        first = outbox.append(1, 'PUT', 'http://url/1', '<story/>')
+        second = outbox.append(1, 'POST', 'http://url/1/notes', '<note/>')
+
+        outbox.done(first)
+
+        self.assertEqual([e['id'] for e in outbox.pending()], [second])
+
+        outbox.done(second, error='404 Not Found')
+
+        self.assertEqual(outbox.pending(), [])
+        # emptied once nothing is pending
+        self.assertEqual(os.path.getsize(outbox.path), 0)
+
+    def test_truncated_line(self):
+        outbox = self._makeOne()
+        outbox.append(1, 'PUT', 'http://url/1', '<story/>')
+        f = open(outbox.path, 'a')
+        f.write('{"id": 100, "sto')
+        f.close()
+
+        self.assertEqual(len(outbox.pending()), 1)
+
+    def test_lock(self):
+        outbox = self._makeOne()
+        outbox.append(1, 'PUT', 'http://url/1', '<story/>')
+
+        lock = outbox.lock()
+        self.assertNotEqual(lock, None)
+        self.assertEqual(self._makeOne().lock(), None)
+        lock.close()
+
+        lock = self._makeOne().lock()
+        self.assertNotEqual(lock, None)
+        lock.close()
+
+    def test_flush(self):
+        outbox = self._makeOne()
+        outbox.append(1, 'PUT', 'http://url/1', 'a')
+        outbox.append(2, 'PUT', 'http://url/2', 'b')
+        outbox.append(1, 'POST', 'http://url/1/notes', 'c')
+        outbox.append(3, 'PUT', 'http://url/3', 'd')
+        outbox.append(2, 'POST', 'http://url/2/notes', 'e')
+        outbox.append(3, 'POST', 'http://url/3/notes', 'f')
+        sends = []
+        def send(entry):
+            sends.append(entry['body'])
+            if entry['body'] == 'b':
+                return False # story 2 is retried later
+            if entry['body'] == 'd':
+                return '404 Not Found'
+
+        sent, failed, remaining = outbox.flush(send)
+
+        self.assertEqual(sends, ['a', 'c', 'b', 'd', 'f'])
+        self.assertEqual([e['body'] for e in sent], ['a', 'c', 'f'])
+        self.assertEqual([(e['body'], e['error']) for e in failed], [('d', '404 Not Found')])
+        # nothing for story 2 is sent after the change which couldn't be
+        self.assertEqual([e['body'] for e in remaining], ['b', 'e'])
+        self.assertEqual([e['body'] for e in outbox.pending()], ['b', 'e'])
+        # the tracker may have made the change which failed
+        self.assertEqual([e.get('attempted') for e in outbox.pending()], [True, None])
+
+    def test_flush_pool(self):
+        from bushy.threads import Pool
+        outbox = self._makeOne()
+        for story in range(10):
+            outbox.append(story, 'PUT', 'http://url/%s' % story, 'update')
+            outbox.append(story, 'POST', 'http://url/%s/notes' % story, 'note')
+        sends = []
+
+        sent, failed, remaining = outbox.flush(lambda entry: sends.append(entry) or None, Pool(4))
+
+        self.assertEqual(len(sent), 20)
+        self.assertEqual(outbox.pending(), [])
+        for story in range(10):
+            bodies = [e['body'] for e in sends if e['story'] == story]
+            self.assertEqual(bodies, ['update', 'note'])
@@ -15,6 +15,12 @@ class TestFormatFilter(unittest.TestCase):
 
         self.assertEqual(res, 'key2:2 key1:value1')
 
+    def test_quoting(self):
+        self.assertEqual(self._callFUT({'owned_by': 'Mr Test'}), 'owned_by:"Mr Test"')
+        self.assertEqual(self._callFUT({'owned_by': 'Mr "T" Test'}), 'owned_by:"Mr \\"T\\" Test"')
+        self.assertEqual(self._callFUT({'owned_by': ''}), 'owned_by:""')
+        self.assertEqual(self._callFUT({'id': '1,2'}), 'id:1,2')
+
 class TestEtreeUtils(unittest.TestCase):
     def setUp(self):
         self.xml = '''\
@@ -55,6 +61,66 @@ class TestEtreeUtils(unittest.TestCase):
         self.assertEqual(etree_datetime(etree, 'non_attr'), None)
         self.assertRaises(ValueError, etree_datetime,
                           etree, 'text_attr')
+
+    def test_parse_datetime(self):
+        from bushy._pivotal import parse_datetime
+        from datetime import datetime
+        self.assertEqual(parse_datetime('2021/12/21 21:21:21 UTC'), datetime(2021, 12, 21, 21, 21, 21))
+        self.assertRaises(ValueError, parse_datetime, '2021/13/21 21:21:21 UTC')
+        self.assertRaises(ValueError, parse_datetime, '2021/12/21 21:21:21 GMT')
+        self.assertRaises(ValueError, parse_datetime, 'foobar')
+
+    def test_parse_story(self):
+        etree = self._makeOne('''\
+          <story>
+            <id type="integer">12345</id>
+            <project_id type="integer">1</project_id>
+            <story_type>feature</story_type>
+            <estimate type="integer">3</estimate>
+            <name>Story 1</name>
+            <labels>ui,reports</labels>
+            <notes type="array">
+              <note><id>9</id><text>Seen on staging</text></note>
+              <note><id>10</id><text>Fixed</text></note>
+            </notes>
+            <created_at type="datetime">2021/12/21 21:21:21 UTC</created_at>
+          </story>
+        ''')
+
+        from bushy._pivotal import parse_story, EMPTY_STORY
+        from datetime import datetime
+        story = parse_story(etree)
+        self.assertEqual(story.id, 12345)
+        self.assertEqual(story.project_id, 1)
+        self.assertEqual(story.story_type, 'feature')
+        self.assertEqual(story.estimate, 3)
+        self.assertEqual(story.name, 'Story 1')
+        self.assertEqual(story.owned_by, '')
+        self.assertEqual(story.labels, 'ui,reports')
+        self.assertEqual(story.notes, 'Seen on staging\nFixed')
+        self.assertEqual(story.created_at, datetime(2021, 12, 21, 21, 21, 21))
+        self.assertEqual(story.updated_at, None)
+        self.assertEqual(parse_story(self._makeOne('<story/>')), EMPTY_STORY)
+
+    def test_iterparse_stories(self):
+        from bushy._pivotal import iterparse_stories
+        listing = StringIO('<stories type="array">'
+                           '<story><id>1</id><notes><note><id>9</id></note></notes></story>'
+                           '<story><id>2</id></story>'
+                           '</stories>')
+
+        self.assertEqual([s.id for s in iterparse_stories(listing)], [1, 2])
+        self.assertEqual([s.id for s in iterparse_stories(StringIO('<story><id>3</id></story>'))], [3])
+        self.assertEqual(list(iterparse_stories(StringIO('<stories/>'))), [])
+
+    def test_dump_load_fields(self):
+        etree = self._makeOne('<story><id>1</id><name>Story 1</name>'
+                              '<updated_at>2021/12/21 21:21:21 UTC</updated_at></story>')
+
+        import json
+        from bushy._pivotal import parse_story, dump_fields, load_fields
+        story = parse_story(etree)
+        self.assertEqual(load_fields(json.loads(json.dumps(dump_fields(story)))), story)
         
 
 class TestPivotalBase(unittest.TestCase):
@@ -63,21 +129,22 @@ class TestPivotalBase(unittest.TestCase):
         self._output = StringIO()
 
     def tearDown(self):
-        if hasattr(self, '_getoutput'):
-            import bushy._pivotal
-            bushy._pivotal.getoutput = self._getoutput
+        if hasattr(self, '_config'):
+            import bushy.config
+            bushy.config._config = self._config
     
-    def _patch_getoutput(self, value):
-        import bushy._pivotal
-        self._getoutput = bushy._pivotal.getoutput
-        bushy._pivotal.getoutput = lambda x: value
+    def _patch_config(self, values):
+        import bushy.config
+        if not hasattr(self, '_config'):
+            self._config = bushy.config._config
+        bushy.config._config = bushy.config.GitConfig(values)
 
     def _makeOne(self, args):
         from bushy._pivotal import PivotalBase
         return PivotalBase(self._input, self._output, args)
     
     def test_parser(self):
-        self._patch_getoutput('')
+        self._patch_config({})
         
         base = self._makeOne([])
 
@@ -85,15 +152,28 @@ class TestPivotalBase(unittest.TestCase):
                          'The integration branch should be the default')
 
     def test_gitconfig(self):
-        self._patch_getoutput('true')
+        self._patch_config({'bushy-pivotal.integration-branch': 'true'})
         
         base = self._makeOne([])
 
         self.assertEqual(base.options['integration_branch'], 'true',
                          'The integration branch should overridden by gitconfig')
 
+    def test_gitconfig_only_mine(self):
+        self._patch_config({'bushy-pivotal.only-mine': 'false'})
+        
+        base = self._makeOne([])
+
+        self.assertEqual(base.options['only_mine'], False)
+
+        self._patch_config({'bushy-pivotal.only-mine': None})
+        
+        base = self._makeOne([])
+
+        self.assertEqual(base.options['only_mine'], True)
+
     def test_api(self):
-        self._patch_getoutput('true')
+        self._patch_config({})
         
         base = self._makeOne([])
         base.options['api_token'] = 'token'
@@ -101,7 +181,7 @@ class TestPivotalBase(unittest.TestCase):
         self.assertEqual(base.api.token, 'token')
         
     def test_project(self):
-        self._patch_getoutput('true')
+        self._patch_config({})
         
         base = self._makeOne([])
         base.options['api_token'] = 'token'
@@ -109,18 +189,641 @@ class TestPivotalBase(unittest.TestCase):
 
         self.assertTrue(base.project.url.endswith('/uniqueproject'))
         self.assertEqual(base.project.token, 'token')
+
+    def test_project_ids(self):
+        self._patch_config({'bushy-pivotal.project-id': '1, 2 3'})
+
+        base = self._makeOne([])
+
+        self.assertEqual(base.project_ids, ['1', '2', '3'])
+        self.assertEqual(base.default_project_id, '1')
+
+        self._patch_config({})
+        self.assertEqual(self._makeOne(['-p', '4,5']).project_ids, ['4', '5'])
+
+    def test_merge_by_priority(self):
+        from bushy._pivotal import merge_by_priority
+
+        self.assertEqual(merge_by_priority([['a1', 'a2', 'a3'], [], ['c1'], ['d1', 'd2']]),
+                         ['a1', 'c1', 'd1', 'a2', 'd2', 'a3'])
+
+    def _respondProjects(self, listings):
+        import re
+        def respond(url, method, body):
+            project_id, story_id = re.search(r'/projects/(\w+)/stories/?(\d*)', url).groups()
+            ids = listings.get(project_id, [])
+            if story_id:
+                ids = [int(story_id)] if int(story_id) in ids else []
+            return '<stories>%s</stories>' % ''.join(
+                '<story><id>%s</id><project_id>%s</project_id></story>' % (i, project_id) for i in ids)
+        return respond
+
+    def test_fetch_candidates_projects(self):
+        base = self._makeFetching(self._respondProjects({'1': [11, 12], '2': [21, 22]}))
+        base.options['project_id'] = '1,2'
+
+        stories = base.fetch_candidates({'state': 'unstarted'}, 3)
+
+        self.assertEqual([s.id for s in stories], [11, 21, 12])
+        urls = sorted(request[0] for request in base._http.requests)
+        self.assertEqual(len(urls), 2)
+        self.assertTrue('/projects/1/stories?' in urls[0])
+        self.assertTrue('/projects/2/stories?' in urls[1])
+
+    def test_fetch_stories_projects(self):
+        base = self._makeFetching(self._respondProjects({'1': [11], '2': [21]}))
+        base.options['project_id'] = '1,2'
+
+        self.assertEqual(sorted(base.fetch_stories_by_id([11, 21])), [11, 21])
+
+    def test_fetch_story_projects(self):
+        base = self._makeFetching(self._respondProjects({'1': [11], '2': [21]}))
+        base.options['project_id'] = '1,2'
+
+        story = base.fetch_story(21)
+
+        self.assertEqual((story.id, story.project_id), (21, 2))
+        self.assertEqual(len(base._http.requests), 2)
+        self.assertEqual(base.fetch_story(21, project_id='2').id, 21)
+        self.assertEqual(len(base._http.requests), 3)
+        self.assertEqual(base.fetch_story(31), None)
+
+    def test_mirror_projects(self):
+        self._patch_config({'bushy.mirror': 'true'})
+        base = self._makeOne(['-p', '1,2'])
+
+        self.assertEqual(base.mirror, None)
+
+    def test_pool(self):
+        self._patch_config({'bushy.concurrency': '8'})
+
+        base = self._makeOne([])
+
+        self.assertEqual(base.pool.size, 8)
+        self.assertTrue(base.pool is base.pool)
+
+        self._patch_config({})
+
+        self.assertEqual(self._makeOne([]).pool.size, 4)
+
+    def test_pool_at_least_one(self):
+        for size in ('0', '-2'):
+            self._patch_config({'bushy.concurrency': size})
+
+            pool = self._makeOne([]).pool
+
+            self.assertEqual(pool.size, 1)
+            self.assertEqual(pool.submit(lambda: 'done').result(), 'done')
+
+    def test_outbox(self):
+        self._patch_config({})
+        base = self._makeOne([])
+        base._git = DummyGit()
+        base._git.common_dir = self._tmpdir()
+
+        self.assertEqual(base.outbox, None)
+
+        self._patch_config({'bushy.outbox': 'true'})
+        base = self._makeOne([])
+        base._git = DummyGit()
+        base._git.common_dir = self._tmpdir()
+
+        self.assertTrue(base.outbox.path.startswith(base._git.common_dir))
+
+    def test_close(self):
+        self._patch_config({'bushy.outbox': 'true'})
+        base = self._makeOne([])
+        base._git = DummyGit()
+        base._git.common_dir = self._tmpdir()
+        syncs = []
+        base.sync_in_background = lambda: syncs.append(1)
+
+        base.close()
+        base.outbox
+        base.close()
+
+        self.assertEqual(syncs, [])
+
+        base.outbox.append(1, 'PUT', 'http://url', '<story/>')
+        base.close()
+
+        self.assertEqual(syncs, [1])
+
+    def test_backend(self):
+        from bushy._pivotal import XmlBackend, JsonBackend
+        self._patch_config({})
+
+        self.assertTrue(isinstance(self._makeOne([]).backend, XmlBackend))
+
+        self._patch_config({'bushy-pivotal.api-version': '5'})
+        base = self._makeOne([])
+
+        self.assertTrue(isinstance(base.backend, JsonBackend))
+        self.assertTrue(base.backend is base.backend)
+
+    def _makeMirrored(self, respond, mirror=None):
+        from bushy.mirror import Mirror
+        self._patch_config({'bushy.mirror': 'true'})
+        base = self._makeOne([])
+        base.options['api_token'] = 'token'
+        base.options['project_id'] = 'uniqueproject'
+        base._git = DummyGit()
+        base._git.common_dir = self._tmpdir()
+        if mirror is not None:
+            mirror.path = Mirror.for_repository(base._git.common_dir).path
+            mirror.save()
+        base._http = DummyHttp()
+        base._http.content = respond
+        return base
+
+    def _respondListing(self, activity='<activities/>', version=7):
+        def respond(url, method, body):
+            if 'activities' in url and 'newer_than_version' in url:
+                return activity
+            if 'activities' in url:
+                return '<activities><activity><version>%s</version></activity></activities>' % version
+            return ('<stories><story><id>1</id><current_state>unstarted</current_state></story>'
+                    '<story><id>2</id><current_state>started</current_state></story></stories>')
+        return respond
+
+    def _makeStoredMirror(self):
+        from bushy.mirror import Mirror
+        mirror = Mirror(None)
+        mirror.reset(5, [{'id': 1, 'current_state': 'unstarted'},
+                         {'id': 2, 'current_state': 'unstarted'}])
+        return mirror
+
+    def test_mirror_disabled(self):
+        self._patch_config({})
+
+        self.assertEqual(self._makeOne([]).mirror, None)
+
+    def test_mirror_built(self):
+        base = self._makeMirrored(self._respondListing())
+
+        mirror = base.mirror
+
+        self.assertEqual(mirror.version, 7)
+        self.assertEqual(mirror.order, [1, 2])
+        self.assertTrue('includedone' in base._http.requests[1][0])
+        requests = len(base._http.requests)
+        # listings and stories are then answered without a request
+        self.assertEqual([s.id for s in base.fetch_stories({'state': 'unstarted'})], [1])
+        self.assertEqual(base.fetch_story(2).current_state, 'started')
+        self.assertEqual(base.fetch_story(3), None)
+        self.assertEqual(len(base._http.requests), requests)
+        # the full listing isn't kept in the listing cache as well
+        self.assertEqual(base.cache.lookup(1), None)
+
+    def test_mirror_paging_ignored(self):
+        from bushy.mirror import Mirror
+        base = self._makeMirrored(self._respondListing())
+
+        # every page is the same whatever the limit and offset
+        mirror = Mirror.for_repository(base._git.common_dir)
+        self.assertTrue(base.resync_mirror(mirror, page_size=2))
+        self.assertEqual(len(base._http.requests), 3)
+        self.assertEqual(mirror.order, [1, 2])
+
+        self.assertTrue(base.resync_mirror(mirror, page_size=1))
+        self.assertEqual(len(base._http.requests), 5)
+        self.assertEqual(mirror.order, [1, 2])
+
+    def test_mirror_incremental(self):
+        activity = ('<activities>'
+                    '<activity><version>7</version><event_type>story_update</event_type>'
+                    '<stories><story><id>1</id><current_state>started</current_state>'
+                    '<owned_by>Mr Test</owned_by></story></stories></activity>'
+                    '<activity><version>6</version><event_type>story_create</event_type>'
+                    '<stories><story><id>3</id><current_state>unstarted</current_state></story></stories></activity>'
+                    '<activity><version>8</version><event_type>note_create</event_type>'
+                    '<stories><story><id>1</id><notes><note><text>Hi</text></note></notes></story></stories></activity>'
+                    '</activities>')
+        base = self._makeMirrored(self._respondListing(activity), self._makeStoredMirror())
+
+        mirror = base.mirror
+
+        self.assertEqual(len(base._http.requests), 1)
+        self.assertTrue('newer_than_version=5' in base._http.requests[0][0])
+        self.assertEqual(mirror.version, 8)
+        self.assertEqual(mirror.order, [1, 2, 3])
+        self.assertEqual(mirror.get(1)['owned_by'], 'Mr Test')
+        # the activity only has the new note, not all of them
+        self.assertFalse('notes' in mirror.get(1))
+        self.assertEqual([s.id for s in base.iter_stories({'state': 'unstarted'}, limit=1)], [2])
+
+        from bushy.mirror import Mirror
+        self.assertEqual(Mirror(mirror.path).load().version, 8)
+
+    def test_mirror_gap(self):
+        import bushy._pivotal
+        activity = '<activities>%s</activities>' % ''.join(
+            '<activity><version>%s</version><event_type>story_update</event_type></activity>' % i
+            for i in range(bushy._pivotal.ACTIVITY_LIMIT))
+        base = self._makeMirrored(self._respondListing(activity), self._makeStoredMirror())
+
+        mirror = base.mirror
+
+        # the feed is full so it may not reach back far enough
+        self.assertEqual(mirror.version, 7)
+        self.assertEqual(mirror.get(2)['current_state'], 'started')
+
+    def test_mirror_move_v3(self):
+        activity = ('<activities><activity><version>6</version><event_type>story_move</event_type>'
+                    '<stories><story><id>2</id></story></stories></activity></activities>')
+        base = self._makeMirrored(self._respondListing(activity), self._makeStoredMirror())
+
+        self.assertEqual(base.mirror.version, 7)
+
+    def test_mirror_unreachable(self):
+        base = self._makeMirrored(self._respondListing(), self._makeStoredMirror())
+        base._http.headers['status'] = '503'
+
+        mirror = base.mirror
+
+        self.assertEqual(mirror.version, 5)
+        self.assertEqual(len(base._http.requests), 1)
+
+    def test_mirror_unavailable(self):
+        base = self._makeMirrored(self._respondListing())
+        base._http.headers['status'] = '503'
+
+        self.assertEqual(base.mirror, None)
+        self.assertEqual(base.mirror, None)
+        self.assertEqual(len(base._http.requests), 1)
+
+    def test_index_stories(self):
+        from bushy.index import SearchIndex
+        base = self._makeFetching('<stories><story><id>1</id><name>Login page</name></story></stories>')
+        base._git = DummyGit()
+        base._git.common_dir = self._tmpdir()
+        index = SearchIndex.for_repository(base._git.common_dir)
+        index.reset([])
+
+        list(base.iter_stories({'state': 'unstarted'}))
+        base.index_stories({2: {'name': 'Logout'}})
+        base.index_stories({'2': {'current_state': 'started'}})
+        self.assertEqual(index.search('login'), [])
+        base.close()
+
+        index = SearchIndex.for_repository(base._git.common_dir)
+        self.assertEqual([hit['id'] for hit in index.search('log')], [1, 2])
+        self.assertEqual(index.search('logout')[0]['current_state'], 'started')
+
+    def test_index_stories_disabled(self):
+        base = self._makeFetching('<stories><story><id>1</id></story></stories>')
+        base._git = DummyGit()
+        base._git.common_dir = self._tmpdir()
+
+        list(base.iter_stories({'state': 'unstarted'}))
+
+        self.assertEqual(base.search_index, None)
+        self.assertEqual(base._indexed, None)
+
+    def _makeFetching(self, content, headers={}):
+        from bushy.cache import StoryCache
+        self._patch_config({})
+        base = self._makeOne([])
+        base.options['api_token'] = 'token'
+        base.options['project_id'] = 'uniqueproject'
+        base._cache = StoryCache(self._tmpdir())
+        base._http = DummyHttp()
+        base._http.headers.update(headers)
+        base._http.content = content
+        return base
+
+    def _tmpdir(self):
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        return tmpdir
+
+    def test_fetch_stories(self):
+        base = self._makeFetching('<stories><story><id>1</id><name>Story 1</name>'
+                                  '<created_at>2021/12/21 21:21:21 UTC</created_at></story>'
+                                  '<story><id>2</id></story></stories>',
+                                  {'etag': '"abc"'})
+
+        stories = base.fetch_stories({'state': 'unstarted'})
+
+        from datetime import datetime
+        self.assertEqual([s.id for s in stories], [1, 2])
+        self.assertEqual(stories[0].name, 'Story 1')
+        self.assertEqual(stories[0].created_at, datetime(2021, 12, 21, 21, 21, 21))
+        self.assertEqual(base._http.requests[0][1], 'GET')
+        self.assertEqual(base._http.requests[0][2]['X-TrackerToken'], 'token')
+        self.assertFalse('If-None-Match' in base._http.requests[0][2])
+
+    def test_iter_stories_page(self):
+        import urlparse
+        base = self._makeFetching('<stories/>')
+
+        list(base.iter_stories({'state': 'unstarted'}, limit=1))
+        list(base.iter_stories({'state': 'unstarted'}, limit=10, offset=20))
+
+        first = urlparse.parse_qs(urlparse.urlparse(base._http.requests[0][0]).query)
+        second = urlparse.parse_qs(urlparse.urlparse(base._http.requests[1][0]).query)
+        self.assertEqual(first['limit'], ['1'])
+        self.assertFalse('offset' in first)
+        self.assertEqual((second['limit'], second['offset']), (['10'], ['20']))
+
+    def test_page_stories(self):
+        import urlparse
+        def respond(url, method, body):
+            query = urlparse.parse_qs(urlparse.urlparse(url).query)
+            offset = int(query.get('offset', ['0'])[0])
+            ids = range(offset + 1, min(offset + int(query['limit'][0]), 5) + 1)
+            return '<stories>%s</stories>' % ''.join('<story><id>%s</id></story>' % i for i in ids)
+        base = self._makeFetching(respond)
+
+        stories = base.page_stories({'state': 'unstarted'}, page_size=2)
+
+        self.assertEqual(next(stories).id, 1)
+        # the next page is only requested once it is reached
+        self.assertEqual(len(base._http.requests), 1)
+        self.assertEqual([s.id for s in stories], [2, 3, 4, 5])
+        self.assertEqual(len(base._http.requests), 3)
+
+    def test_page_stories_exact_pages(self):
+        base = self._makeFetching(lambda url, method, body: 'offset=2' in url and '<stories/>' or
+                                  '<stories><story><id>1</id></story><story><id>2</id></story></stories>')
+
+        self.assertEqual([s.id for s in base.page_stories({}, page_size=2)], [1, 2])
+        self.assertEqual(len(base._http.requests), 2)
+
+    def test_page_stories_limit_ignored(self):
+        listing = '<stories>%s</stories>' % ''.join('<story><id>%s</id></story>' % i for i in range(1, 6))
+        base = self._makeFetching(listing)
+
+        self.assertEqual([s.id for s in base.page_stories({}, page_size=2)], [1, 2, 3, 4, 5])
+        self.assertEqual(len(base._http.requests), 1)
+
+    def test_page_stories_offset_ignored(self):
+        base = self._makeFetching('<stories><story><id>1</id></story><story><id>2</id></story></stories>')
+
+        self.assertEqual([s.id for s in base.page_stories({}, page_size=2)], [1, 2])
+        self.assertEqual(len(base._http.requests), 2)
+
+    def test_fetch_stories_not_modified(self):
+        base = self._makeFetching('<stories><story><id>1</id>'
+                                  '<created_at>2021/12/21 21:21:21 UTC</created_at></story></stories>',
+                                  {'etag': '"abc"', 'last-modified': 'yesterday'})
+
+        first = base.fetch_stories({'state': 'unstarted'})
+
+        base._http.headers['status'] = '304'
+        base._http.content = ''
+        second = base.fetch_stories({'state': 'unstarted'})
+
+        self.assertEqual(first, second)
+        self.assertEqual(base._http.requests[1][2]['If-None-Match'], '"abc"')
+        self.assertEqual(base._http.requests[1][2]['If-Modified-Since'], 'yesterday')
+
+    def test_fetch_stories_no_cache(self):
+        base = self._makeFetching('<stories><story><id>1</id></story></stories>',
+                                  {'etag': '"abc"'})
+        base._cache = None
+        base.options['no_cache'] = True
+
+        base.fetch_stories({'state': 'unstarted'})
+        base.fetch_stories({'state': 'unstarted'})
+
+        self.assertFalse('If-None-Match' in base._http.requests[1][2])
+
+    def test_fetch_stories_error(self):
+        base = self._makeFetching('<error/>', {'status': '401'})
+
+        self.assertEqual(base.fetch_stories({'state': 'unstarted'}), [])
+
+    def test_iter_stories_closed_early(self):
+        base = self._makeFetching('<stories><story><id>1</id></story><story><id>2</id></story></stories>',
+                                  {'etag': '"abc"'})
+
+        stories = base.iter_stories({'state': 'unstarted'})
+        self.assertEqual(next(stories).id, 1)
+        stories.close()
+
+        # a partly read listing isn't cached
+        self.assertEqual(base.cache.get(base._http.requests[0][0]), None)
+        self.assertEqual([s.id for s in base.iter_stories({'state': 'unstarted'})], [1, 2])
+        self.assertNotEqual(base.cache.get(base._http.requests[0][0]), None)
+
+    def test_fetch_story(self):
+        base = self._makeFetching('<story><id>12345</id><name>Story 1</name></story>')
+
+        story = base.fetch_story(12345)
+
+        self.assertEqual(story.id, 12345)
+        self.assertEqual(story.name, 'Story 1')
+        self.assertTrue(base._http.requests[0][0].endswith('/uniqueproject/stories/12345'))
+
+    def test_fetch_story_not_found(self):
+        base = self._makeFetching('<error/>', {'status': '404'})
+        base.cache.put('list', [{'id': 12345}])
+
+        self.assertEqual(base.fetch_story(12345), None)
+
+    def test_fetch_story_unreachable(self):
+        base = self._makeFetching('', {'status': '408'})
+        base.cache.put('list', [{'id': 12345, 'name': 'Story 1'}])
+
+        story = base.fetch_story(12345)
+
+        self.assertEqual(story.id, 12345)
+        self.assertEqual(story.name, 'Story 1')
+        self.assertEqual(story.current_state, '')
+        self.assertEqual(base.fetch_story(54321), None)
         
+class TestJsonBackend(unittest.TestCase):
+    def setUp(self):
+        import bushy.config
+        self._config = bushy.config._config
+        bushy.config._config = bushy.config.GitConfig({'bushy-pivotal.api-version': '5'})
+
+    def tearDown(self):
+        import bushy.config
+        bushy.config._config = self._config
+
+    def _makeContext(self, content):
+        from bushy._pivotal import PivotalBase
+        context = PivotalBase(StringIO(), StringIO(), [])
+        context.options['api_token'] = 'token'
+        context.options['project_id'] = '99'
+        context._http = DummyHttp()
+        context._http.content = content
+        return context
+
+    def test_stories_url(self):
+        context = self._makeContext('')
+
+        url = context.backend.stories_url({'owned_by': 'Mr Test'})
+
+        self.assertTrue(url.startswith('https://www.pivotaltracker.com/services/v5/projects/99/stories?'))
+        self.assertTrue('fields=id%2Cproject_id%2C' in url)
+        self.assertTrue('owners%28name%29' in url)
+        self.assertTrue('date_format=millis' in url)
+        self.assertTrue('filter=owner%3A%22Mr+Test%22' in url)
+
+    def test_json_story(self):
+        from bushy._pivotal import json_story, EMPTY_STORY
+        from datetime import datetime
+
+        story = json_story({'kind': 'story', 'id': 12345, 'project_id': 99,
+                            'name': u'Story 1', 'current_state': 'started',
+                            'estimate': None, 'labels': [{'name': 'ui'}, {'name': 'reports'}],
+                            'owners': [{'name': 'Mr Test'}],
+                            'comments': [{'text': 'Seen on staging'}, {'text': 'Fixed'}],
+                            'created_at': 1640121681000})
+
+        self.assertEqual(story.id, 12345)
+        self.assertEqual(story.project_id, 99)
+        self.assertEqual(story.name, 'Story 1')
+        self.assertEqual(story.estimate, 0)
+        self.assertEqual(story.owned_by, 'Mr Test')
+        self.assertEqual(story.labels, 'ui,reports')
+        self.assertEqual(story.notes, 'Seen on staging\nFixed')
+        self.assertEqual(story.created_at, datetime(2021, 12, 21, 21, 21, 21))
+        self.assertEqual(story.updated_at, None)
+        self.assertEqual(json_story({}), EMPTY_STORY)
+
+    def test_fetch_stories(self):
+        context = self._makeContext('[{"id": 1, "name": "Story 1"}, {"id": 2}]')
+
+        stories = context.fetch_stories({'state': 'unstarted'})
+
+        self.assertEqual([s.id for s in stories], [1, 2])
+        self.assertEqual(stories[0].name, 'Story 1')
+
+    def test_fetch_story(self):
+        context = self._makeContext('{"kind": "story", "id": 12345}')
+
+        self.assertEqual(context.fetch_story(12345).id, 12345)
+        self.assertTrue('/projects/99/stories/12345?' in context._http.requests[0][0])
+
+    def test_update(self):
+        from bushy._pivotal import Story, json_story
+        import json
+
+        def respond(url, method, body):
+            if '/memberships' in url:
+                return '[{"person": {"id": 7, "name": "Mr Test"}}]'
+            return '{"id": 12345, "current_state": "started", "owners": [{"name": "Mr Test"}]}'
+        context = self._makeContext(respond)
+        story = Story(json_story({'id': 12345, 'project_id': 99}), context)
+
+        story.update(current_state='started', owned_by='Mr Test')
+        story.update(owned_by='Mr Test')
+
+        requests = context._http.requests
+        # the members are only looked up once
+        self.assertEqual([r[1] for r in requests], ['GET', 'PUT', 'PUT'])
+        self.assertTrue('/projects/99/stories/12345?' in requests[1][0])
+        self.assertEqual(requests[1][2]['Content-type'], 'application/json')
+        self.assertEqual(json.loads(requests[1][3]), {'current_state': 'started', 'owner_ids': [7]})
+        self.assertEqual(story.current_state, 'started')
+        self.assertEqual(story.owned_by, 'Mr Test')
+        self.assertRaises(ValueError, story.update, owned_by='Someone Else')
+
+    def test_update_error(self):
+        from bushy._pivotal import Story, json_story
+        context = self._makeContext('{"kind": "error", "code": "invalid_parameter", "error": "One or more request parameters was missing or invalid."}')
+        context._http.headers = DummyResponse({'status': '400'})
+        story = Story(json_story({'id': 12345, 'project_id': 99, 'name': 'Story 1',
+                                  'current_state': 'unstarted'}), context)
+
+        story.update(current_state='started')
+
+        # the story isn't replaced by the error
+        self.assertEqual((story.id, story.name, story.current_state), (12345, 'Story 1', 'unstarted'))
+
+    def test_update_members_unavailable(self):
+        from bushy._pivotal import Story, json_story
+        context = self._makeContext('{"kind": "error", "code": "timeout"}')
+        context._http.headers = DummyResponse({'status': '408'})
+        story = Story(json_story({'id': 12345, 'project_id': 99, 'current_state': 'unstarted'}), context)
+
+        story.update(current_state='started', owned_by='Mr Test')
+        story.update(owned_by='Mr Test')
+
+        # nothing is sent, and a failure isn't remembered as no members
+        self.assertEqual([r[1] for r in context._http.requests], ['GET', 'GET'])
+        self.assertEqual((story.current_state, story.owned_by), ('unstarted', ''))
+
+    def test_update_outbox(self):
+        import json
+        import shutil
+        import tempfile
+        from bushy._pivotal import Story, json_story
+        from bushy.outbox import Outbox
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        context = self._makeContext('')
+        context._outbox = Outbox.for_repository(tmpdir)
+        story = Story(json_story({'id': 12345, 'project_id': 99}), context)
+
+        story.update(current_state='started', owned_by='Mr Test')
+
+        # the owner is looked up when the change is sent
+        self.assertEqual(context._http.requests, [])
+        self.assertEqual(story.owned_by, 'Mr Test')
+        entry = story.outbox.pending()[0]
+        self.assertEqual(json.loads(entry['body']), {'current_state': 'started'})
+        self.assertEqual((entry['owner'], entry['project_id']), ('Mr Test', 99))
+
+    def test_parse_activity(self):
+        content = """[
+          {"project_version": 12,
+           "changes": [{"kind": "story", "change_type": "update", "id": 1,
+                        "new_values": {"current_state": "started", "owner_ids": [7],
+                                       "updated_at": 1640121681000}},
+                       {"kind": "comment", "change_type": "create", "id": 9,
+                        "new_values": {"text": "Started"}}]},
+          {"project_version": 11,
+           "changes": [{"kind": "story", "change_type": "create", "id": 3,
+                        "new_values": {"id": 3, "name": "Story 3", "before_id": 1}},
+                       {"kind": "story", "change_type": "delete", "id": 2}]}
+        ]"""
+        context = self._makeContext('[{"person": {"id": 7, "name": "Mr Test"}}]')
+
+        activities = context.backend.parse_activity(content)
+
+        from bushy.mirror import Change
+        self.assertEqual(activities,
+                         [(11, [Change('update', 3, {'id': 3, 'name': 'Story 3'}),
+                                Change('move', 3, {'before_id': 1}),
+                                Change('delete', 2, None)]),
+                          (12, [Change('update', 1, {'current_state': 'started',
+                                                     'owned_by': 'Mr Test',
+                                                     'updated_at': '2021/12/21 21:21:21 UTC'})])])
+
+    def test_comment(self):
+        from bushy._pivotal import Story, json_story
+        import json
+        context = self._makeContext('{"id": 1}')
+        story = Story(json_story({'id': 12345, 'project_id': 99}), context)
+
+        story.comment(u'Story started by Mr Test')
+
+        url, method, headers, body = context._http.requests[0]
+        self.assertEqual(method, 'POST')
+        self.assertTrue('/projects/99/stories/12345/comments?' in url)
+        self.assertEqual(json.loads(body), {'text': 'Story started by Mr Test'})
+
+
 class TestStory(unittest.TestCase):
     def setUp(self):
         self._input = StringIO()
         self._output = StringIO()
         
     def _makeOne(self, xml, args):
+        from bushy._pivotal import PivotalBase
         from bushy._pivotal import Story
         from pivotal import anyetree
 
+        context = PivotalBase(self._input, self._output, args)
         etree = anyetree.etree.fromstring(xml)
-        return Story(etree, input=self._input, output=self._output, args=args)
+        return Story(etree, context)
 
     def test_init(self):
         story = self._makeOne('<xml></xml>', [])
@@ -138,6 +841,21 @@ class TestStory(unittest.TestCase):
         self.assertEqual(story.created_at, None)
         self.assertEqual(story.updated_at, None)
 
+    def test_context(self):
+        from bushy._pivotal import PivotalBase
+        from bushy._pivotal import Story
+        from bushy._pivotal import EMPTY_STORY
+
+        context = PivotalBase(self._input, self._output, [])
+        context.options['api_token'] = 'token'
+        story = Story(EMPTY_STORY._replace(id=12345), context)
+
+        self.assertEqual(story.id, 12345)
+        self.assertTrue(story.options is context.options)
+        self.assertTrue(story.api is context.api)
+        self.assertTrue(story.h is context.http)
+        self.assertEqual(story.api.token, 'token')
+
     def test_update_status(self):
         story = self._makeOne('<xml></xml>', [])
 
@@ -177,20 +895,87 @@ class TestStory(unittest.TestCase):
 
         self.assertEqual(story.h.requests[0][3], '<note><text>%s</text></note>' % comment)
 
+    def test_update(self):
+        story = self._makeOne('<xml></xml>', [])
+
+        story.h = DummyHttp()
+        story.h.content = '<story><current_state>started</current_state><owned_by>Tom &amp; Jerry</owned_by></story>'
+
+        story.update(owned_by='Tom & Jerry', current_state='started')
+
+        self.assertEqual(len(story.h.requests), 1)
+        self.assertEqual(story.h.requests[0][1], 'PUT')
+        self.assertEqual(story.h.requests[0][3], '<story><current_state>started</current_state><owned_by>Tom &amp; Jerry</owned_by></story>')
+        self.assertEqual(story.current_state, 'started')
+        self.assertEqual(story.owned_by, 'Tom & Jerry')
+
+    def test_update_outbox(self):
+        import shutil
+        import tempfile
+        from bushy.outbox import Outbox
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        story = self._makeOne('<story><id>12345</id><project_id>1</project_id></story>', [])
+        story.outbox = Outbox.for_repository(tmpdir)
+        story.h = DummyHttp()
+
+        story.update(current_state='finished')
+        story.comment('Done')
+
+        self.assertEqual(story.h.requests, [])
+        self.assertEqual(story.current_state, 'finished')
+        pending = story.outbox.pending()
+        self.assertEqual([(e['story'], e['method'], e['url'], e['body']) for e in pending],
+                         [(12345, 'PUT', 'http://www.pivotaltracker.com/services/v3/projects/1/stories/12345',
+                           '<story><current_state>finished</current_state></story>'),
+                          (12345, 'POST', 'http://www.pivotaltracker.com/services/v3/projects/1/stories/12345/notes',
+                           '<note><text>Done</text></note>')])
+        self.assertEqual(pending[1]['note'], 'Done')
+        self.assertTrue(pending[1]['story_url'].endswith('/services/v3/projects/1/stories/12345'))
+
     def test_start(self):
         story = self._makeOne('<xml></xml>', [])
 
         story.options['full_name'] = 'Mr Test'
         
         story.h = DummyHttp()
-        story.h.responses.append('<story><current_state>%s</current_state></story>' % 'started')
-        story.h.responses.append('<story><current_state>%s</current_state><owned_by>%s</owned_by></story>' % ('started', story.options['full_name']))
+        story.h.content = '<story><current_state>%s</current_state><owned_by>%s</owned_by></story>' % ('started', story.options['full_name'])
+
+        note = story.start()
+        note.result()
 
-        story.start()
-        
         self.assertEqual(story.current_state, 'started')
         self.assertEqual(story.owned_by, story.options['full_name'])
-        self.assertEqual(story.h.requests[2][3], '<note><text>Story started by %s</text></note>' % story.options['full_name'])
+        # a single update, followed by the note
+        self.assertEqual([request[1] for request in story.h.requests], ['PUT', 'POST'])
+        requests = dict((request[1], request) for request in story.h.requests)
+        self.assertEqual(requests['PUT'][3], '<story><current_state>started</current_state><owned_by>%s</owned_by></story>' % story.options['full_name'])
+        self.assertEqual(requests['POST'][3], '<note><text>Story started by %s</text></note>' % story.options['full_name'])
+
+    def test_start_refused(self):
+        story = self._makeOne('<story><id>12345</id><current_state>unstarted</current_state></story>', [])
+        story.options['full_name'] = 'Mr Test'
+        story.h = DummyHttp()
+        story.h.headers = DummyResponse({'status': '422'})
+        story.h.content = '<errors><error>Story must be estimated</error></errors>'
+
+        self.assertEqual(story.start(), None)
+
+        self.assertEqual(story.current_state, 'unstarted')
+        self.assertEqual([request[1] for request in story.h.requests], ['PUT'])
+
+    def test_start_failed(self):
+        story = self._makeOne('<xml></xml>', [])
+        story.options['full_name'] = 'Mr Test'
+        story.h = DummyHttp()
+        def content(url, method, body):
+            raise IOError("connection reset")
+        story.h.content = content
+
+        self.assertRaises(IOError, story.start)
+
+        # no note that the story was started when it wasn't
+        self.assertEqual([request[1] for request in story.h.requests], ['PUT'])
         
 
     
@@ -226,36 +1011,255 @@ class TestFeature(unittest.TestCase):
         self._output = StringIO()
         
     def tearDown(self):
-        if hasattr(self, '_getoutput'):
+        if hasattr(self, '_Git'):
             import bushy.base
-            import bushy._pivotal
-            bushy.base.getoutput = self._getoutput
-            bushy._pivotal.getoutput = self._getoutput
+            import bushy.config
+            bushy.base.Git = self._Git
+            bushy.config._config = self._config
     
-    def _patch_getoutput(self, value):
+    def _patch_git(self, current='', branches=(), results=None):
         import bushy.base
-        import bushy._pivotal
-        self._getoutput = bushy.base.getoutput
-        bushy.base.getoutput = lambda x: value
-        bushy._pivotal.getoutput = lambda x: value
+        import bushy.config
+        self._Git = bushy.base.Git
+        self._config = bushy.config._config
+        self.git = DummyGit(current, branches, results)
+        bushy.base.Git = lambda runner=None, path=None: self.git
+        bushy.config._config = bushy.config.GitConfig()
 
     def _makeOne(self, args):
         from bushy._pivotal import Feature
 
-        return Feature(input=self._input, output=self._output, args=args)
+        command = Feature(input=self._input, output=self._output, args=args)
+        if not hasattr(self, '_Git'):
+            # never the repository the tests are run from
+            command._git = DummyGit()
+        return command
 
-    def _makeStory(self, xml, args):
+    def _makeStory(self, xml, context):
         from bushy._pivotal import Story
         from pivotal import anyetree
 
         etree = anyetree.etree.fromstring(xml)
-        return Story(etree, input=self._input, output=self._output, args=args)
+        return Story(etree, context)
 
     def test_type(self):
         pick = self._makeOne([])
 
         self.assertEqual(pick.type, 'feature')
 
+    def _makePrefetching(self, cache_dir, states):
+        from bushy.cache import StoryCache
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick._cache = StoryCache(cache_dir)
+        pick._http = DummyHttp()
+        story = '<story><id>%s</id><current_state>%s</current_state></story>'
+        def respond(url, method, body):
+            if 'filter=' in url:
+                return '<stories>%s</stories>' % ''.join(story % (i, 'unstarted') for i in range(1, 6))
+            story_id = int(url.rsplit('/', 1)[1])
+            return story % (story_id, states.get(story_id, 'unstarted'))
+        pick._http.content = respond
+        return pick
+
+    def test_get_story_first_only(self):
+        self._patch_git()
+        pick = self._makeOne(['--no-cache'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick.options['only_mine'] = True
+        pick.options['full_name'] = 'Mr Test'
+        pick._http = DummyHttp()
+        pick._http.content = '<stories><story><id>1</id></story></stories>'
+
+        self.assertEqual(pick.get_story().id, 1)
+        url = pick._http.requests[0][0]
+        self.assertTrue('limit=1' in url)
+        self.assertTrue('owned_by%3A%22Mr+Test%22' in url)
+
+    def test_get_story_projects(self):
+        self._patch_git()
+        pick = self._makeOne(['--no-cache'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = '1,2'
+        pick._http = DummyHttp()
+        def respond(url, method, body):
+            if '/projects/1/' in url:
+                return '<stories/>'
+            return '<stories><story><id>21</id><project_id>2</project_id></story></stories>'
+        pick._http.content = respond
+
+        story = pick.get_story()
+
+        self.assertEqual((story.id, story.project_id), (21, 2))
+        self.assertEqual(len(pick._http.requests), 2)
+        self.assertNotEqual(pick.queue_key({'state': 'unstarted'}),
+                            self._makeOne([]).queue_key({'state': 'unstarted'}))
+
+    def test_queue_key(self):
+        self._patch_git()
+        pick = self._makeOne([])
+        pick.options['project_id'] = '111'
+        other = self._makeOne([])
+        other.options['project_id'] = '222'
+
+        self.assertEqual(pick.queue_key({'state': 'unstarted', 'type': 'feature'}),
+                         'queue:state:unstarted type:feature projects:111')
+        # projects don't share a queue
+        self.assertNotEqual(pick.queue_key({'state': 'unstarted'}),
+                            other.queue_key({'state': 'unstarted'}))
+
+    def _makeChoosing(self, states):
+        pick = self._makeOne(['--no-cache', '-i'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick._http = DummyHttp()
+        story = '<story><id>%s</id><name>%s</name><current_state>%s</current_state></story>'
+        names = ['Login page', 'Export reports', 'Export invoices']
+        def respond(url, method, body):
+            if 'filter=' in url:
+                return '<stories>%s</stories>' % ''.join(
+                    story % (i + 1, name, 'unstarted') for i, name in enumerate(names))
+            story_id = int(url.rsplit('/', 1)[1])
+            return story % (story_id, names[story_id - 1], states.get(story_id, 'unstarted'))
+        pick._http.content = respond
+        return pick
+
+    def test_choose_story(self):
+        self._patch_git()
+        pick = self._makeChoosing({})
+        answers = iter(['export', 'exp invo', '1'])
+
+        story = pick.choose_story(lambda prompt: next(answers))
+
+        self.assertEqual((story.id, story.name), (3, 'Export invoices'))
+        # the backlog once, then only the chosen story
+        urls = [request[0] for request in pick._http.requests]
+        self.assertEqual(len(urls), 2)
+        self.assertTrue('filter=' in urls[0])
+        self.assertTrue(urls[1].endswith('/stories/3'))
+        output = self._output.getvalue()
+        self.assertTrue('3 of 3 features:' in output)
+        self.assertTrue('  1. 2 Export reports (0 pts)' in output)
+
+    def test_choose_story_started(self):
+        self._patch_git()
+        pick = self._makeChoosing({1: 'started'})
+        answers = iter(['', ''])
+
+        story = pick.choose_story(lambda prompt: next(answers))
+
+        self.assertEqual(story.id, 2)
+        self.assertTrue('Story 1 is no longer available' in self._output.getvalue())
+
+    def test_choose_story_none(self):
+        self._patch_git()
+        pick = self._makeChoosing({})
+        answers = iter(['missing', ''])
+
+        self.assertEqual(pick.choose_story(lambda prompt: next(answers)), None)
+        self.assertTrue('No features match "missing"' in self._output.getvalue())
+
+    def test_get_story_mirror(self):
+        import shutil
+        import tempfile
+        from bushy.mirror import Mirror
+        self._patch_git()
+        self.git.common_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.git.common_dir)
+        mirror = Mirror.for_repository(self.git.common_dir)
+        mirror.reset(5, [{'id': 1, 'current_state': 'started', 'story_type': 'feature'},
+                         {'id': 2, 'current_state': 'unstarted', 'story_type': 'bug'},
+                         {'id': 3, 'current_state': 'unstarted', 'story_type': 'feature'}])
+        mirror.save()
+        import bushy.config
+        bushy.config._config = bushy.config.GitConfig({'bushy.mirror': 'true'})
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick._http = DummyHttp()
+        pick._http.content = '<activities/>'
+
+        self.assertEqual(pick.get_story().id, 3)
+        pick.close()
+
+        # only the activity since the mirror's version was requested
+        self.assertEqual(len(pick._http.requests), 1)
+        self.assertEqual(pick._refill, None)
+
+    def test_prefetch(self):
+        import shutil
+        import tempfile
+        self._patch_git()
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        pick = self._makePrefetching(cache_dir, {})
+        self.assertEqual(pick.get_story().id, 1)
+        pick.close()
+
+        queue = pick.cache.get(pick.queue_key({'state': 'unstarted', 'type': 'feature'}))
+        self.assertEqual([record['id'] for record in queue['records']], [2, 3, 4])
+
+        # story 2 was started by someone else in the meantime
+        pick = self._makePrefetching(cache_dir, {2: 'started'})
+        self.assertEqual(pick.get_story().id, 3)
+        pick.close()
+
+        urls = [request[0] for request in pick._http.requests]
+        self.assertTrue(urls[0].endswith('/stories/2'))
+        self.assertTrue(urls[1].endswith('/stories/3'))
+        self.assertTrue('filter=' in urls[2])
+        self.assertEqual(len(urls), 3)
+        queue = pick.cache.get(pick.queue_key({'state': 'unstarted', 'type': 'feature'}))
+        self.assertEqual([record['id'] for record in queue['records']], [1, 2, 4])
+
+    def test_prefetch_projects_one_worker(self):
+        import shutil
+        import tempfile
+        import threading
+        import bushy.config
+        self._patch_git()
+        bushy.config._config = bushy.config.GitConfig({'bushy.concurrency': '1'})
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        pick = self._makePrefetching(cache_dir, {})
+        pick.options['project_id'] = '1,2'
+        story = '<story><id>%s</id><project_id>%s</project_id><current_state>unstarted</current_state></story>'
+        def respond(url, method, body):
+            project_id = int(url.split('/projects/')[1].split('/')[0])
+            return '<stories>%s</stories>' % ''.join(story % (project_id * 10 + i, project_id) for i in range(1, 4))
+        pick._http.content = respond
+
+        # the projects are listed concurrently from the refill, which mustn't
+        # wait on the pool's only worker while holding it
+        worker = threading.Thread(target=lambda: pick.get_story() and pick.close())
+        worker.daemon = True
+        worker.start()
+        worker.join(5)
+
+        self.assertFalse(worker.isAlive())
+        self.assertEqual(pick._story.id, 11)
+        queue = pick.cache.get(pick.queue_key({'state': 'unstarted', 'type': 'feature'}))
+        self.assertEqual([record['id'] for record in queue['records']], [21, 12, 22])
+
+    def test_prefetch_disabled(self):
+        import shutil
+        import tempfile
+        import bushy.config
+        self._patch_git()
+        bushy.config._config = bushy.config.GitConfig({'bushy.prefetch': '0'})
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+
+        pick = self._makePrefetching(cache_dir, {})
+        self.assertEqual(pick.get_story().id, 1)
+        pick.close()
+
+        self.assertEqual(pick._refill, None)
+        self.assertEqual(pick.cache.get(pick.queue_key({'state': 'unstarted', 'type': 'feature'})), None)
+
     def test_plural_type(self):
         pick = self._makeOne([])
 
@@ -276,19 +1280,21 @@ class TestFeature(unittest.TestCase):
         self.assertEqual(pick.project.token, 'token')
 
         # test badly configured api / project values don't break the machinery
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '401'})
         self.assertEqual(pick._story, None)
         self.assertEqual(pick.get_story(), None) # call the property
         self.assertEqual(pick._story, None)
 
     def test_call(self):
-        self._patch_getoutput('')
+        self._patch_git()
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
         pick.options['project_id'] = 'uniqueproject'
         pick.options['full_name'] = 'Mr Test'
         
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -307,9 +1313,42 @@ class TestFeature(unittest.TestCase):
         self.assertEqual(out[2], 'URL: %s\n' % story.url)
         self.assertEqual(out[3], 'Updating feature status in Pivotal Tracker...\n')
         self.assertEqual(out[4], 'Creating new branch: 12345-feature\n')
+        self.assertEqual(self.git.commands, [('checkout', '-b', '12345-feature')])
+
+    def test_call_note_in_background(self):
+        import threading
+        from bushy.git import Result
+        self._patch_git()
+
+        pick = self._makeOne(['-q'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick.options['full_name'] = 'Mr Test'
+        story = self._makeStory('<story><id>12345</id></story>', pick)
+        story.h = DummyHttp()
+        checked_out = threading.Event()
+        def content(url, method, body):
+            if method == 'POST':
+                # the note doesn't hold up the branch
+                checked_out.wait(5)
+                return '<note/>' if checked_out.is_set() else ''
+            return '<story><id>12345</id><current_state>started</current_state><owned_by>Mr Test</owned_by></story>'
+        story.h.content = content
+        pick._story = story
+        def checkout(args):
+            checked_out.set()
+            return Result(0, '', '')
+        self.git.results['checkout'] = checkout
+
+        pick()
+        pick.close()
+
+        self.assertEqual(self.git.commands, [('checkout', '-b', '12345-feature')])
+        self.assertEqual([r[1] for r in story.h.requests], ['PUT', 'POST'])
+        self.assertEqual(pick._note.result(), '<note/>')
 
     def test_call_existing_branch(self):
-        self._patch_getoutput('12345-feature')
+        self._patch_git(branches=['12345-feature'])
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -317,7 +1356,7 @@ class TestFeature(unittest.TestCase):
         pick.options['only_mine'] = False
         pick.options['full_name'] = 'Mr Test'
         
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -336,9 +1375,35 @@ class TestFeature(unittest.TestCase):
         self.assertEqual(out[2], 'URL: %s\n' % story.url)
         self.assertEqual(out[3], 'Updating feature status in Pivotal Tracker...\n')
         self.assertEqual(out[4], 'Switching to branch 12345-feature\n')
+        self.assertEqual(self.git.commands, [('checkout', '12345-feature')])
+
+    def test_call_existing_story_branch(self):
+        self._patch_git(branches=['1123-feature', '12345-login-form'])
+
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick.options['only_mine'] = False
+        pick.options['full_name'] = 'Mr Test'
+
+        story = self._makeStory('<story><id>12345</id><name>Story 1</name><url>http://url</url></story>', pick)
+        story.owned_by = pick.options['full_name']
+        story.h = DummyHttp()
+        story.h.content = '<story><id>12345</id><current_state>started</current_state><owned_by>Mr Test</owned_by></story>'
+
+        pick._story = story
+
+        def raw_input(prompt): # pragma: no cover
+            self.fail('The existing branch should be used without asking')
+        pick(raw_input=raw_input)
+
+        self._output.seek(0)
+        out = self._output.readlines()
+        self.assertEqual(out[4], 'Switching to branch 12345-login-form\n')
+        self.assertEqual(self.git.commands, [('checkout', '12345-login-form')])
 
     def test_call_only_mine_no_story(self):
-        self._patch_getoutput('')
+        self._patch_git()
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -346,6 +1411,8 @@ class TestFeature(unittest.TestCase):
         pick.options['only_mine'] = True
         pick.options['full_name'] = 'Mr Test'
 
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '401'})
         pick()
 
         self._output.seek(0)
@@ -354,7 +1421,7 @@ class TestFeature(unittest.TestCase):
         self.assertEqual(out[1], 'No features available!\n')
 
     def test_call_unable_to_update(self):
-        self._patch_getoutput('12345-feature')
+        self._patch_git(branches=['12345-feature'])
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -362,7 +1429,7 @@ class TestFeature(unittest.TestCase):
         pick.options['only_mine'] = False
         pick.options['full_name'] = 'Mr Test'
         
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -382,8 +1449,53 @@ class TestFeature(unittest.TestCase):
         self.assertEqual(out[3], 'Updating feature status in Pivotal Tracker...\n')
         self.assertEqual(out[4], 'Unable to update 12345\n')
 
+    def test_call_not_member(self):
+        self._patch_git()
+
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['api_version'] = '5'
+        pick.options['project_id'] = '99'
+        pick.options['full_name'] = 'Mr Test'
+        pick._http = DummyHttp()
+        pick._http.content = '[{"person": {"id": 7, "name": "Someone Else"}}]'
+        pick._story = self._makeStory('<story><id>12345</id><project_id>99</project_id></story>', pick)
+        pick._story.h = pick._http
+
+        pick(raw_input=lambda s: '')
+
+        self._output.seek(0)
+        out = self._output.readlines()
+        self.assertEqual(out[-2:], ['Mr Test is not a member of projects/99\n',
+                                    'Unable to update 12345\n'])
+        # only the members were looked up
+        self.assertEqual([r[1] for r in pick._http.requests], ['GET'])
+        self.assertEqual(self.git.commands, [])
+
+    def test_call_members_unavailable(self):
+        self._patch_git()
+
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['api_version'] = '5'
+        pick.options['project_id'] = '99'
+        pick.options['full_name'] = 'Mr Test'
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '408'})
+        pick._story = self._makeStory('<story><id>12345</id><project_id>99</project_id></story>', pick)
+        pick._story.h = pick._http
+
+        pick(raw_input=lambda s: '')
+
+        self._output.seek(0)
+        out = self._output.readlines()
+        # an unreachable Tracker isn't reported as a membership problem
+        self.assertEqual(out[-2:], ['Updating feature status in Pivotal Tracker...\n',
+                                    'Unable to update 12345\n'])
+        self.assertEqual(self.git.commands, [])
+
     def test_call_specify_story(self):
-        self._patch_getoutput('')
+        self._patch_git()
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -392,6 +1504,8 @@ class TestFeature(unittest.TestCase):
         pick.options['full_name'] = 'Mr Test'
         pick.options['target_story'] = '12345'
 
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '401'})
         pick()
 
         self._output.seek(0)
@@ -405,30 +1519,36 @@ class TestBug(unittest.TestCase):
         self._output = StringIO()
         
     def tearDown(self):
-        if hasattr(self, '_getoutput'):
+        if hasattr(self, '_Git'):
             import bushy.base
-            import bushy._pivotal
-            bushy.base.getoutput = self._getoutput
-            bushy._pivotal.getoutput = self._getoutput
+            import bushy.config
+            bushy.base.Git = self._Git
+            bushy.config._config = self._config
     
-    def _patch_getoutput(self, value):
+    def _patch_git(self, current='', branches=(), results=None):
         import bushy.base
-        import bushy._pivotal
-        self._getoutput = bushy.base.getoutput
-        bushy.base.getoutput = lambda x: value
-        bushy._pivotal.getoutput = lambda x: value
+        import bushy.config
+        self._Git = bushy.base.Git
+        self._config = bushy.config._config
+        self.git = DummyGit(current, branches, results)
+        bushy.base.Git = lambda runner=None, path=None: self.git
+        bushy.config._config = bushy.config.GitConfig()
 
     def _makeOne(self, args):
         from bushy._pivotal import Bug
 
-        return Bug(input=self._input, output=self._output, args=args)
+        command = Bug(input=self._input, output=self._output, args=args)
+        if not hasattr(self, '_Git'):
+            # never the repository the tests are run from
+            command._git = DummyGit()
+        return command
 
-    def _makeStory(self, xml, args):
+    def _makeStory(self, xml, context):
         from bushy._pivotal import Story
         from pivotal import anyetree
 
         etree = anyetree.etree.fromstring(xml)
-        return Story(etree, input=self._input, output=self._output, args=args)
+        return Story(etree, context)
 
     def test_type(self):
         pick = self._makeOne([])
@@ -455,19 +1575,21 @@ class TestBug(unittest.TestCase):
         self.assertEqual(pick.project.token, 'token')
 
         # test badly configured api / project values don't break the machinery
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '401'})
         self.assertEqual(pick._story, None)
         self.assertEqual(pick.get_story(), None) # call the property
         self.assertEqual(pick._story, None)
 
     def test_call(self):
-        self._patch_getoutput('')
+        self._patch_git()
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
         pick.options['project_id'] = 'uniqueproject'
         pick.options['full_name'] = 'Mr Test'
         
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -488,7 +1610,7 @@ class TestBug(unittest.TestCase):
         self.assertEqual(out[4], 'Creating new branch: 12345-bug\n')
 
     def test_call_existing_branch(self):
-        self._patch_getoutput('12345-bug')
+        self._patch_git(branches=['12345-bug'])
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -496,7 +1618,7 @@ class TestBug(unittest.TestCase):
         pick.options['only_mine'] = False
         pick.options['full_name'] = 'Mr Test'
         
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -517,7 +1639,7 @@ class TestBug(unittest.TestCase):
         self.assertEqual(out[4], 'Switching to branch 12345-bug\n')
 
     def test_call_only_mine_no_story(self):
-        self._patch_getoutput('')
+        self._patch_git()
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -525,6 +1647,8 @@ class TestBug(unittest.TestCase):
         pick.options['only_mine'] = True
         pick.options['full_name'] = 'Mr Test'
 
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '401'})
         pick()
 
         self._output.seek(0)
@@ -533,7 +1657,7 @@ class TestBug(unittest.TestCase):
         self.assertEqual(out[1], 'No bugs available!\n')
 
     def test_call_unable_to_update(self):
-        self._patch_getoutput('12345-bug')
+        self._patch_git(branches=['12345-bug'])
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -541,7 +1665,7 @@ class TestBug(unittest.TestCase):
         pick.options['only_mine'] = False
         pick.options['full_name'] = 'Mr Test'
         
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -567,64 +1691,113 @@ class TestFinish(unittest.TestCase):
         self._output = StringIO()
         
     def tearDown(self):
-        if hasattr(self, '_getoutput'):
+        if hasattr(self, '_Git'):
             import bushy.base
-            import bushy._pivotal
-            bushy.base.getoutput = self._getoutput
-            bushy._pivotal.getoutput = self._getoutput
+            import bushy.config
+            bushy.base.Git = self._Git
+            bushy.config._config = self._config
     
-    def _patch_getoutput(self, value):
+    def _patch_git(self, current='', branches=(), results=None, detached=False):
         import bushy.base
-        import bushy._pivotal
-        self._getoutput = bushy.base.getoutput
-        bushy.base.getoutput = lambda x: value
-        bushy._pivotal.getoutput = lambda x: value
+        import bushy.config
+        self._Git = bushy.base.Git
+        self._config = bushy.config._config
+        self.git = DummyGit(current, branches, results, detached)
+        bushy.base.Git = lambda runner=None, path=None: self.git
+        bushy.config._config = bushy.config.GitConfig()
 
     def _makeOne(self, args):
         from bushy._pivotal import Finish
 
-        return Finish(input=self._input, output=self._output, args=args)
+        command = Finish(input=self._input, output=self._output, args=args)
+        if not hasattr(self, '_Git'):
+            # never the repository the tests are run from
+            command._git = DummyGit()
+        return command
 
-    def _makeStory(self, xml, args):
+    def _makeStory(self, xml, context):
         from bushy._pivotal import Story
         from pivotal import anyetree
 
         etree = anyetree.etree.fromstring(xml)
-        return Story(etree, input=self._input, output=self._output, args=args)
+        return Story(etree, context)
 
     def test_no_current_branch(self):
-        self._patch_getoutput('')
+        self._patch_git()
         
         pick = self._makeOne([])
 
         self.assertEqual(pick.current_branch, '')
 
     def test_current_branch(self):
-        self._patch_getoutput('foo\n* bar\nbaz')
+        self._patch_git(current='bar', branches=['foo', 'bar', 'baz'])
         
         pick = self._makeOne([])
 
         self.assertEqual(pick.current_branch, 'bar')
 
     def test_story_id(self):
-        self._patch_getoutput('* 12345-feature')
+        self._patch_git(current='12345-feature')
         
         pick = self._makeOne([])
 
         self.assertEqual(pick.current_branch, '12345-feature')
         self.assertEqual(pick.story_id, '12345')
 
+    def test_current_branch_resolved_once(self):
+        self._patch_git(current='12345-feature')
+
+        pick = self._makeOne([])
+        pick.current_branch
+        pick.story_id
+        self.git('checkout', 'master')
+
+        self.assertEqual(pick.current_branch, '12345-feature')
+        self.assertEqual(self.git.heads_read, 1)
+
+    def test_call_detached(self):
+        self._patch_git(detached=True)
+
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+
+        pick()
+
+        self._output.seek(0)
+        out = self._output.readlines()
+        self.assertEqual(out[0], 'HEAD is detached, please checkout the branch for the '+\
+                         'story then re-run this command\n')
+        self.assertEqual(self.git.commands, [])
+
     def test_no_story(self):
-        self._patch_getoutput('* 12345-feature')
+        self._patch_git(current='12345-feature')
         
         pick = self._makeOne([])
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '401'})
 
         self.assertEqual(pick._story, None)
         self.assertEqual(pick.story, None)
         self.assertEqual(pick._story, None)
 
+    def test_call_no_story(self):
+        self._patch_git(current='12345-feature')
+
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick._http = DummyHttp()
+        pick._http.headers = DummyResponse({'status': '404'})
+
+        pick()
+
+        self._output.seek(0)
+        self.assertEqual(self._output.readlines(), ['Story 12345 is unavailable!\n'])
+        self.assertEqual(self.git.commands, [])
+
     def test_call_no_story_id(self):
-        self._patch_getoutput('* master')
+        self._patch_git(current='master')
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
@@ -639,13 +1812,13 @@ class TestFinish(unittest.TestCase):
                          'branch then re-run this command\n')
         
     def test_call_w_unfinished_error(self):
-        self._patch_getoutput('* 12345-feature\nerror: foo')
+        self._patch_git(current='12345-feature')
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
         pick.options['project_id'] = 'uniqueproject'
 
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -659,18 +1832,23 @@ class TestFinish(unittest.TestCase):
         
         self._output.seek(0)
         out = self._output.readlines()
-        self.assertEqual(out[0], 'Marking Story 12345 as finished...\n')
-        self.assertEqual(out[1], 'Unable to mark Story 12345 as finished\n')
+        self.assertEqual(out[1], 'Marking Story 12345 as finished...\n')
+        self.assertEqual(out[2], 'Unable to mark Story 12345 as finished\n')
+        # merged, but kept to finish again
+        self.assertEqual(self.git.commands, [('checkout', 'master'),
+                                             ('merge', '--no-ff', '12345-feature')])
         
-    def test_call_w_merge_error(self):
-        self._patch_getoutput('* 12345-feature\nerror: foo')
+    def test_call_w_checkout_error(self):
+        from bushy.git import Result
+        self._patch_git(current='12345-feature',
+                        results={'checkout': Result(1, '', 'error: foo\n')})
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
         pick.options['project_id'] = 'uniqueproject'
         pick.options['integration_branch'] = 'master'
 
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -684,21 +1862,53 @@ class TestFinish(unittest.TestCase):
         
         self._output.seek(0)
         out = self._output.readlines()
-        self.assertEqual(out[0], 'Marking Story 12345 as finished...\n')
-        self.assertEqual(out[1], 'Merging 12345-feature into master\n')
-        self.assertEqual(out[2], 'There was an error checking out master:\n')
-        self.assertEqual(out[3], '* 12345-feature\n')
-        self.assertEqual(out[4], 'error: foo\n')
+        self.assertEqual(out[0], 'Merging 12345-feature into master\n')
+        self.assertEqual(out[1], 'There was an error checking out master:\n')
+        self.assertEqual(out[2], 'error: foo\n')
+        self.assertEqual(self.git.commands, [('checkout', 'master')])
+        # the story isn't finished when its work couldn't be merged
+        self.assertEqual(story.h.requests, [])
+
+    def test_call_w_merge_error(self):
+        from bushy.git import Result
+        self._patch_git(current='12345-feature',
+                        results={'merge': Result(1, 'CONFLICT (content): Merge conflict in foo\n', '')})
+        
+        pick = self._makeOne([])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick.options['integration_branch'] = 'master'
+
+        story = self._makeStory('<story><id>12345</id><current_state>started</current_state></story>', pick)
+        story.h = DummyHttp()
+        story.h.content = '<story><id>12345</id><current_state>finished</current_state></story>'
+
+        pick._story = story
+        
+        pick()
+        
+        self._output.seek(0)
+        out = self._output.readlines()
+        self.assertEqual(out[0], 'Merging 12345-feature into master\n')
+        self.assertEqual(out[1], 'There was an error merging 12345-feature:\n')
+        self.assertEqual(out[2], 'CONFLICT (content): Merge conflict in foo\n')
+        # the merge is undone and the story left as it was
+        self.assertEqual(self.git.commands, [('checkout', 'master'),
+                                             ('merge', '--no-ff', '12345-feature'),
+                                             ('merge', '--abort'),
+                                             ('checkout', '12345-feature')])
+        self.assertEqual(story.h.requests, [])
+        self.assertEqual(story.current_state, 'started')
         
     def test_call(self):
-        self._patch_getoutput('* 12345-feature')
+        self._patch_git(current='12345-feature')
         
         pick = self._makeOne([])
         pick.options['api_token'] = 'token'
         pick.options['project_id'] = 'uniqueproject'
         pick.options['integration_branch'] = 'master'
 
-        story = self._makeStory('<xml></xml>', [])
+        story = self._makeStory('<xml></xml>', pick)
         story.id = 12345
         story.name = 'Story 1'
         story.url = 'http://url'
@@ -712,23 +1922,485 @@ class TestFinish(unittest.TestCase):
         
         self._output.seek(0)
         out = self._output.readlines()
-        self.assertEqual(out[0], 'Marking Story 12345 as finished...\n')
-        self.assertEqual(out[1], 'Merging 12345-feature into master\n')
+        self.assertEqual(out[0], 'Merging 12345-feature into master\n')
+        self.assertEqual(out[1], 'Marking Story 12345 as finished...\n')
         self.assertEqual(out[2], 'Removing 12345-feature branch\n')
         self.assertEqual(out[3], 'Merged code into trunk. Please push upstream and notify the release manager if necessary\n')
+        self.assertEqual(self.git.commands, [('checkout', 'master'),
+                                             ('merge', '--no-ff', '12345-feature'),
+                                             ('branch', '-d', '12345-feature')])
+        self.assertEqual(self.git.heads_read, 1)
         
 
+    def test_story_branches(self):
+        self._patch_git(branches=['master', '12345-feature', '123-bug',
+                                  'topic-branch', '123-other', '12a-feature'])
+
+        pick = self._makeOne([])
+
+        self.assertEqual(pick.story_branches(), [(123, '123-bug'),
+                                                 (123, '123-other'),
+                                                 (12345, '12345-feature')])
+
+    def test_call_all_no_branches(self):
+        self._patch_git(branches=['master'])
+
+        pick = self._makeOne(['--all'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+
+        pick()
+
+        self._output.seek(0)
+        self.assertEqual(self._output.readlines(), ['There are no story branches to finish\n'])
+
+    def test_call_all(self):
+        from bushy.git import Result
+        from bushy._pivotal import EMPTY_STORY
+        self._patch_git(branches=['master', '1-feature', '2-bug', '3-feature',
+                                  '4-conflict', '5-gone'],
+                        results={'merge': lambda args: Result(int(args[-1] == '4-conflict'), '', '')})
+
+        pick = self._makeOne(['--all'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick.options['integration_branch'] = 'master'
+
+        queries = []
+        def fetch_stories(qs):
+            queries.append(qs)
+            return [EMPTY_STORY._replace(id=1, current_state='started'),
+                    EMPTY_STORY._replace(id=2, current_state='delivered'),
+                    EMPTY_STORY._replace(id=3, current_state='unstarted'),
+                    EMPTY_STORY._replace(id=4, current_state='finished')]
+        pick.fetch_stories = fetch_stories
+        pick._http = DummyHttp()
+        def respond(url, method, body):
+            story_id = url.split('/stories/')[1].split('/')[0]
+            if method == 'POST':
+                return '<note/>'
+            state = story_id == '3' and 'unscheduled' or 'finished'
+            return '<story><id>%s</id><current_state>%s</current_state></story>' % (story_id, state)
+        pick._http.content = respond
+
+        pick()
+
+        self.assertEqual(queries, [{'id': '1,2,3,4,5', 'includedone': 'true'}])
+        methods = sorted((request[1], request[0].split('/stories/')[1])
+                         for request in pick._http.requests)
+        self.assertEqual(methods, [('POST', '1/notes'),
+                                   ('POST', '2/notes'),
+                                   ('PUT', '1'),
+                                   ('PUT', '3')])
+        self.assertEqual(self.git.commands, [('checkout', 'master'),
+                                             ('merge', '--no-ff', '1-feature'),
+                                             ('branch', '-d', '1-feature'),
+                                             ('merge', '--no-ff', '2-bug'),
+                                             ('branch', '-d', '2-bug'),
+                                             ('merge', '--no-ff', '3-feature'),
+                                             ('branch', '-d', '3-feature'),
+                                             ('merge', '--no-ff', '4-conflict'),
+                                             ('merge', '--abort')])
+        self._output.seek(0)
+        out = self._output.read().splitlines()
+        self.assertEqual(out[-6:], ['Story  Branch      Result',
+                                    '1      1-feature   merged',
+                                    '2      2-bug       merged',
+                                    '3      3-feature   merged, not finished (unscheduled)',
+                                    '4      4-conflict  merge failed',
+                                    '5      5-gone      story not found'])
+
+    def test_call_all_merge_first(self):
+        from bushy.git import Result
+        from bushy._pivotal import EMPTY_STORY
+        self._patch_git(branches=['1-feature', '2-conflict'],
+                        results={'merge': lambda args: Result(int(args[-1] == '2-conflict'), '', '')})
+
+        pick = self._makeOne(['--all'])
+        pick.options['api_token'] = 'token'
+        pick.options['project_id'] = 'uniqueproject'
+        pick.options['integration_branch'] = 'master'
+        pick.fetch_stories = lambda qs: [EMPTY_STORY._replace(id=1, current_state='started'),
+                                         EMPTY_STORY._replace(id=2, current_state='started')]
+        pick._http = DummyHttp()
+        def respond(url, method, body):
+            if method == 'POST':
+                return '<note/>'
+            # no story is updated until its branch has been merged
+            self.assertTrue(('merge', '--no-ff', '1-feature') in self.git.commands)
+            raise IOError('connection reset')
+        pick._http.content = respond
+
+        pick()
+
+        # the story whose branch didn't merge is left alone, and there is no
+        # note for the story which couldn't be updated
+        self.assertEqual([(request[1], request[0].split('/stories/')[1]) for request in pick._http.requests],
+                         [('PUT', '1')])
+        self._output.seek(0)
+        out = self._output.read().splitlines()
+        self.assertEqual(out[-3:], ['Story  Branch      Result',
+                                    '1      1-feature   merged, update failed: connection reset',
+                                    '2      2-conflict  merge failed'])
+
+
+class TestSearch(unittest.TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        import bushy.base
+        import bushy.config
+        self._input = StringIO()
+        self._output = StringIO()
+        self._config = bushy.config._config
+        bushy.config._config = bushy.config.GitConfig()
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+        self.git = DummyGit()
+        self.git.common_dir = self._tmpdir
+        self._Git = bushy.base.Git
+        bushy.base.Git = lambda runner=None, path=None: self.git
+        self.http = DummyHttp()
+        self.http.content = self._respond
+        self.started = set()
+
+    def tearDown(self):
+        import bushy.base
+        import bushy.config
+        bushy.config._config = self._config
+        bushy.base.Git = self._Git
+
+    STORY = ('<story><id>%s</id><story_type>%s</story_type><current_state>%s</current_state>'
+             '<name>%s</name><owned_by>%s</owned_by><notes><note><text>%s</text></note></notes></story>')
+
+    def _story(self, story_id):
+        stories = {1: ('feature', 'Login page', 'Needs a design'),
+                   2: ('bug', 'Export fails', 'Seen on the login page'),
+                   3: ('chore', 'Upgrade the server', ''),
+                   }
+        story_type, name, note = stories[story_id]
+        state, owner = story_id in self.started and ('started', 'Mr Test') or ('unstarted', '')
+        return self.STORY % (story_id, story_type, state, name, owner, note)
+
+    def _respond(self, url, method, body):
+        if method == 'PUT':
+            story_id = int(url.rsplit('/', 1)[1])
+            self.started.add(story_id)
+            return self._story(story_id)
+        if url.endswith('/notes'):
+            return '<note/>'
+        if 'includedone' in url:
+            return '<stories>%s</stories>' % ''.join(self._story(i) for i in (1, 2, 3))
+        story_id = int(url.split('id%3A', 1)[1].split('&', 1)[0])
+        return '<stories>%s</stories>' % self._story(story_id)
+
+    def _makeOne(self, args):
+        from bushy._pivotal import Search
+        search = Search(input=self._input, output=self._output, args=['git-bushy', 'search'] + args)
+        search.options['api_token'] = 'token'
+        search.options['project_id'] = 'uniqueproject'
+        search.options['full_name'] = 'Mr Test'
+        search._http = self.http
+        return search
+
+    def _index(self):
+        from bushy.index import SearchIndex
+        return SearchIndex.for_repository(self._tmpdir)
+
+    def _run(self, args, answers=()):
+        answers = iter(answers)
+        search = self._makeOne(args)
+        try:
+            return search(lambda prompt: next(answers))
+        finally:
+            search.close()
+
+    def test_query(self):
+        from bushy._pivotal import Search
+
+        self.assertEqual(self._makeOne(['login', 'page']).query, 'login page')
+        self.assertEqual(Search(self._input, self._output, ['login']).query, 'login')
+
+    def test_search(self):
+        self._run(['login'], [''])
+
+        output = self._output.getvalue()
+        self.assertTrue('Indexed 3 stories' in output)
+        self.assertTrue('  1. 1 [feature, unstarted] Login page' in output)
+        self.assertTrue('  2. 2 [bug, unstarted] Export fails' in output)
+        self.assertEqual(len(self.http.requests), 1)
+        self.assertTrue(self._index().exists())
+
+        # then answered from the index
+        self._run(['server'], [''])
+        self.assertTrue('  1. 3 [chore, unstarted] Upgrade the server' in self._output.getvalue())
+        self.assertEqual(len(self.http.requests), 1)
+
+    def test_no_hits(self):
+        self._index().reset([])
+
+        self._run(['login'])
+
+        self.assertTrue('No stories match "login"' in self._output.getvalue())
+        self.assertEqual(self.http.requests, [])
+
+    def test_rebuild(self):
+        self._index().reset([])
+
+        self._run(['--rebuild', 'login'], [''])
+
+        self.assertTrue('  1. 1 [feature, unstarted] Login page' in self._output.getvalue())
+
+    def test_start(self):
+        self._run(['export'], ['1', ''])
+
+        output = self._output.getvalue()
+        self.assertTrue('Retrieving story 2 from Pivotal Tracker' in output)
+        self.assertTrue(('checkout', '-b', '2-bug') in self.git.commands)
+        # the story's new state was indexed
+        self.assertEqual(self._index().search('export')[0]['current_state'], 'started')
+
+    def test_start_chore(self):
+        self._run(['server'], ['1'])
+
+        self.assertTrue('Only features and bugs can be started, story 3 is a chore' in self._output.getvalue())
+        self.assertEqual(len(self.http.requests), 1)
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        import bushy.config
+        self._input = StringIO()
+        self._output = StringIO()
+        self._config = bushy.config._config
+        bushy.config._config = bushy.config.GitConfig()
+        self._tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._tmpdir)
+
+    def tearDown(self):
+        import bushy.config
+        bushy.config._config = self._config
+
+    def _makeOne(self, args=[]):
+        from bushy._pivotal import Sync
+        sync = Sync(input=self._input, output=self._output, args=args)
+        sync.options['api_token'] = 'token'
+        sync.options['project_id'] = 'uniqueproject'
+        sync._git = DummyGit()
+        sync._git.common_dir = self._tmpdir
+        sync._http = DummyHttp()
+        return sync
+
+    def _makeOutbox(self):
+        from bushy.outbox import Outbox
+        return Outbox.for_repository(self._tmpdir)
+
+    def test_send(self):
+        sync = self._makeOne()
+        entry = {'method': 'PUT', 'url': 'http://url', 'body': u'<story/>'}
+
+        self.assertEqual(sync.send(entry), None)
+        self.assertEqual(sync._http.requests[0][:2], ('http://url', 'PUT'))
+        self.assertEqual(sync._http.requests[0][2]['X-TrackerToken'], 'token')
+
+        for status in ('503', '408', '429'):
+            sync._http.headers['status'] = status
+            self.assertEqual(sync.send(entry), False)
+
+        sync._http.headers['status'] = '404'
+        self.assertTrue(sync.send(entry).startswith('404'))
+
+    def test_send_content_type(self):
+        sync = self._makeOne()
+
+        sync.send({'method': 'PUT', 'url': 'http://url', 'body': u'{}', 'content_type': 'application/json'})
+        sync.send({'method': 'PUT', 'url': 'http://url', 'body': u'<story/>'})
+
+        self.assertEqual(sync._http.requests[0][2]['Content-type'], 'application/json')
+        self.assertEqual(sync._http.requests[1][2]['Content-type'], 'application/xml')
+
+    def _makeNote(self, **kw):
+        entry = {'method': 'POST', 'url': 'http://url/1/notes', 'body': u'<note><text>Done</text></note>',
+                 'note': u'Done', 'story_url': 'http://url/1', 'attempted': True}
+        entry.update(kw)
+        return entry
+
+    def test_send_note_added(self):
+        sync = self._makeOne()
+        sync._http.content = '<story><id>1</id><notes><note><text>Started</text></note><note><text>Done</text></note></notes></story>'
+
+        self.assertEqual(sync.send(self._makeNote()), None)
+
+        # the note from the attempt which failed isn't added again
+        self.assertEqual([r[:2] for r in sync._http.requests], [('http://url/1', 'GET')])
+
+    def test_send_note_missing(self):
+        sync = self._makeOne()
+        sync._http.content = '<story><id>1</id><notes><note><text>Done twice</text></note></notes></story>'
+
+        self.assertEqual(sync.send(self._makeNote()), None)
+        self.assertEqual(sync.send(self._makeNote(attempted=None)), None)
+
+        self.assertEqual([r[:2] for r in sync._http.requests],
+                         [('http://url/1', 'GET'), ('http://url/1/notes', 'POST'),
+                          ('http://url/1/notes', 'POST')])
+
+    def test_send_note_json(self):
+        sync = self._makeOne()
+        sync._http.content = '{"kind":"story","id":1,"comments":[{"kind":"comment","text":"Done"}]}'
+
+        self.assertEqual(sync.send(self._makeNote(content_type='application/json')), None)
+        self.assertEqual(len(sync._http.requests), 1)
+
+    def test_send_note_unreachable(self):
+        sync = self._makeOne()
+        sync._http.headers['status'] = '503'
+
+        self.assertEqual(sync.send(self._makeNote()), False)
+        self.assertEqual([r[:2] for r in sync._http.requests], [('http://url/1', 'GET')])
+
+    def test_send_owner(self):
+        import json
+        sync = self._makeOne()
+        sync._http.content = '[{"person": {"id": 7, "name": "Mr Test"}}]'
+        entry = {'method': 'PUT', 'url': 'http://url/1', 'body': u'{"current_state": "started"}',
+                 'content_type': 'application/json', 'owner': 'Mr Test', 'project_id': 99}
+
+        self.assertEqual(sync.send(entry), None)
+        self.assertEqual(sync.send(dict(entry, owner='Someone Else')),
+                         'Someone Else is not a member of projects/99')
+
+        requests = sync._http.requests
+        # the members are looked up once
+        self.assertEqual([r[1] for r in requests], ['GET', 'PUT'])
+        self.assertTrue('/projects/99/memberships?' in requests[0][0])
+        self.assertEqual(json.loads(requests[1][3]), {'current_state': 'started', 'owner_ids': [7]})
+
+    def test_send_owner_unreachable(self):
+        sync = self._makeOne()
+        sync._http.headers['status'] = '503'
+        entry = {'method': 'PUT', 'url': 'http://url/1', 'body': u'{}',
+                 'content_type': 'application/json', 'owner': 'Mr Test', 'project_id': 99}
+
+        self.assertEqual(sync.send(entry), False)
+        self.assertEqual([r[1] for r in sync._http.requests], ['GET'])
+
+    def test_send_transport_failure(self):
+        from bushy.transport import Response
+        sync = self._makeOne()
+        sync._http.headers = Response(400, 'Request Failed')
+        sync._http.headers.error = 'Connection refused'
+
+        self.assertEqual(sync.send({'method': 'PUT', 'url': 'http://url', 'body': u''}), False)
+
+    def test_call_nothing_queued(self):
+        sync = self._makeOne()
+
+        sync()
+
+        self._output.seek(0)
+        self.assertEqual(self._output.readlines(), ['There are no changes to send\n'])
+
+    def test_call(self):
+        outbox = self._makeOutbox()
+        outbox.append(1, 'PUT', 'http://url/1', '<story/>')
+        outbox.append(2, 'PUT', 'http://url/2', '<story/>')
+        outbox.append(2, 'POST', 'http://url/2/notes', '<note/>')
+        outbox.append(3, 'PUT', 'http://url/3', '<story/>')
+        sync = self._makeOne()
+        statuses = {'http://url/2': '503', 'http://url/3': '404'}
+        def request(url, method, headers={}, body=''):
+            sync._http.requests.append((url, method, headers, body))
+            return DummyResponse({'status': statuses.get(url, '200')}), ''
+        sync._http.request = request
+
+        sync()
+
+        self._output.seek(0)
+        out = self._output.readlines()
+        self.assertEqual(out[0], 'Sending 4 changes to Pivotal Tracker...\n')
+        self.assertEqual(out[1], 'Sent 1 changes\n')
+        self.assertTrue(out[2].startswith('Gave up on PUT http://url/3 (story 3): 404'))
+        self.assertEqual(out[3], '2 changes could not be sent, run git bushy sync to try again\n')
+        self.assertEqual(sorted(r[0] for r in sync._http.requests),
+                         ['http://url/1', 'http://url/2', 'http://url/3'])
+        self.assertEqual([e['url'] for e in outbox.pending()],
+                         ['http://url/2', 'http://url/2/notes'])
+
+    def test_call_locked(self):
+        outbox = self._makeOutbox()
+        outbox.append(1, 'PUT', 'http://url/1', '<story/>')
+        lock = outbox.lock()
+        self.addCleanup(lock.close)
+        sync = self._makeOne()
+
+        sync()
+
+        self._output.seek(0)
+        self.assertEqual(self._output.readlines(),
+                         ['The changes are already being sent by another process\n'])
+        self.assertEqual(sync._http.requests, [])
+
+
+class DummyGit(object):
+    git_dir = common_dir = None
+
+    def __init__(self, current='', branches=(), results=None, detached=False):
+        self.current = current
+        self.branches = set(branches)
+        self.results = results or {}
+        self.detached = detached
+        self.commands = []
+        self.heads_read = 0
+
+    def __call__(self, *args):
+        from bushy.git import Result
+        self.commands.append(args)
+        result = self.results.get(args[0], Result(0, '', ''))
+        if callable(result):
+            result = result(args)
+        if args[0] == 'checkout' and result.ok:
+            self.current = args[-1]
+        return result
+
+    def branch_exists(self, name):
+        return name in self.branches
+
+    def story_branches(self, story_id):
+        prefix = '%s-' % story_id
+        return sorted(name for name in self.branches if name.startswith(prefix))
+
+    def current_branch(self):
+        self.heads_read += 1
+        return self.current
+
+class DummyResponse(dict):
+    error = None
+    reason = ''
+
+    @property
+    def status(self):
+        return int(self['status'])
+
 class DummyHttp(object):
     def __init__(self):
         self.requests = []
-        self.headers = {'status': '200',
-                        }
+        self.headers = DummyResponse({'status': '200',
+                                      })
         self.content = ''
         self.responses = []
 
     def request(self, url, method, headers={}, body=''):
         self.requests.append((url, method, headers, body))
+        if callable(self.content):
+            return self.headers, self.content(url, method, body)
         if len(self.responses):
             print self.responses
             return self.headers, self.responses.pop(0)
         return self.headers, self.content
+
+    def stream(self, url, method, headers={}, body=''):
+        resp, content = self.request(url, method, headers=headers, body=body)
+        return resp, StringIO(content)
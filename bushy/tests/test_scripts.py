@@ -0,0 +1,213 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from StringIO import StringIO
+
+class DummyCommand(object):
+    calls = []
+
+    def __call__(self):
+        self.calls.append(self.__class__.__name__)
+        return 'done'
+
+    def close(self):
+        self.calls.append('close')
+
+class Feature(DummyCommand):
+    pass
+
+class Profiled(DummyCommand):
+    options = {'profile': True}
+
+    def __call__(self):
+        from bushy.trace import span
+        with span('http', 'GET /stories'):
+            pass
+        return super(Profiled, self).__call__()
+
+class TestDispatch(unittest.TestCase):
+    def setUp(self):
+        import bushy.config
+        import bushy.scripts
+        self._config = bushy.config._config
+        self._entry_points = bushy.scripts._entry_points
+        self._platforms = bushy.scripts.PLATFORMS.copy()
+        bushy.scripts.PLATFORMS['dummy'] = 'bushy.tests.test_scripts'
+        DummyCommand.calls = []
+
+    def tearDown(self):
+        import bushy.config
+        import bushy.scripts
+        bushy.config._config = self._config
+        bushy.scripts._entry_points = self._entry_points
+        bushy.scripts.PLATFORMS.clear()
+        bushy.scripts.PLATFORMS.update(self._platforms)
+
+    def _callFUT(self, name, platform=None):
+        from bushy.scripts import dispatch
+        return dispatch(name, platform)
+
+    def _patch_config(self, values):
+        import bushy.config
+        bushy.config._config = bushy.config.GitConfig(values)
+
+    def _patch_entry_points(self, entry_points):
+        import bushy.scripts
+        scans = []
+        def _entry_points():
+            scans.append(1)
+            return entry_points
+        bushy.scripts._entry_points = _entry_points
+        return scans
+
+    def test_configured_platform(self):
+        self._patch_config({'bushy.platform': ' dummy\n'})
+        scans = self._patch_entry_points([])
+
+        self.assertEqual(self._callFUT('Feature'), 'done')
+        self.assertEqual(DummyCommand.calls, ['Feature', 'close'])
+        # a built in platform is found without scanning entry points
+        self.assertEqual(scans, [])
+
+    def test_profile(self):
+        self._patch_config({'bushy.platform': 'dummy'})
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self._callFUT('Profiled')
+            report = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+        self.assertTrue(report.startswith('Profile of Profiled ('))
+        self.assertTrue('  command         1' in report)
+        self.assertTrue('  http            1' in report)
+        self.assertTrue(report.endswith('GET /stories\n'))
+
+    def test_trace_file(self):
+        import json
+        from bushy import trace
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'trace.jsonl')
+        self._patch_config({'bushy.platform': 'dummy', 'bushy.trace-file': path})
+
+        stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            self._callFUT('Feature')
+            # --profile's report isn't wanted on the real stderr
+            self._callFUT('Profiled')
+        finally:
+            sys.stderr = stderr
+
+        records = [json.loads(line) for line in open(path)]
+        self.assertEqual([(r['command'], r['category']) for r in records],
+                         [('Feature', 'command'), ('Profiled', 'command'), ('Profiled', 'http')])
+        self.assertEqual(records[2]['parent'], records[1]['id'])
+        self.assertNotEqual(records[0]['trace'], records[1]['trace'])
+        # tracing stops with the command
+        self.assertEqual(trace.span('git', 'status'), trace.NULL_SPAN)
+
+    def test_entry_point_platform(self):
+        import bushy.scripts
+        del bushy.scripts.PLATFORMS['dummy']
+        self._patch_entry_points([('dummy', 'bushy.tests.test_scripts')])
+
+        self.assertEqual(self._callFUT('Feature', 'dummy'), 'done')
+
+    def test_unsupported_platform(self):
+        self._patch_config({})
+        self._patch_entry_points([('other', 'bushy.tests.no_such_module')])
+
+        try:
+            self._callFUT('Feature')
+        except NotImplementedError as e:
+            self.assertEqual(str(e), 'The platform  is not supported, please update your '
+                             'configuration with one of the following platforms: '
+                             'dummy, other, pivotal')
+        else: # pragma: no cover
+            self.fail('NotImplementedError not raised')
+        self.assertFalse('bushy.tests.no_such_module' in sys.modules)
+
+    def test_find_platforms(self):
+        from bushy.scripts import find_platforms
+        self._patch_entry_points([('other', 'other.module'),
+                                  ('pivotal', 'other.pivotal')])
+
+        platforms = find_platforms()
+
+        self.assertEqual(platforms['other'], 'other.module')
+        # built in platforms can't be replaced
+        self.assertEqual(platforms['pivotal'], 'bushy._pivotal')
+
+
+class TestBushy(unittest.TestCase):
+    def setUp(self):
+        import bushy.scripts
+        self._argv = sys.argv
+        self._stderr = sys.stderr
+        self._run = bushy.scripts.run
+        self.runs = []
+        bushy.scripts.run = lambda name: self.runs.append(name)
+        sys.stderr = StringIO()
+
+    def tearDown(self):
+        import bushy.scripts
+        sys.argv = self._argv
+        sys.stderr = self._stderr
+        bushy.scripts.run = self._run
+
+    def _callFUT(self, argv):
+        from bushy.scripts import bushy
+        sys.argv = argv
+        return bushy()
+
+    def test_subcommand(self):
+        self._callFUT(['git-bushy', 'sync', '-q'])
+        self._callFUT(['git-bushy', 'search', 'login'])
+
+        self.assertEqual(self.runs, ['Sync', 'Search'])
+
+    def test_usage(self):
+        self.assertEqual(self._callFUT(['git-bushy']), 2)
+        self.assertEqual(self._callFUT(['git-bushy', 'unknown']), 2)
+
+        self.assertEqual(self.runs, [])
+        self.assertTrue(sys.stderr.getvalue().startswith('usage: git bushy <search|sync>'))
+
+
+class TestEntryPoints(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+        self._path = sys.path[:]
+        sys.path[:] = [self._tmpdir, self._tmpdir + '/missing']
+
+    def tearDown(self):
+        sys.path[:] = self._path
+        shutil.rmtree(self._tmpdir)
+
+    def _callFUT(self):
+        from bushy.scripts import _entry_points
+        return _entry_points()
+
+    def _write(self, metadata, content):
+        os.makedirs(os.path.join(self._tmpdir, metadata))
+        f = open(os.path.join(self._tmpdir, metadata, 'entry_points.txt'), 'w')
+        f.write(content)
+        f.close()
+
+    def test_entry_points(self):
+        self._write('other-1.0.egg-info', '[console_scripts]\n'
+                                          'git-other = other:main\n\n'
+                                          '[bushy.platforms]\n'
+                                          'Other = other.bushy\n')
+        self._write('third-1.0.dist-info', '[bushy.platforms]\n'
+                                           'third = third.platform:Platform\n')
+        self._write('plain-1.0.egg/EGG-INFO', '[console_scripts]\n')
+        self._write('broken-1.0.egg-info', 'not an ini file')
+
+        self.assertEqual(sorted(self._callFUT()), [('Other', 'other.bushy'),
+                                                   ('third', 'third.platform')])
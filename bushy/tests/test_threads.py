@@ -0,0 +1,87 @@
+import unittest
+
+class TestBackground(unittest.TestCase):
+    def _callFUT(self, func, *args, **kw):
+        from bushy.threads import background
+        return background(func, *args, **kw)
+
+    def test_result(self):
+        future = self._callFUT(lambda a, b=0: a + b, 1, b=2)
+
+        self.assertEqual(future.result(), 3)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('foo')
+        future = self._callFUT(fail)
+
+        self.assertRaises(ValueError, future.result)
+
+    def test_overlaps(self):
+        import threading
+        started = threading.Event()
+        release = threading.Event()
+        def wait():
+            started.set()
+            release.wait(5)
+            return 'done'
+        future = self._callFUT(wait)
+
+        self.assertTrue(started.wait(5) or started.is_set())
+        release.set()
+        self.assertEqual(future.result(), 'done')
+
+
+class TestPool(unittest.TestCase):
+    def _makeOne(self, size):
+        from bushy.threads import Pool
+        return Pool(size)
+
+    def test_map(self):
+        pool = self._makeOne(2)
+
+        self.assertEqual(pool.map(lambda n: n * 2, range(5)), [0, 2, 4, 6, 8])
+
+    def test_bounded(self):
+        import time
+        import threading
+        lock = threading.Lock()
+        running = []
+        peak = []
+        def work(n):
+            with lock:
+                running.append(n)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(n)
+            return n
+        pool = self._makeOne(3)
+
+        self.assertEqual(pool.map(work, range(10)), range(10))
+        self.assertEqual(max(peak), 3)
+
+    def test_nested(self):
+        import threading
+        pool = self._makeOne(1)
+        results = []
+
+        # the inner work can't wait for the only slot, which the outer holds
+        worker = threading.Thread(target=lambda: results.append(
+            pool.submit(lambda: pool.map(lambda n: n * 2, range(3))).result()))
+        worker.daemon = True
+        worker.start()
+        worker.join(5)
+
+        self.assertEqual(results, [[0, 2, 4]])
+
+    def test_exception(self):
+        def fail(n):
+            raise ValueError(n)
+        pool = self._makeOne(1)
+
+        future = pool.submit(fail, 1)
+
+        self.assertRaises(ValueError, future.result)
+        # the slot is given back
+        self.assertEqual(pool.submit(lambda: 'ok').result(), 'ok')
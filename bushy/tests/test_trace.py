@@ -0,0 +1,159 @@
+import unittest
+
+class TestSpan(unittest.TestCase):
+    def tearDown(self):
+        from bushy import trace
+        trace.stop()
+
+    def _callFUT(self, category, name, **attrs):
+        from bushy.trace import span
+        return span(category, name, **attrs)
+
+    def test_not_tracing(self):
+        from bushy.trace import NULL_SPAN
+
+        with self._callFUT('git', 'git status') as span:
+            span.set(status=0)
+
+        self.assertTrue(span is NULL_SPAN)
+
+    def test_tracing(self):
+        from bushy import trace
+        tracer = trace.start()
+
+        with self._callFUT('http', 'GET /stories', method='GET') as span:
+            span.set(status=200)
+
+        self.assertEqual(tracer.spans, [span])
+        self.assertEqual(span.attrs, {'method': 'GET', 'status': 200})
+        self.assertTrue(span.duration >= 0)
+        self.assertTrue(trace.stop() is tracer)
+        self.assertEqual(trace.stop(), None)
+
+    def test_error(self):
+        from bushy import trace
+        tracer = trace.start()
+
+        try:
+            with self._callFUT('git', 'git merge'):
+                raise KeyError('conflict')
+        except KeyError:
+            pass
+
+        self.assertEqual(tracer.spans[0].attrs, {'error': 'KeyError'})
+
+    def test_nesting(self):
+        from bushy import trace
+        from bushy.threads import Future
+        tracer = trace.start()
+
+        with self._callFUT('command', 'Finish') as outer:
+            with self._callFUT('http', 'GET /stories') as inner:
+                pass
+            worker = Future(lambda: self._callFUT('http', 'PUT /stories').__enter__().__exit__(None, None, None))
+            worker.start()
+            worker.result()
+
+        self.assertEqual(inner.parent, outer.id)
+        self.assertEqual(outer.parent, None)
+        other = [span for span in tracer.spans if span.name == 'PUT /stories'][0]
+        # spans on other threads aren't nested under this thread's
+        self.assertEqual(other.parent, None)
+
+    def test_suspend(self):
+        import time
+        from bushy import trace
+        tracer = trace.start()
+
+        def parse():
+            with self._callFUT('parse', 'stories') as parsing:
+                for story in range(2):
+                    parsing.suspend()
+                    try:
+                        yield story
+                    finally:
+                        parsing.resume()
+
+        with self._callFUT('command', 'Feature') as outer:
+            for story in parse():
+                with self._callFUT('http', 'GET /stories/%s' % story) as inner:
+                    time.sleep(0.01)
+
+        parsing = tracer.spans[-2]
+        self.assertEqual(parsing.name, 'stories')
+        self.assertEqual(parsing.parent, outer.id)
+        # the caller's spans aren't nested under the generator's, nor is
+        # their time counted in it
+        self.assertEqual(inner.parent, outer.id)
+        self.assertTrue(parsing.duration < 0.01)
+        self.assertEqual(tracer._local.stack, [])
+
+
+class TestTracer(unittest.TestCase):
+    def _makeOne(self, spans):
+        from bushy.trace import Tracer, Span
+        tracer = Tracer()
+        for id, parent, category, duration in spans:
+            span = Span(tracer, category, '%s %s' % (category, id), {})
+            span.id, span.parent, span.start, span.duration = id, parent, 100.0 + id, duration
+            span.thread = 'MainThread'
+            tracer.spans.append(span)
+        return tracer
+
+    def test_breakdown(self):
+        tracer = self._makeOne([(1, None, 'command', 0.5),
+                                (2, 1, 'http', 0.2),
+                                (3, 1, 'http', 0.1),
+                                (4, 1, 'mirror', 0.15),
+                                (5, 4, 'parse', 0.04)])
+
+        rows = [(category, calls, round(total, 3), round(own, 3))
+                for category, calls, total, own in tracer.breakdown()]
+
+        self.assertEqual(rows, [('http', 2, 0.3, 0.3),
+                                ('mirror', 1, 0.15, 0.11),
+                                ('command', 1, 0.5, 0.05),
+                                ('parse', 1, 0.04, 0.04)])
+
+    def test_report(self):
+        tracer = self._makeOne([(1, None, 'command', 0.5),
+                                (2, 1, 'http', 0.2)])
+
+        lines = tracer.report('Profile of Finish').splitlines()
+
+        self.assertTrue(lines[0].startswith('Profile of Finish ('))
+        self.assertEqual(lines[1].split(), ['phase', 'calls', 'total', 'ms', 'self', 'ms'])
+        self.assertEqual(lines[2].split(), ['command', '1', '500.0', '300.0'])
+        self.assertEqual(lines[3].split(), ['http', '1', '200.0', '200.0'])
+        self.assertEqual(lines[4], 'Slowest')
+        self.assertEqual(lines[5].split(), ['http', '200.0', 'http', '2'])
+
+    def test_export(self):
+        import os
+        import json
+        import shutil
+        import tempfile
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'trace.jsonl')
+        tracer = self._makeOne([(2, 1, 'http', 0.2),
+                                (1, None, 'command', 0.5)])
+        tracer.spans[0].attrs['status'] = 200
+
+        tracer.export(path, command='Finish')
+        tracer.export(path, command='Finish')
+
+        records = [json.loads(line) for line in open(path)]
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[0]['name'], 'command 1')
+        self.assertEqual(records[1], {'trace': records[0]['trace'],
+                                      'command': 'Finish',
+                                      'id': 2,
+                                      'parent': 1,
+                                      'thread': 'MainThread',
+                                      'category': 'http',
+                                      'name': 'http 2',
+                                      'start': 102.0,
+                                      'duration_ms': 200.0,
+                                      'attrs': {'status': 200},
+                                      })
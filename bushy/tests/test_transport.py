@@ -0,0 +1,205 @@
+import unittest
+
+class TestClient(unittest.TestCase):
+    def setUp(self):
+        from bushy.tests.fakeserver import FakeServer
+        self.server = FakeServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _makeOne(self, **kw):
+        from bushy.transport import Client
+        kw.setdefault('backoff', 0)
+        client = Client(**kw)
+        self.addCleanup(client.close)
+        return client
+
+    def test_request(self):
+        self.server.respond(200, '<story/>', {'ETag': '"abc"'})
+        client = self._makeOne()
+
+        resp, content = client.request(self.server.url + '/stories?filter=a%20b', 'PUT',
+                                       headers={'X-TrackerToken': 'token'},
+                                       body='<story/>')
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(resp.error, None)
+        self.assertEqual(resp['status'], '200')
+        self.assertEqual(resp['etag'], '"abc"')
+        self.assertEqual(content, '<story/>')
+        method, path, headers, body = self.server.requests[0]
+        self.assertEqual(method, 'PUT')
+        self.assertEqual(path, '/stories?filter=a%20b')
+        self.assertEqual(headers['x-trackertoken'], 'token')
+        self.assertEqual(body, '<story/>')
+
+    def test_traced(self):
+        from bushy import trace
+        self.server.respond(200, '<story/>')
+        client = self._makeOne()
+        tracer = trace.start()
+        self.addCleanup(trace.stop)
+
+        client.request(self.server.url + '/stories?filter=owned_by%3AMr', 'GET')
+
+        span = tracer.spans[0]
+        self.assertEqual((span.category, span.name), ('http', 'GET /stories'))
+        self.assertEqual(span.attrs, {'status': 200, 'bytes': 8})
+
+    def test_keep_alive(self):
+        client = self._makeOne()
+
+        for i in range(3):
+            client.request(self.server.url + '/stories')
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_keep_alive_post(self):
+        client = self._makeOne()
+
+        client.request(self.server.url + '/stories')
+        client.request(self.server.url + '/notes', 'POST', body='<note/>')
+        client.request(self.server.url + '/stories')
+
+        # the POST wasn't sent on an idle connection which may have been
+        # dropped, but its connection is kept for the next request
+        self.assertEqual(self.server.connections, 2)
+
+    def test_concurrent(self):
+        import threading
+        client = self._makeOne(pool_size=2)
+        self.server.delay = 0.05
+        threads = [threading.Thread(target=client.request, args=(self.server.url,))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertTrue(len(client._pools.values()[0]) <= 2)
+
+    def test_stream(self):
+        self.server.respond(200, 'x' * 10000)
+        client = self._makeOne()
+
+        resp, body = client.stream(self.server.url)
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(body.read(10), 'x' * 10)
+        self.assertEqual(len(body.read()), 9990)
+        body.close()
+        client.request(self.server.url)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stream_closed_early(self):
+        self.server.respond(200, 'x' * 10000)
+        client = self._makeOne()
+
+        resp, body = client.stream(self.server.url)
+        body.read(10)
+        body.close()
+        body.close()
+        resp, content = client.request(self.server.url)
+
+        self.assertEqual(resp.status, 200)
+        # the partly read connection can't be reused
+        self.assertEqual(self.server.connections, 2)
+
+    def test_stream_error(self):
+        self.server.default = (200, {}, '', 0.5)
+        client = self._makeOne(timeout=0.05, retries=0)
+        client.force_exception_to_status_code = True
+
+        resp, body = client.stream(self.server.url)
+
+        self.assertEqual(resp.status, 408)
+        self.assertTrue(body.read())
+        body.close()
+
+    def test_retry(self):
+        self.server.respond(503)
+        self.server.respond(502)
+        self.server.respond(200, 'ok')
+        client = self._makeOne(retries=2)
+
+        resp, content = client.request(self.server.url)
+
+        self.assertEqual(resp.status, 200)
+        self.assertEqual(content, 'ok')
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_retries_exhausted(self):
+        self.server.default = (503, {}, 'busy')
+        client = self._makeOne(retries=1)
+
+        resp, content = client.request(self.server.url)
+
+        self.assertEqual(resp.status, 503)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_no_retry_post(self):
+        self.server.respond(503)
+        client = self._makeOne(retries=2)
+
+        resp, content = client.request(self.server.url, 'POST', body='<note/>')
+
+        self.assertEqual(resp.status, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_timeout(self):
+        from bushy.transport import TransportError
+        self.server.default = (200, {}, '', 0.5)
+        client = self._makeOne(timeout=0.05, retries=0)
+
+        self.assertRaises(TransportError, client.request, self.server.url)
+
+    def test_timeout_status(self):
+        self.server.default = (200, {}, '', 0.5)
+        client = self._makeOne(timeout=0.05, retries=0)
+        client.force_exception_to_status_code = True
+
+        resp, content = client.request(self.server.url)
+
+        self.assertEqual(resp.status, 408)
+        self.assertTrue(resp.error)
+
+    def test_connection_refused(self):
+        client = self._makeOne(retries=0)
+        client.force_exception_to_status_code = True
+        url = self.server.url
+        self.server.stop()
+        self.server.start()
+
+        resp, content = client.request(url)
+
+        self.assertEqual(resp.status, 400)
+        self.assertTrue(resp.error)
+
+
+class TestGetClient(unittest.TestCase):
+    def setUp(self):
+        import bushy.config
+        import bushy.transport
+        self._config = bushy.config._config
+        self._client = bushy.transport._client
+        bushy.config._config = bushy.config.GitConfig({'bushy.http-timeout': '5',
+                                                       'bushy.http-retries': '0'})
+        bushy.transport._client = None
+
+    def tearDown(self):
+        import bushy.config
+        import bushy.transport
+        bushy.config._config = self._config
+        bushy.transport._client = self._client
+
+    def test_shared(self):
+        from bushy.transport import get_client
+        client = get_client()
+
+        self.assertTrue(get_client() is client)
+        self.assertEqual(client.timeout, 5)
+        self.assertEqual(client.retries, 0)
+        self.assertEqual(client.force_exception_to_status_code, True)
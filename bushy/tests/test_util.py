@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestToText(unittest.TestCase):
+    def _callFUT(self, value):
+        from bushy.util import to_text
+        return to_text(value)
+
+    def test_values(self):
+        self.assertEqual(self._callFUT('Caf\xc3\xa9'), u'Caf\xe9')
+        self.assertEqual(self._callFUT(u'Caf\xe9'), u'Caf\xe9')
+        self.assertEqual(self._callFUT('\xff'), u'\ufffd')
+        self.assertEqual(self._callFUT(None), u'')
+        self.assertEqual(self._callFUT(2), u'2')
+
+
+class TestFiles(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmpdir)
+
+    def test_makedirs(self):
+        from bushy.util import makedirs
+        path = os.path.join(self._tmpdir, 'a', 'b')
+
+        makedirs(path)
+        makedirs(path)
+
+        self.assertTrue(os.path.isdir(path))
+
+    def test_dump_json(self):
+        import json
+        from bushy.util import dump_json
+        filename = os.path.join(self._tmpdir, 'bushy', 'data.json')
+
+        dump_json(filename, {'id': 1})
+        dump_json(filename, {'id': 2})
+
+        self.assertEqual(json.load(open(filename)), {'id': 2})
+        # no temporary files are left behind
+        self.assertEqual(os.listdir(os.path.dirname(filename)), ['data.json'])
+
+    def test_lock(self):
+        from bushy.util import lock
+        filename = os.path.join(self._tmpdir, 'bushy', 'lock')
+
+        held = lock(filename)
+        try:
+            # flock is per open file, so a second one waits on the first
+            self.assertEqual(lock(filename, blocking=False), None)
+        finally:
+            held.close()
+
+        again = lock(filename, blocking=False)
+        self.assertNotEqual(again, None)
+        again.close()
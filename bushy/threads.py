@@ -0,0 +1,93 @@
+""" Helpers for overlapping network waits on worker threads.
+"""
+
+import sys
+import threading
+
+__all__ = ['Future',
+           'Pool',
+           'background',
+           ]
+
+DEFAULT_SIZE = 4
+
+
+class Future(threading.Thread):
+    """ Runs ``func`` on its own thread. ``result`` waits for it to finish
+        and returns its value, re-raising anything it raised.
+    """
+
+    def __init__(self, func, args=(), kw=None):
+        super(Future, self).__init__()
+        self.daemon = True
+        self.func = func
+        self.args = args
+        self.kw = kw or {}
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self.func(*self.args, **self.kw)
+        except:
+            self._exc_info = sys.exc_info()
+
+    def result(self):
+        if self.ident is not None:
+            self.join()
+        if self._exc_info is not None:
+            exc_type, exc_value, tb = self._exc_info
+            raise exc_type, exc_value, tb
+        return self._result
+
+
+def background(func, *args, **kw):
+    future = Future(func, args, kw)
+    future.start()
+    return future
+
+
+class Pool(object):
+    """ Runs functions on worker threads, at most ``size`` at once.
+        ``submit`` waits for a free slot before starting another thread, so
+        a long list of work doesn't start a thread per item up front.
+
+        Work shouldn't be submitted from the pool's own workers; if it is,
+        it is run there and then rather than waiting on a slot the worker
+        may itself hold.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+
+    def _call(self, func, args, kw):
+        self._local.worker = True
+        try:
+            return func(*args, **kw)
+        finally:
+            self._slots.release()
+
+    def submit(self, func, *args, **kw):
+        """ Run ``func`` on a worker thread, returning its ``Future``.
+        """
+        if getattr(self._local, 'worker', False):
+            future = Future(func, args, kw)
+            future.run()
+            return future
+        self._slots.acquire()
+        try:
+            future = Future(self._call, (func, args, kw))
+            future.start()
+        except:
+            self._slots.release()
+            raise
+        return future
+
+    def map(self, func, iterable):
+        """ ``func`` applied to each item concurrently, as a list in the
+            order of ``iterable``.
+        """
+        futures = [self.submit(func, item) for item in iterable]
+        return [future.result() for future in futures]
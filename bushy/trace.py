@@ -0,0 +1,212 @@
+""" Timing spans around the slow parts of a command: reading the git
+configuration, running git, tracker requests and parsing their responses.
+
+A ``Tracer`` is started for each command (see ``bushy.scripts.dispatch``)
+and collects a span for each ``with span(category, name):`` block run while
+it is active. ``--profile`` prints a breakdown by category once the command
+has finished, and the ``bushy.trace-file`` setting appends every span to a
+file as JSON lines so timings can be collected from many machines.
+
+With no tracer started ``span`` returns a shared no-op, so the hooks cost
+next to nothing.
+"""
+
+import os
+import time
+import threading
+
+__all__ = ['Tracer',
+           'span',
+           'start',
+           'stop',
+           ]
+
+
+class NullSpan(object):
+
+    def set(self, **attrs):
+        pass
+
+    def suspend(self):
+        pass
+
+    def resume(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+
+    def __init__(self, tracer, category, name, attrs):
+        self.tracer = tracer
+        self.category = category
+        self.name = name
+        self.attrs = attrs
+        self.id = None
+        self.parent = None
+        self.thread = None
+        self.start = None
+        self.duration = None
+
+    def set(self, **attrs):
+        """ Record more about the span, e.g. the status of a response.
+        """
+        self.attrs.update(attrs)
+
+    def suspend(self):
+        """ Pause a span timing a generator while it yields, so the time
+            until it is resumed isn't counted and the caller's spans aren't
+            nested under it.
+        """
+        self._elapsed += time.time() - self._resumed
+        self.tracer._pop(self)
+
+    def resume(self):
+        """ Carry on after ``suspend``, on whichever thread the generator
+            is resumed.
+        """
+        self.tracer._push(self)
+        self._resumed = time.time()
+
+    def __enter__(self):
+        self.tracer._enter(self)
+        self.start = self._resumed = time.time()
+        self._elapsed = 0
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.duration = self._elapsed + time.time() - self._resumed
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.tracer._exit(self)
+        return False
+
+
+class Tracer(object):
+
+    def __init__(self):
+        self.spans = []
+        self.started = time.time()
+        self._ids = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, category, name, **attrs):
+        return Span(self, category, name, attrs)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _enter(self, span):
+        with self._lock:
+            self._ids += 1
+            span.id = self._ids
+        stack = self._stack()
+        if stack:
+            # spans started on pool threads have no parent
+            span.parent = stack[-1].id
+        span.thread = threading.current_thread().name
+        stack.append(span)
+
+    def _push(self, span):
+        self._stack().append(span)
+
+    def _pop(self, span):
+        self._stack().remove(span)
+
+    def _exit(self, span):
+        self._pop(span)
+        self.spans.append(span)
+
+    def breakdown(self):
+        """ ``(category, calls, total, self)`` for each category, slowest
+            first. Self time leaves out the nested spans on the same thread,
+            e.g. the requests made while syncing the mirror.
+        """
+        nested = {}
+        for span in self.spans:
+            if span.parent is not None:
+                nested[span.parent] = nested.get(span.parent, 0) + span.duration
+        categories = {}
+        for span in self.spans:
+            calls, total, own = categories.get(span.category, (0, 0, 0))
+            categories[span.category] = (calls + 1,
+                                         total + span.duration,
+                                         own + span.duration - nested.get(span.id, 0))
+        rows = [(category,) + values for category, values in categories.items()]
+        rows.sort(key=lambda row: -row[3])
+        return rows
+
+    def report(self, title, slowest=5):
+        """ A table of where the time went, followed by the slowest spans.
+        """
+        lines = ['%s (%.1f ms)' % (title, (time.time() - self.started) * 1000),
+                 '  %-10s %6s %10s %10s' % ('phase', 'calls', 'total ms', 'self ms'),
+                 ]
+        for category, calls, total, own in self.breakdown():
+            lines.append('  %-10s %6d %10.1f %10.1f' % (category, calls, total * 1000, own * 1000))
+        spans = [span for span in self.spans if span.category != 'command']
+        spans.sort(key=lambda span: -span.duration)
+        if spans[:slowest]:
+            lines.append('Slowest')
+        for span in spans[:slowest]:
+            lines.append('  %-10s %10.1f  %s' % (span.category, span.duration * 1000, span.name))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, **context):
+        """ Append each span to ``path`` as a line of JSON, along with
+            ``context`` (e.g. the command's name).
+        """
+        import json
+        trace_id = '%x-%x' % (os.getpid(), int(self.started * 1000000))
+        f = open(path, 'a')
+        try:
+            for span in sorted(self.spans, key=lambda span: span.start):
+                record = dict(context)
+                record.update({'trace': trace_id,
+                               'id': span.id,
+                               'parent': span.parent,
+                               'thread': span.thread,
+                               'category': span.category,
+                               'name': span.name,
+                               'start': span.start,
+                               'duration_ms': round(span.duration * 1000, 3),
+                               'attrs': span.attrs,
+                               })
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        finally:
+            f.close()
+
+
+_tracer = None
+
+def start():
+    """ Start collecting spans for this process, returning the tracer.
+    """
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+def stop():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def span(category, name, **attrs):
+    """ A span to time a ``with`` block, or a no-op when nothing is being
+        traced.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(category, name, **attrs)
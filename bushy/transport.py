@@ -0,0 +1,224 @@
+""" A process wide HTTP client with keep-alive connection pooling.
+
+All requests to the tracker share one ``Client`` (see ``get_client``) so
+connections, and their TLS sessions, are reused across calls and threads.
+The interface mirrors ``httplib2.Http.request``: it returns a ``Response``
+(a dict of lower-cased headers with a ``status`` attribute) and the body.
+"""
+
+import time
+import socket
+import httplib
+import threading
+from urlparse import urlsplit
+from cStringIO import StringIO
+from bushy.config import get_config
+from bushy.trace import span
+
+__all__ = ['Client',
+           'Response',
+           'Stream',
+           'TransportError',
+           'get_client',
+           ]
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.5
+DEFAULT_POOL_SIZE = 4
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+RETRY_STATUSES = (502, 503, 504)
+
+
+class TransportError(Exception):
+    pass
+
+
+class Response(dict):
+
+    # why the request failed, for failures reported as a response (see
+    # ``force_exception_to_status_code``)
+    error = None
+
+    def __init__(self, status, reason='', headers=()):
+        super(Response, self).__init__(headers)
+        self.status = status
+        self.reason = reason
+        self['status'] = str(status)
+
+
+class Client(object):
+
+    # as ``httplib2.Http``, report failures as a response rather than raising
+    force_exception_to_status_code = False
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff=DEFAULT_BACKOFF, pool_size=DEFAULT_POOL_SIZE):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def _connection(self, scheme, netloc, reuse=True):
+        """ An idle pooled connection for ``netloc`` if there is one (and
+            ``reuse`` is true), else a new connection. The flag is true for
+            a reused connection.
+        """
+        if reuse:
+            with self._lock:
+                idle = self._pools.get((scheme, netloc))
+                if idle:
+                    return idle.pop(), True
+        if scheme == 'https':
+            return httplib.HTTPSConnection(netloc, timeout=self.timeout), False
+        return httplib.HTTPConnection(netloc, timeout=self.timeout), False
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            idle = self._pools.setdefault((scheme, netloc), [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for idle in pools.values():
+            for conn in idle:
+                conn.close()
+
+    def _send(self, scheme, netloc, path, method, headers, body, stream=False):
+        # a request which isn't safe to send twice goes on a new connection,
+        # as there is no telling whether the server saw it if an idle one
+        # turns out to have been dropped
+        conn, reused = self._connection(scheme, netloc, method in IDEMPOTENT_METHODS)
+        try:
+            conn.request(method, path, body, headers)
+            resp = conn.getresponse()
+            if stream:
+                content = Stream(self, scheme, netloc, conn, resp)
+            else:
+                content = resp.read()
+        except socket.timeout:
+            conn.close()
+            raise
+        except (socket.error, httplib.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            # the server dropped an idle keep-alive connection before
+            # answering, and the request is idempotent, so send it again on
+            # another
+            return self._send(scheme, netloc, path, method, headers, body, stream)
+        if not stream:
+            if resp.will_close:
+                conn.close()
+            else:
+                self._release(scheme, netloc, conn)
+        return Response(resp.status, resp.reason, resp.getheaders()), content
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        return self._request(uri, method, body, headers, False)
+
+    def stream(self, uri, method='GET', body=None, headers=None):
+        """ As ``request`` but the body is returned as a file-like object
+            to be read as it arrives. It must be closed once finished with.
+        """
+        return self._request(uri, method, body, headers, True)
+
+    def _request(self, uri, method, body, headers, stream):
+        # the query is left out of the span's name as it may hold names
+        with span('http', '%s %s' % (method, urlsplit(uri).path)) as requesting:
+            resp, content = self._retry(uri, method, body, headers, stream)
+            requesting.set(status=resp.status)
+            if not stream:
+                requesting.set(bytes=len(content))
+        return resp, content
+
+    def _retry(self, uri, method, body, headers, stream):
+        scheme, netloc, path, query, _ = urlsplit(uri)
+        if query:
+            path = '%s?%s' % (path, query)
+        headers = dict(headers or {})
+        if body is not None:
+            headers.setdefault('Content-Length', str(len(body)))
+        retries = method in IDEMPOTENT_METHODS and self.retries or 0
+
+        attempt = 0
+        while True:
+            try:
+                resp, content = self._send(scheme, netloc, path or '/', method, headers, body, stream)
+            except socket.timeout as e:
+                error, status = e, 408
+            except (socket.error, httplib.HTTPException) as e:
+                error, status = e, 400
+            else:
+                if resp.status not in RETRY_STATUSES or attempt >= retries:
+                    return resp, content
+                if stream:
+                    content.close()
+                error = None
+            if attempt >= retries:
+                break
+            time.sleep(self.backoff * (2 ** attempt))
+            attempt += 1
+
+        if not self.force_exception_to_status_code:
+            raise TransportError('%s %s failed: %s' % (method, uri, error))
+        content = str(error)
+        if stream:
+            content = StringIO(content)
+        resp = Response(status, 'Request Failed')
+        resp.error = str(error)
+        return resp, content
+
+
+class Stream(object):
+    """ The body of a streamed response. Closing it returns the connection
+        to the pool if the body was read to the end, otherwise the
+        connection is dropped.
+    """
+
+    def __init__(self, client, scheme, netloc, conn, resp):
+        self._client = client
+        self._key = (scheme, netloc)
+        self._conn = conn
+        self._resp = resp
+
+    def read(self, size=-1):
+        if self._resp is None:
+            return ''
+        if size is None or size < 0:
+            return self._resp.read()
+        return self._resp.read(size)
+
+    def close(self):
+        if self._resp is None:
+            return
+        resp, conn = self._resp, self._conn
+        self._resp = self._conn = None
+        if resp.isclosed() and not resp.will_close:
+            self._client._release(self._key[0], self._key[1], conn)
+        else:
+            conn.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """ The client shared by everything in this process.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            config = get_config()
+            client = Client(timeout=config.get_int('bushy.http-timeout', DEFAULT_TIMEOUT),
+                            retries=config.get_int('bushy.http-retries', DEFAULT_RETRIES))
+            client.force_exception_to_status_code = True
+            _client = client
+    return _client
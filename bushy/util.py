@@ -0,0 +1,69 @@
+""" Helpers shared by the modules which keep files under ``.git/bushy/``.
+"""
+
+import os
+import json
+import fcntl
+import errno
+import tempfile
+
+__all__ = ['to_text',
+           'makedirs',
+           'dump_json',
+           'lock',
+           ]
+
+
+def to_text(value):
+    """ ``value`` as unicode, decoding byte strings as UTF-8. ``None`` is
+        the empty string.
+    """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if value is None:
+        return u''
+    return unicode(value)
+
+def makedirs(path):
+    """ Create ``path`` and its parents, unless it exists (e.g. another
+        process has just created it).
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+def dump_json(filename, data):
+    """ Write ``data`` to ``filename`` as JSON, through a temporary file
+        renamed over it, so readers never see it half written.
+    """
+    directory = os.path.dirname(filename)
+    makedirs(directory)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    f = os.fdopen(fd, 'w')
+    try:
+        # dumps uses the C encoder, which dump to a file doesn't
+        f.write(json.dumps(data))
+    finally:
+        f.close()
+    os.rename(tmp, filename)
+
+def lock(filename, mode='a', blocking=True):
+    """ Open ``filename`` with an exclusive lock held on it until it is
+        closed. Unless ``blocking``, ``None`` is returned if another
+        process holds the lock.
+    """
+    makedirs(os.path.dirname(filename))
+    f = open(filename, mode)
+    flags = fcntl.LOCK_EX
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(f, flags)
+    except IOError as e:
+        f.close()
+        if not blocking and e.errno in (errno.EAGAIN, errno.EACCES):
+            return None
+        raise
+    return f
@@ -3,7 +3,6 @@ from setuptools import find_packages
 from distutils.core import setup
 
 REQUIRES = [
-    'httplib2',
     'pivotal-py>=0.1.2',
     ]
 
@@ -34,5 +33,10 @@ setup(
 git-feature = bushy.scripts:feature
 git-bug = bushy.scripts:bug
 git-finish = bushy.scripts:finish
+git-bushy = bushy.scripts:bushy
+bushy-daemon = bushy.daemon:main
+
+[bushy.platforms]
+pivotal = bushy._pivotal
 ''',
     )